@@ -1,3 +1,18 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import EnrollJob, RerunQueueItem
+
+
+class RerunQueueItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'source_course_key', 'course_key', 'state', 'user', 'created', 'started', 'finished')
+    list_filter = ('state',)
+    search_fields = ('source_course_key', 'course_key')
+
+admin.site.register(RerunQueueItem, RerunQueueItemAdmin)
+
+class EnrollJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'job_id', 'user', 'mode', 'state', 'rows', 'errors', 'created', 'finished')
+    list_filter = ('state',)
+    search_fields = ('job_id',)
+
+admin.site.register(EnrollJob, EnrollJobAdmin)
@@ -31,3 +31,6 @@ class NorteamericanoAPIConfig(AppConfig):
                     PluginSettings.RELATIVE_PATH: "settings.common"}},
         },
     }
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.utils import timezone
+from oauth2_provider.models import get_access_token_model
+from openedx.core.lib.api.authentication import BearerAuthentication
+from .cache import get_shared_cache
+
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_TIMEOUT = 300
+# the token is not served from the cache in the last seconds before it expires
+TOKEN_EXPIRATION_MARGIN = 30
+TOKEN_KEY = 'norteamericanoapi.bearer_token.{}'
+
+def token_cache_key(access_token):
+    return TOKEN_KEY.format(hashlib.sha256(access_token.encode('utf-8')).hexdigest())
+
+def invalidate_access_token(access_token):
+    """
+        Discard the cached token, called when the token is deleted or changed
+    """
+    get_shared_cache().delete(token_cache_key(access_token))
+
+def invalidate_user_tokens(user_ids):
+    """
+        Discard the cached tokens of the users, called when a user is changed
+        (e.g. deactivated) or its permissions or groups change
+    """
+    tokens = get_access_token_model().objects.filter(user_id__in=list(user_ids)).values_list('token', flat=True)
+    get_shared_cache().delete_many([token_cache_key(token) for token in tokens])
+
+class CachedBearerAuthentication(BearerAuthentication):
+    """
+        BearerAuthentication that remembers the validated tokens with their
+        user and permissions in the shared cache, until shortly before the
+        token expires or for NORTEAMERICANO_TOKEN_CACHE_TIMEOUT seconds
+    """
+
+    def authenticate_credentials(self, access_token):
+        shared_cache = get_shared_cache()
+        cache_key = token_cache_key(access_token)
+        cached = shared_cache.get(cache_key)
+        if cached is not None:
+            user, token = cached
+            if (token.expires - timezone.now()).total_seconds() > TOKEN_EXPIRATION_MARGIN:
+                return user, token
+        user, token = super(CachedBearerAuthentication, self).authenticate_credentials(access_token)
+        timeout = min(
+            getattr(settings, 'NORTEAMERICANO_TOKEN_CACHE_TIMEOUT', TOKEN_CACHE_TIMEOUT),
+            int((token.expires - timezone.now()).total_seconds()) - TOKEN_EXPIRATION_MARGIN)
+        if timeout > 0:
+            # load the permissions of the user, they are kept in the cached user
+            user.get_all_permissions()
+            shared_cache.set(cache_key, (user, token), timeout)
+        return user, token
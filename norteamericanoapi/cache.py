@@ -0,0 +1,185 @@
+from django.conf import settings
+from django.core.cache import caches, InvalidCacheBackendError
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from edx_django_utils.cache import RequestCache
+
+import hashlib
+import logging
+import math
+import time
+logger = logging.getLogger(__name__)
+
+RERUN_STATUS_CACHE_TIMEOUT = 5
+RERUN_STATUS_VERSION_KEY = 'norteamericanoapi.rerun_status.version'
+RERUN_STATUS_KEY = 'norteamericanoapi.rerun_status.{}.{}'
+COURSE_CACHE_TIMEOUT = 300
+# a missing course can be created by another worker, it is cached briefly
+COURSE_MISSING_CACHE_TIMEOUT = 5
+COURSE_EXISTS_KEY = 'norteamericanoapi.course_exists.{}'
+PENDING_COURSE_EXISTS_KEY = 'norteamericanoapi.pending_course_exists.{}'
+NA_RUT_CACHE_TIMEOUT = 3600
+NA_RUT_KEY = 'norteamericanoapi.na_rut.{}'
+NA_RUT_CACHE_NAMESPACE = 'norteamericanoapi.na_ruts'
+
+# used when the cache of NORTEAMERICANO_CACHE is not configured
+local_cache = LocMemCache('norteamericanoapi', {})
+
+def get_shared_cache():
+    """
+        Return the cache shared by the workers, the cache alias is
+        NORTEAMERICANO_CACHE (default) with a local memory fallback
+    """
+    try:
+        return caches[getattr(settings, 'NORTEAMERICANO_CACHE', 'default')]
+    except InvalidCacheBackendError:
+        return local_cache
+
+def bump_rerun_status_version():
+    """
+        Change the version of the rerun status, called when a rerun or
+        an item of the rerun queue changes
+    """
+    version = '{:.6f}'.format(time.time())
+    get_shared_cache().set(RERUN_STATUS_VERSION_KEY, version, None)
+    return version
+
+def get_rerun_status_version():
+    """
+        Return the version of the rerun status, it is the time of the last change
+    """
+    version = get_shared_cache().get(RERUN_STATUS_VERSION_KEY)
+    if version is None:
+        version = bump_rerun_status_version()
+    return version
+
+def rerun_status_etag(version, key):
+    return quote_etag(hashlib.md5('{}.{}'.format(version, key).encode('utf-8')).hexdigest())
+
+def rerun_status_not_modified(request, version, key):
+    """
+        Return a 304 response if the client already has the status of this version, else None,
+        only the ETag is checked because Last-Modified has a resolution of one second
+    """
+    return get_conditional_response(request, etag=rerun_status_etag(version, key))
+
+def set_rerun_status_headers(response, version, key):
+    response['ETag'] = rerun_status_etag(version, key)
+    response['Last-Modified'] = http_date(math.ceil(float(version)))
+    return response
+
+def rerun_status_cache_key(version, key):
+    return RERUN_STATUS_KEY.format(version, hashlib.md5(key.encode('utf-8')).hexdigest())
+
+def get_rerun_status(version, key):
+    """
+        Return the cached status payload of the key in this version, None if it expired
+    """
+    return get_shared_cache().get(rerun_status_cache_key(version, key))
+
+def get_cached_rerun_status(version, key, get_status):
+    """
+        Return the status payload of the key, it is shared between the
+        workers for NORTEAMERICANO_RERUN_STATUS_CACHE_TIMEOUT seconds
+        and discarded when the version changes
+    """
+    shared_cache = get_shared_cache()
+    cache_key = rerun_status_cache_key(version, key)
+    status = shared_cache.get(cache_key)
+    if status is None:
+        status = get_status()
+        timeout = getattr(settings, 'NORTEAMERICANO_RERUN_STATUS_CACHE_TIMEOUT', RERUN_STATUS_CACHE_TIMEOUT)
+        shared_cache.set(cache_key, status, timeout)
+    return status
+
+def course_cache_key(key_format, course_key):
+    return key_format.format(hashlib.md5(str(course_key).encode('utf-8')).hexdigest())
+
+def get_cached_exists(key_format, course_key, exists):
+    """
+        Return if the course exists, exists() is only called on a cache miss,
+        the missing courses are cached only a few seconds
+    """
+    shared_cache = get_shared_cache()
+    cache_key = course_cache_key(key_format, course_key)
+    value = shared_cache.get(cache_key)
+    if value is None:
+        value = exists()
+        if value:
+            timeout = getattr(settings, 'NORTEAMERICANO_COURSE_CACHE_TIMEOUT', COURSE_CACHE_TIMEOUT)
+        else:
+            timeout = getattr(settings, 'NORTEAMERICANO_COURSE_MISSING_CACHE_TIMEOUT', COURSE_MISSING_CACHE_TIMEOUT)
+        shared_cache.set(cache_key, value, timeout)
+    return value
+
+def course_exists(course_key, exists):
+    return get_cached_exists(COURSE_EXISTS_KEY, course_key, exists)
+
+def pending_course_exists(course_key, exists):
+    return get_cached_exists(PENDING_COURSE_EXISTS_KEY, course_key, exists)
+
+def invalidate_course_exists(course_key):
+    """
+        Discard the cached existence of the course and of its pending rerun,
+        called when the course is published or deleted and when a rerun changes
+    """
+    get_shared_cache().delete_many([
+        course_cache_key(COURSE_EXISTS_KEY, course_key),
+        course_cache_key(PENDING_COURSE_EXISTS_KEY, course_key)])
+
+def na_rut_cache_key(rut):
+    return NA_RUT_KEY.format(hashlib.md5(rut.encode('utf-8')).hexdigest())
+
+def get_na_rut_timeout():
+    return getattr(settings, 'NORTEAMERICANO_NA_RUT_CACHE_TIMEOUT', NA_RUT_CACHE_TIMEOUT)
+
+def get_cached_na_ruts(ruts, load):
+    """
+        Return a dict rut -> (NAExtraInfo id, user id, username) of the
+        registered ruts. The ruts are looked up in the cache of the request,
+        then in the shared cache and the rest with load(ruts).
+        Only the registered ruts are cached.
+    """
+    request_cache = RequestCache(NA_RUT_CACHE_NAMESPACE)
+    na_ruts = {}
+    missing = []
+    for rut in set(ruts):
+        cached = request_cache.get_cached_response(rut)
+        if cached.is_found:
+            na_ruts[rut] = cached.value
+        else:
+            missing.append(rut)
+    if missing:
+        shared_cache = get_shared_cache()
+        found = shared_cache.get_many([na_rut_cache_key(rut) for rut in missing])
+        for rut in missing:
+            value = found.get(na_rut_cache_key(rut))
+            if value is not None:
+                na_ruts[rut] = tuple(value)
+                request_cache.set(rut, tuple(value))
+        not_cached = [rut for rut in missing if rut not in na_ruts]
+        if not_cached:
+            loaded = load(not_cached)
+            for rut, value in loaded.items():
+                request_cache.set(rut, value)
+            set_cached_na_ruts(loaded)
+            na_ruts.update(loaded)
+    return na_ruts
+
+def set_cached_na_ruts(na_ruts):
+    """
+        Save the dict rut -> (NAExtraInfo id, user id, username) in the shared cache
+    """
+    get_shared_cache().set_many({na_rut_cache_key(rut): value for rut, value in na_ruts.items()}, get_na_rut_timeout())
+
+def invalidate_na_ruts(ruts):
+    """
+        Discard the cached users of the ruts, called when a NAExtraInfo
+        (or the username of its user) changes
+    """
+    ruts = [rut for rut in ruts if rut]
+    if not ruts:
+        return
+    RequestCache(NA_RUT_CACHE_NAMESPACE).clear()
+    get_shared_cache().delete_many([na_rut_cache_key(rut) for rut in ruts])
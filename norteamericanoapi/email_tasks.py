@@ -3,7 +3,7 @@ from openedx.core.djangoapps.site_configuration import helpers as configuration_
 from django.conf import settings
 
 from celery import task
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.utils.html import strip_tags
 
 from django.template.loader import render_to_string
@@ -13,17 +13,27 @@ logger = logging.getLogger(__name__)
 
 EMAIL_DEFAULT_RETRY_DELAY = 30
 EMAIL_MAX_RETRIES = 5
+EMAIL_BATCH_SIZE = 100
 
-@task(
-    queue='edx.lms.core.low',
-    default_retry_delay=EMAIL_DEFAULT_RETRY_DELAY,
-    max_retries=EMAIL_MAX_RETRIES)
-def enroll_email(data, login_url):
+def get_email_batch_size():
+    return getattr(settings, 'NORTEAMERICANO_EMAIL_BATCH_SIZE', EMAIL_BATCH_SIZE)
+
+def get_email_site_values():
     """
-        Send mail to specific user
+        Return the platform name and the from address of the emails
     """
     platform_name = configuration_helpers.get_value(
             'PLATFORM_NAME', settings.PLATFORM_NAME)
+    from_email = configuration_helpers.get_value(
+        'email_from_address',
+        settings.BULK_EMAIL_DEFAULT_FROM_EMAIL
+    )
+    return platform_name, from_email
+
+def build_enroll_email(data, login_url, platform_name, from_email, connection=None):
+    """
+        Render the enroll email of the user
+    """
     subject = 'Inscripción en el curso: {}'.format(data['course_name'])
     context = {
         "course_name": data['course_name'],
@@ -38,15 +48,68 @@ def enroll_email(data, login_url):
     else:
         html_message = render_to_string('na_emails/normal_email.txt', context)
     plain_message = strip_tags(html_message)
-    from_email = configuration_helpers.get_value(
-        'email_from_address',
-        settings.BULK_EMAIL_DEFAULT_FROM_EMAIL
-    )
-    mail = send_mail(
+    mail = EmailMultiAlternatives(
         subject,
         plain_message,
         from_email,
         [data['email']],
-        fail_silently=False,
-        html_message=html_message)
-    return mail
\ No newline at end of file
+        connection=connection)
+    mail.attach_alternative(html_message, 'text/html')
+    return mail
+
+@task(
+    queue='edx.lms.core.low',
+    default_retry_delay=EMAIL_DEFAULT_RETRY_DELAY,
+    max_retries=EMAIL_MAX_RETRIES)
+def enroll_email(data, login_url):
+    """
+        Send mail to specific user
+    """
+    platform_name, from_email = get_email_site_values()
+    mail = build_enroll_email(data, login_url, platform_name, from_email)
+    return mail.send(fail_silently=False)
+
+@task(
+    bind=True,
+    queue='edx.lms.core.low',
+    default_retry_delay=EMAIL_DEFAULT_RETRY_DELAY,
+    max_retries=EMAIL_MAX_RETRIES)
+def enroll_emails(self, data_list, login_url):
+    """
+        Send the enroll mails of a batch of users over one connection.
+        Return the sent emails and the emails that failed.
+    """
+    platform_name, from_email = get_email_site_values()
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error("NorteamericanoEnrollEmails - Error opening the connection: {}".format(str(e)))
+        raise self.retry(exc=e)
+    result = {'sent': [], 'failed': []}
+    try:
+        for data in data_list:
+            try:
+                mail = build_enroll_email(data, login_url, platform_name, from_email, connection=connection)
+                connection.send_messages([mail])
+                result['sent'].append(data['email'])
+            except Exception as e:
+                logger.error("NorteamericanoEnrollEmails - Error sending the email to {}: {}".format(data['email'], str(e)))
+                result['failed'].append(data['email'])
+                # The connection can be left unusable after an error, reopen it for the next recipients
+                try:
+                    connection.close()
+                    connection.open()
+                except Exception as e:
+                    logger.error("NorteamericanoEnrollEmails - Error reopening the connection: {}".format(str(e)))
+    finally:
+        connection.close()
+    return result
+
+def send_enroll_emails(emails_data, login_url):
+    """
+        Queue the enroll mails in batches of NORTEAMERICANO_EMAIL_BATCH_SIZE
+    """
+    batch_size = get_email_batch_size()
+    for i in range(0, len(emails_data), batch_size):
+        enroll_emails.delay(emails_data[i:i + batch_size], login_url)
@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from celery import task
+
+from .email_tasks import send_enroll_emails
+from .models import EnrollJob
+from .utils import file_to_csvreader, stream_enroll_csv
+import datetime
+import logging
+import uuid
+import tempfile
+logger = logging.getLogger(__name__)
+
+ENROLL_JOB_TIMEOUT = 7 * 24 * 60 * 60
+ENROLL_JOB_PATH = 'norteamericanoapi/enroll/{}/{}'
+
+def get_enroll_job_timeout():
+    return getattr(settings, 'NORTEAMERICANO_ENROLL_JOB_TIMEOUT', ENROLL_JOB_TIMEOUT)
+
+def create_enroll_job(user, csvfile, mode):
+    """
+        Store the uploaded file and create the enroll job,
+        the expired jobs are removed in background
+    """
+    job_id = uuid.uuid4().hex
+    upload_file = default_storage.save(ENROLL_JOB_PATH.format(job_id, 'upload.csv'), csvfile)
+    EnrollJob.objects.create(job_id=job_id, user=user, mode=mode, upload_file=upload_file)
+    cleanup_enroll_jobs.delay()
+    return job_id
+
+def get_enroll_job(job_id):
+    """
+        Return the EnrollJob, None if it does not exists or it is expired
+    """
+    expired = timezone.now() - datetime.timedelta(seconds=get_enroll_job_timeout())
+    return EnrollJob.objects.filter(job_id=job_id, created__gt=expired).first()
+
+def update_enroll_job(job_id, **kwargs):
+    kwargs['updated'] = timezone.now()
+    EnrollJob.objects.filter(job_id=job_id).update(**kwargs)
+
+def get_enroll_job_status(job):
+    """
+        Return the progress of the job: processed rows, rows with errors and throughput
+    """
+    rows_per_second = 0
+    if job.started and job.updated and job.updated > job.started:
+        rows_per_second = round(job.rows / (job.updated - job.started).total_seconds(), 2)
+    return {
+        'job_id': job.job_id,
+        'state': job.state,
+        'rows': job.rows,
+        'errors': job.errors,
+        'rows_per_second': rows_per_second,
+    }
+
+def delete_enroll_job_files(job):
+    for path in (job.upload_file, job.result_file):
+        if path and default_storage.exists(path):
+            default_storage.delete(path)
+
+@task(queue='edx.lms.core.low')
+def enroll_csv_task(job_id, login_url):
+    """
+        Process the enroll CSV of the job and store the result CSV,
+        the job is deleted with its files when it expires
+    """
+    job = EnrollJob.objects.filter(job_id=job_id).first()
+    if job is None:
+        logger.error("NorteamericanoEnrollTask - Job does not exists: {}".format(job_id))
+        return None
+    update_enroll_job(job_id, state=EnrollJob.PROCESSING, started=timezone.now())
+    def progress(rows, errors):
+        update_enroll_job(job_id, rows=rows, errors=errors)
+    def send_emails(emails_data):
+        send_enroll_emails(emails_data, login_url)
+    try:
+        with default_storage.open(job.upload_file, 'rb') as csvfile, tempfile.TemporaryFile() as output:
+            csv_reader = file_to_csvreader(csvfile)
+            for line in stream_enroll_csv(csv_reader, job.mode, emails_callback=send_emails, progress=progress):
+                output.write(line.encode('utf-8'))
+            output.seek(0)
+            result_file = default_storage.save(
+                ENROLL_JOB_PATH.format(job_id, 'enroll_resumen.csv'),
+                File(output))
+        update_enroll_job(job_id, state=EnrollJob.SUCCESS, result_file=result_file, finished=timezone.now())
+    except Exception:
+        logger.exception("NorteamericanoEnrollTask - Error processing the job: {}".format(job_id))
+        update_enroll_job(job_id, state=EnrollJob.ERROR, finished=timezone.now())
+    finally:
+        default_storage.delete(job.upload_file)
+        update_enroll_job(job_id, upload_file='')
+    # the job was created at job.created, it expires get_enroll_job_timeout() seconds later
+    countdown = get_enroll_job_timeout() - (timezone.now() - job.created).total_seconds()
+    delete_enroll_job.apply_async(args=(job_id,), countdown=max(0, int(countdown)))
+    return job_id
+
+@task(queue='edx.lms.core.low')
+def delete_enroll_job(job_id):
+    """
+        Delete the job and its files
+    """
+    job = EnrollJob.objects.filter(job_id=job_id).first()
+    if job is None:
+        return None
+    delete_enroll_job_files(job)
+    job.delete()
+    return job_id
+
+@task(queue='edx.lms.core.low')
+def cleanup_enroll_jobs():
+    """
+        Delete the expired jobs and their files, in case the scheduled
+        delete_enroll_job was lost
+    """
+    expired = timezone.now() - datetime.timedelta(seconds=get_enroll_job_timeout())
+    deleted = 0
+    for job in EnrollJob.objects.filter(created__lte=expired):
+        try:
+            delete_enroll_job_files(job)
+        except Exception:
+            logger.exception("NorteamericanoEnrollTask - Error deleting the files of the job: {}".format(job.job_id))
+            continue
+        job.delete()
+        deleted += 1
+    return deleted
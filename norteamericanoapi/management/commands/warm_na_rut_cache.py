@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from norteamericanoapi.cache import set_cached_na_ruts
+from norteamericanoapi.utils import PRELOAD_BATCH_SIZE, HAVE_NA_MODEL
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Load the rut -> user of every NAExtraInfo in the shared cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PRELOAD_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if not HAVE_NA_MODEL:
+            raise CommandError('Model is not installed')
+        from norteamericano_form.models import NAExtraInfo
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            rows = list(NAExtraInfo.objects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'na_rut', 'user_id', 'user__username')[:batch_size])
+            if not rows:
+                break
+            set_cached_na_ruts({na_rut: (na_id, user_id, username) for na_id, na_rut, user_id, username in rows})
+            last_id = rows[-1][0]
+            total += len(rows)
+        logger.info('NorteamericanoWarmNaRutCache - {} ruts loaded'.format(total))
+        self.stdout.write('{} ruts loaded'.format(total))
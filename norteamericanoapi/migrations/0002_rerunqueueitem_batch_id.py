@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('norteamericanoapi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rerunqueueitem',
+            name='batch_id',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+    ]
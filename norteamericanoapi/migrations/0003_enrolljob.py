@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('norteamericanoapi', '0002_rerunqueueitem_batch_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrollJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(max_length=32, unique=True)),
+                ('mode', models.CharField(max_length=16)),
+                ('state', models.CharField(choices=[('pending', 'pending'), ('processing', 'processing'), ('success', 'success'), ('error', 'error')], db_index=True, default='pending', max_length=16)),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('upload_file', models.CharField(blank=True, max_length=255)),
+                ('result_file', models.CharField(blank=True, max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('updated', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+
+from django.contrib.auth.models import User
+from django.db import models
+from opaque_keys.edx.django.models import CourseKeyField
+
+
+class RerunQueueItem(models.Model):
+    """
+        Rerun request waiting for a free slot of the rerun scheduler,
+        once started its progress is in CourseRerunState
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATE_CHOICES = (
+        (PENDING, PENDING),
+        (RUNNING, RUNNING),
+        (SUCCEEDED, SUCCEEDED),
+        (FAILED, FAILED),
+    )
+
+    source_course_key = CourseKeyField(max_length=255, db_index=True)
+    course_key = CourseKeyField(max_length=255, db_index=True)
+    display_name = models.CharField(max_length=255, blank=True)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    batch_id = models.CharField(max_length=32, blank=True, db_index=True)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=PENDING, db_index=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return '{} -> {} ({})'.format(self.source_course_key, self.course_key, self.state)
+
+
+class EnrollJob(models.Model):
+    """
+        Asynchronous enroll of a CSV file, the uploaded file and the result
+        CSV are in the default storage and removed once the job expires
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    SUCCESS = 'success'
+    ERROR = 'error'
+    STATE_CHOICES = (
+        (PENDING, PENDING),
+        (PROCESSING, PROCESSING),
+        (SUCCESS, SUCCESS),
+        (ERROR, ERROR),
+    )
+
+    job_id = models.CharField(max_length=32, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    mode = models.CharField(max_length=16)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=PENDING, db_index=True)
+    rows = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    upload_file = models.CharField(max_length=255, blank=True)
+    result_file = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    started = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return '{} ({})'.format(self.job_id, self.state)
@@ -0,0 +1,213 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from opaque_keys.edx.locator import CourseLocator
+
+from celery import task
+
+from .cache import bump_rerun_status_version
+from .models import RerunQueueItem
+from collections import Counter
+import logging
+import threading
+logger = logging.getLogger(__name__)
+
+RERUN_MAX_RUNNING = 2
+RERUN_MAX_RUNNING_PER_SOURCE = 1
+RERUN_MAX_RUNTIME = 6 * 60 * 60
+QUEUE_BATCH_SIZE = 500
+
+# state of the scheduler in this thread, with celery in eager mode the
+# reruns finish inside schedule_reruns and it must not be reentered
+_scheduler = threading.local()
+
+def rerun_course_key(course_key):
+    """
+        Return the key of the new course that rerun_course creates in split
+    """
+    return CourseLocator(course_key.org, course_key.course, course_key.run)
+
+def enqueue_rerun(user, source_course_key, new_course_key, display_name, start, end, batch_id=''):
+    """
+        Add the rerun to the queue. Call schedule_reruns to start it.
+    """
+    return RerunQueueItem.objects.create(
+        source_course_key=source_course_key,
+        course_key=rerun_course_key(new_course_key),
+        display_name=display_name,
+        start=start,
+        end=end,
+        user=user,
+        batch_id=batch_id)
+
+def is_rerun_queued(course_key):
+    """
+        Verify if the new course is pending or running in the queue
+    """
+    return RerunQueueItem.objects.filter(
+        course_key=rerun_course_key(course_key),
+        state__in=[RerunQueueItem.PENDING, RerunQueueItem.RUNNING]).exists()
+
+def get_queued_course_keys(course_keys):
+    """
+        Return the set of the new courses that are pending or running in the queue
+    """
+    queued = set()
+    course_keys = list(set(rerun_course_key(x) for x in course_keys))
+    for i in range(0, len(course_keys), QUEUE_BATCH_SIZE):
+        queued.update(RerunQueueItem.objects.filter(
+            course_key__in=course_keys[i:i + QUEUE_BATCH_SIZE],
+            state__in=[RerunQueueItem.PENDING, RerunQueueItem.RUNNING]).values_list('course_key', flat=True))
+    return queued
+
+def get_queue_positions():
+    """
+        Return a dict id -> position (from 1) of the pending reruns
+    """
+    pending = RerunQueueItem.objects.filter(state=RerunQueueItem.PENDING).order_by('id').values_list('id', flat=True)
+    return {item_id: position for position, item_id in enumerate(pending, 1)}
+
+def get_queued_reruns():
+    """
+        Return the pending reruns in order with their position
+    """
+    items = list(RerunQueueItem.objects.filter(state=RerunQueueItem.PENDING).order_by('id'))
+    for position, item in enumerate(items, 1):
+        item.position = position
+    return items
+
+def get_rerun_status(items):
+    """
+        Return a dict id -> status of the reruns for the result of the CSV and the api
+    """
+    positions = get_queue_positions()
+    states = dict(RerunQueueItem.objects.filter(id__in=[x.id for x in items]).values_list('id', 'state'))
+    status = {}
+    for item in items:
+        item.state = states.get(item.id, item.state)
+        item.position = positions.get(item.id)
+        if item.state == RerunQueueItem.PENDING:
+            status[item.id] = 'En cola, posicion {}'.format(item.position)
+        elif item.state == RerunQueueItem.FAILED:
+            status[item.id] = 'Error en relanzar el curso'
+        else:
+            status[item.id] = 'Procesandose'
+    return status
+
+@task(queue='edx.cms.core.low')
+def schedule_reruns():
+    """
+        Start the pending reruns while there are free slots
+    """
+    if getattr(_scheduler, 'active', False):
+        _scheduler.rescan = True
+        return
+    _scheduler.active = True
+    _scheduler.rescan = True
+    try:
+        while _scheduler.rescan:
+            _scheduler.rescan = False
+            for item in reserve_reruns():
+                if not start_rerun(item):
+                    _scheduler.rescan = True
+    finally:
+        _scheduler.active = False
+
+def reserve_reruns():
+    """
+        Mark as running, in order, the pending reruns that fit in the limits:
+        NORTEAMERICANO_RERUN_MAX_RUNNING reruns in total and
+        NORTEAMERICANO_RERUN_MAX_RUNNING_PER_SOURCE by source course.
+        Return the reserved reruns.
+    """
+    max_running = getattr(settings, 'NORTEAMERICANO_RERUN_MAX_RUNNING', RERUN_MAX_RUNNING)
+    max_per_source = getattr(settings, 'NORTEAMERICANO_RERUN_MAX_RUNNING_PER_SOURCE', RERUN_MAX_RUNNING_PER_SOURCE)
+    reserved = []
+    with transaction.atomic():
+        items = list(RerunQueueItem.objects.select_for_update().filter(
+            state__in=[RerunQueueItem.PENDING, RerunQueueItem.RUNNING]).order_by('id'))
+        running = sync_running_reruns([x for x in items if x.state == RerunQueueItem.RUNNING])
+        by_source = Counter(str(x.source_course_key) for x in running)
+        for item in items:
+            if len(running) + len(reserved) >= max_running:
+                break
+            source = str(item.source_course_key)
+            if item.state != RerunQueueItem.PENDING or by_source[source] >= max_per_source:
+                continue
+            item.state = RerunQueueItem.RUNNING
+            item.started = timezone.now()
+            item.save(update_fields=['state', 'started'])
+            by_source[source] += 1
+            reserved.append(item)
+    return reserved
+
+def sync_running_reruns(running):
+    """
+        Finish the running reruns whose CourseRerunState already finished,
+        in case the signal was lost, and fail the reruns running for more than
+        NORTEAMERICANO_RERUN_MAX_RUNTIME seconds so they free their slot.
+        Return the reruns still running.
+    """
+    from common.djangoapps.course_action_state.models import CourseRerunState
+    from common.djangoapps.course_action_state.managers import CourseRerunUIStateManager
+    finished_states = [CourseRerunUIStateManager.State.SUCCEEDED, CourseRerunUIStateManager.State.FAILED]
+    if not running:
+        return []
+    states = {
+        str(x.course_key): x for x in CourseRerunState.objects.filter(
+            course_key__in=[item.course_key for item in running],
+            state__in=finished_states)
+    }
+    max_runtime = getattr(settings, 'NORTEAMERICANO_RERUN_MAX_RUNTIME', RERUN_MAX_RUNTIME)
+    now = timezone.now()
+    still_running = []
+    for item in running:
+        state = states.get(str(item.course_key))
+        if state is not None and item.started is not None and state.updated_time >= item.started:
+            item.state = RerunQueueItem.SUCCEEDED if state.state == CourseRerunUIStateManager.State.SUCCEEDED else RerunQueueItem.FAILED
+            item.finished = now
+            item.save(update_fields=['state', 'finished'])
+        elif item.started is not None and (now - item.started).total_seconds() > max_runtime:
+            logger.error('NorteamericanoReRunQueue - Rerun timed out, course: {}, started: {}'.format(item.course_key, item.started))
+            item.state = RerunQueueItem.FAILED
+            item.error = 'El curso no termino de procesarse en {} segundos'.format(max_runtime)
+            item.finished = now
+            item.save(update_fields=['state', 'error', 'finished'])
+        else:
+            still_running.append(item)
+    return still_running
+
+def start_rerun(item):
+    """
+        Start the clone of the course, return False if it could not be started
+    """
+    from cms.djangoapps.contentstore.views.course import rerun_course
+    org = item.course_key.org
+    number = item.course_key.course
+    run = item.course_key.run
+    fields = {'start': item.start, 'end': item.end}
+    if item.display_name:
+        fields['display_name'] = item.display_name
+    fields['wiki_slug'] = u"{0}.{1}.{2}".format(org, number, run)
+    try:
+        rerun_course(item.user, item.source_course_key, org, number, run, fields)
+    except Exception as e:
+        logger.error('NorteamericanoReRunQueue - Error in rerun_course(): {}'.format(str(e)))
+        RerunQueueItem.objects.filter(id=item.id).update(
+            state=RerunQueueItem.FAILED,
+            error=str(e),
+            finished=timezone.now())
+        bump_rerun_status_version()
+        return False
+    return True
+
+def finish_rerun(course_key, succeeded):
+    """
+        Finish the running rerun of the course and start the next ones
+    """
+    updated = RerunQueueItem.objects.filter(course_key=course_key, state=RerunQueueItem.RUNNING).update(
+        state=RerunQueueItem.SUCCEEDED if succeeded else RerunQueueItem.FAILED,
+        finished=timezone.now())
+    if updated:
+        bump_rerun_status_version()
+        schedule_reruns.delay()
@@ -6,20 +6,30 @@ from django.core.exceptions import ValidationError
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import User
 from django.db import transaction
+from django.db.models import Q
+from django.utils.decorators import method_decorator
 from rest_framework.response import Response
+from rest_framework.pagination import CursorPagination
 from rest_framework.views import APIView
 from .views import NorteamericanoEnroll
-from .serializers import EnrollSerializer, UnEnrollSerializer, ReRunPendingCourseSerializer, ReRunSerializer, CourseStaffEnrollSerializer, CourseDataSerializer
-from .email_tasks import enroll_email
-from .utils import create_user_by_data, create_na_user, enroll_course_user, get_course_by_id, add_role_course_staff, remove_role_course_staff, set_data_course
+from .serializers import EnrollSerializer, EnrollBulkSerializer, UnEnrollSerializer, UnEnrollBulkSerializer, ReRunPendingCourseSerializer, ReRunEventsSerializer, ReRunSerializer, ReRunBulkSerializer, CourseStaffEnrollSerializer, CourseStaffEnrollBulkSerializer, CourseDataSerializer, CourseDataBulkSerializer
+from .email_tasks import enroll_email, send_enroll_emails
+from .utils import create_user_by_data, create_na_user, enroll_course_user, get_course_by_id, add_role_course_staff, remove_role_course_staff, set_data_course, resolve_courses, enroll_chunks, unenroll_users, course_staff_users, get_na_users, get_na_user_ids, clean_rut, normalize_rut, validarRutAllType, validate_rerun_rows, set_courses_dates
 from common.djangoapps.course_action_state.models import CourseRerunState, CourseRerunUIStateManager
-from openedx.core.lib.api.authentication import BearerAuthentication
+from .models import RerunQueueItem
+from .cache import get_rerun_status_version, rerun_status_not_modified, set_rerun_status_headers, get_cached_rerun_status, get_rerun_status
+from .rerun_tasks import enqueue_rerun, schedule_reruns, get_rerun_status, get_queued_reruns, get_queue_positions
+from .authentication import CachedBearerAuthentication
+from .throttling import TokenBucketThrottle
 from datetime import datetime as dt
 from rest_framework import permissions
 from rest_framework import status
 from opaque_keys.edx.keys import CourseKey
 from opaque_keys import InvalidKeyError
 import logging
+import uuid
+import json
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -29,9 +39,27 @@ try:
 except ImportError:
     HAVE_NA_MODEL = False
 
+RERUN_EVENTS_TIMEOUT = 5
+RERUN_EVENTS_INTERVAL = 0.5
+PENDING_COURSES_PAGE_SIZE = 50
+PENDING_COURSES_MAX_PAGE_SIZE = 500
+
+class PendingCoursesPagination(CursorPagination):
+    page_size = PENDING_COURSES_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = PENDING_COURSES_MAX_PAGE_SIZE
+    ordering = '-id'
+
+    def get_page_size(self, request):
+        # read by request, so NORTEAMERICANO_PENDING_COURSES_PAGE_SIZE can change after the import
+        self.page_size = getattr(settings, 'NORTEAMERICANO_PENDING_COURSES_PAGE_SIZE', PENDING_COURSES_PAGE_SIZE)
+        return super(PendingCoursesPagination, self).get_page_size(request)
+
 class EnrollApi(APIView):
-    authentication_classes = (BearerAuthentication,)
+    authentication_classes = (CachedBearerAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = 'enroll'
 
     def post(self, request, format=None):
         if HAVE_NA_MODEL is False:
@@ -58,8 +86,9 @@ class EnrollApi(APIView):
             email = data['email'].lower()
             rut = data['rut']
             aux_pass = ''
-            if NAExtraInfo.objects.filter(na_rut=rut).exists():
-                na_user = NAExtraInfo.objects.get(na_rut=rut)
+            na_users = get_na_users([rut])
+            if rut in na_users:
+                na_user = NAExtraInfo.objects.select_related('user__profile').get(id=na_users[rut][0])
             else:
                 try:
                     user = User.objects.get(email=email)
@@ -92,8 +121,62 @@ class EnrollApi(APIView):
         enroll_email.delay(emails_data, login_url)
         return 'success'
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class EnrollBulkApi(APIView):
+    authentication_classes = (CachedBearerAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = 'enroll_bulk'
+
+    def post(self, request, format=None):
+        if HAVE_NA_MODEL is False:
+            logger.error("NorteamericanoApiEnrollBulk - Model is not installed")
+            return Response({'error': "Model is not installed"}, status=status.HTTP_400_BAD_REQUEST)
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            serializer = EnrollBulkSerializer(data=request.data)
+            if serializer.is_valid():
+                login_url = 'https://{}/login'.format(settings.LMS_BASE)
+                results = self.create_enroll_users(serializer.validated_data['students'], login_url)
+                return Response(data={'result':'success', 'students': results}, status=status.HTTP_200_OK)
+            else:
+                logger.error("NorteamericanoApiEnrollBulk - serializer is not valid")
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            logger.error("NorteamericanoApiEnrollBulk - User is Anonymous or dont have permission")
+            return Response({'error': 'User dont have permission'}, status=status.HTTP_400_BAD_REQUEST)
+
+    def create_enroll_users(self, students, login_url):
+        """
+            Validate the students with the courses resolved together and
+            enroll them in chunks like the enroll CSV.
+            Return the result of each student in the same order.
+        """
+        courses = resolve_courses([x['course'] for x in students if isinstance(x.get('course'), str)])
+        results = [None] * len(students)
+        rows_by_mode = {}
+        for index, student in enumerate(students):
+            serializer = EnrollSerializer(data=student, context={'courses': courses})
+            if serializer.is_valid():
+                data = serializer.validated_data
+                row = [data['email'], data['lastname_1'], data['lastname_2'], data['names'], data['rut'], data['birthday'], data['phone'], data['course']]
+                rows_by_mode.setdefault(data['mode'], []).append((index, row))
+            else:
+                results[index] = {'email': student.get('email', ''), 'result': 'error', 'error': serializer.errors}
+        for mode, rows in rows_by_mode.items():
+            indexes = iter([index for index, row in rows])
+            for chunk in enroll_chunks([row for index, row in rows], mode):
+                send_enroll_emails(chunk['emails_data'], login_url)
+                for row in chunk['new_data']:
+                    results[next(indexes)] = self.row_result(row)
+        return results
+
+    def row_result(self, row):
+        if row[-1] in ('Inscrito', 'Creado e Inscrito'):
+            return {'email': row[0], 'result': 'success', 'username': row[-2]}
+        return {'email': row[0], 'result': 'error', 'error': row[-1]}
+
 class UnenrollApi(APIView):
-    authentication_classes = (BearerAuthentication,)
+    authentication_classes = (CachedBearerAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def post(self, request, format=None):
@@ -113,33 +196,79 @@ class UnenrollApi(APIView):
             return Response({'error': 'User dont have permission'}, status=status.HTTP_400_BAD_REQUEST)
 
     def unenroll_user(self, data):
-        from common.djangoapps.student.models import CourseEnrollment, CourseEnrollmentAllowed
-        course_id = data['course']
-        course_key = CourseKey.from_string(course_id)
-        rut = data['rut']
-        with transaction.atomic():
-            na_user = NAExtraInfo.objects.get(na_rut=rut)
-            #unenroll CourseEnrollmentAllowed
-            enrollmentAllowed = CourseEnrollmentAllowed.objects.filter(
-                course_id=course_key, user__naextrainfo=na_user)
-            if enrollmentAllowed:
-                enrollmentAllowed.delete()
-            #unenroll CourseEnrollment
-            enrollment = CourseEnrollment.objects.filter(user__naextrainfo=na_user, course_id=course_key)
-            if enrollment:
-                enrollment.update(is_active=0)
+        unenroll_users([(data['rut'], data['course'])])
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class UnenrollBulkApi(APIView):
+    authentication_classes = (CachedBearerAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = 'unenroll_bulk'
+
+    def post(self, request, format=None):
+        if HAVE_NA_MODEL is False:
+            logger.error("NorteamericanoApiUnenrollBulk - Model is not installed")
+            return Response({'error': "Model is not installed"}, status=status.HTTP_400_BAD_REQUEST)
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            serializer = UnEnrollBulkSerializer(data=request.data)
+            if serializer.is_valid():
+                results = self.unenroll_users(serializer.validated_data['students'])
+                return Response(data={'result':'success', 'students': results}, status=status.HTTP_200_OK)
+            else:
+                logger.error("NorteamericanoApiUnenrollBulk - serializer is not valid")
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            logger.error("NorteamericanoApiUnenrollBulk - User is Anonymous or dont have permission")
+            return Response({'error': 'User dont have permission'}, status=status.HTTP_400_BAD_REQUEST)
+
+    def unenroll_users(self, students):
+        """
+            Validate the students with the ruts and courses resolved together and
+            unenroll them with one update by course.
+            Return the result of each student in the same order.
+        """
+        ruts = [normalize_rut(x['rut']) for x in students if isinstance(x.get('rut'), str) and validarRutAllType(clean_rut(x['rut']))]
+        na_ruts = get_na_user_ids(ruts)
+        courses = resolve_courses([x['course'] for x in students if isinstance(x.get('course'), str)])
+        results = []
+        data = []
+        for student in students:
+            serializer = UnEnrollSerializer(data=student, context={'courses': courses, 'na_ruts': na_ruts})
+            if serializer.is_valid():
+                data.append((serializer.validated_data['rut'], serializer.validated_data['course']))
+                results.append({'rut': serializer.validated_data['rut'], 'result': 'success'})
+            else:
+                results.append({'rut': student.get('rut', ''), 'result': 'error', 'error': serializer.errors})
+        try:
+            unenroll_users(data, na_ruts)
+        except Exception as e:
+            logger.exception("NorteamericanoApiUnenrollBulk - Error in unenroll_users, changes rolled back: {}".format(str(e)))
+            for result in results:
+                if result['result'] == 'success':
+                    result.update({'result': 'error', 'error': 'Error, no se realizaron cambios'})
+        return results
 
 class ReRunPendingCourseApi(APIView):
-    authentication_classes = (BearerAuthentication,)
+    authentication_classes = (CachedBearerAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, format=None):
         if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
-            serializer = ReRunPendingCourseSerializer(data=request.data)
+            data = request.query_params.dict()
+            data.update(request.data.items())
+            version = get_rerun_status_version()
+            key = '{}.{}'.format(request.get_full_path(), sorted(data.items()))
+            not_modified = rerun_status_not_modified(request, version, key)
+            if not_modified is not None:
+                return not_modified
+            serializer = ReRunPendingCourseSerializer(data=data)
             if serializer.is_valid():
                 base_url = request.build_absolute_uri('/')
-                pending_courses = self.pending_courses(serializer.data, base_url)
-                return Response(data={'result':'success', 'courses_status':pending_courses}, status=status.HTTP_200_OK)
+                if serializer.data.get('course') == 'all' and not serializer.data.get('batch'):
+                    response_data = get_cached_rerun_status(version, key, lambda: self.paginated_courses(request, serializer.data, base_url).data)
+                else:
+                    response_data = get_cached_rerun_status(version, key, lambda: {'result':'success', 'courses_status':self.pending_courses(serializer.data, base_url)})
+                return set_rerun_status_headers(Response(data=response_data, status=status.HTTP_200_OK), version, key)
             else:
                 logger.error("NorteamericanoReRunPendingCourse - serializer is not valid")
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -148,28 +277,111 @@ class ReRunPendingCourseApi(APIView):
             return Response({'error': 'User dont have permission'}, status=status.HTTP_400_BAD_REQUEST)
 
     def pending_courses(self, data, base_url):
+        if data.get('batch'):
+            return self.batch_courses(data['batch'], base_url)
         course_id = data['course']
         if course_id != 'all':
             course_key = CourseKey.from_string(course_id)
-            aux = self.get_status_course(course_key)
-            pending_courses = [ {'new_course_id':str(aux.course_key), 'origen_course_id': str(aux.source_course_key), 'display_name': aux.display_name, 'state': aux.state, 'new_course_url': '{}course/{}'.format(base_url,str(aux.course_key))} ]
+            try:
+                aux = self.get_status_course(course_key)
+                pending_courses = [ self.course_status(aux, base_url) ]
+            except CourseRerunState.DoesNotExist:
+                # the rerun is still in the queue or could not be started
+                item = RerunQueueItem.objects.filter(course_key=course_key).order_by('-id').first()
+                pending_courses = []
+                if item is not None:
+                    position = None
+                    if item.state == RerunQueueItem.PENDING:
+                        position = get_queue_positions().get(item.id)
+                    pending_courses = [ self.queued_course(item, position, base_url) ]
         else:
-            aux = self.get_all_courses_pending()
-            pending_courses = [ {'new_course_id':str(x.course_key), 'origen_course_id': str(x.source_course_key), 'display_name': x.display_name, 'state': x.state, 'new_course_url': '{}course/{}'.format(base_url,str(x.course_key))} for x in aux ]
-        
+            aux = self.get_courses_pending(data)
+            pending_courses = [ self.course_status(x, base_url) for x in aux ]
+            pending_courses.extend([ self.queued_course(x, x.position, base_url) for x in self.get_queued_courses(data) ])
+
+        return pending_courses
+
+    def paginated_courses(self, request, data, base_url):
+        """
+            Get a page of the pending courses, the queued courses are added in the first page
+        """
+        paginator = PendingCoursesPagination()
+        page = paginator.paginate_queryset(self.get_courses_pending(data), request, view=self)
+        pending_courses = [ self.course_status(x, base_url) for x in page ]
+        if not request.query_params.get(paginator.cursor_query_param):
+            pending_courses.extend([ self.queued_course(x, x.position, base_url) for x in self.get_queued_courses(data) ])
+        response = {
+            'result':'success',
+            'courses_status':pending_courses,
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link()
+        }
+        return Response(data=response, status=status.HTTP_200_OK)
+
+    def course_status(self, course_state, base_url):
+        return {'new_course_id':str(course_state.course_key), 'origen_course_id': str(course_state.source_course_key), 'display_name': course_state.display_name, 'state': course_state.state, 'new_course_url': '{}course/{}'.format(base_url,str(course_state.course_key))}
+
+    def batch_courses(self, batch_id, base_url):
+        """
+            Get the state of the reruns of the batch, from CourseRerunState once they are started
+        """
+        items = list(RerunQueueItem.objects.filter(batch_id=batch_id).order_by('id'))
+        states = {
+            str(x.course_key): x for x in CourseRerunState.objects.filter(
+                course_key__in=[item.course_key for item in items],
+                should_display=True)
+        }
+        positions = get_queue_positions()
+        pending_courses = []
+        for item in items:
+            aux = states.get(str(item.course_key))
+            if item.state != RerunQueueItem.PENDING and not item.error and aux is not None:
+                pending_courses.append(self.course_status(aux, base_url))
+            else:
+                pending_courses.append(self.queued_course(item, positions.get(item.id), base_url))
         return pending_courses
+
+    def queued_course(self, item, position, base_url):
+        course = {'new_course_id':str(item.course_key), 'origen_course_id': str(item.source_course_key), 'display_name': item.display_name, 'state': 'queued' if item.state == RerunQueueItem.PENDING else item.state, 'new_course_url': '{}course/{}'.format(base_url,str(item.course_key)), 'position': position}
+        if item.error:
+            course['error'] = item.error
+        return course
     
-    def get_all_courses_pending(self):
+    def get_courses_pending(self, data):
         """
-        Get all in-process course actions
+        Get the course actions with the filters, by default the not succeeded
         """
-        return [
-            course for course in
-            CourseRerunState.objects.find_all(
-                exclude_args={'state': CourseRerunUIStateManager.State.SUCCEEDED},
-                should_display=True,
-            )
-        ]
+        courses = CourseRerunState.objects.filter(should_display=True)
+        state = data.get('state')
+        if state == 'queued':
+            return courses.none()
+        if state:
+            courses = courses.filter(state=state)
+        else:
+            courses = courses.exclude(state=CourseRerunUIStateManager.State.SUCCEEDED)
+        if data.get('source_course'):
+            courses = courses.filter(source_course_key=CourseKey.from_string(data['source_course']))
+        if data.get('org'):
+            courses = courses.filter(
+                Q(course_key__startswith='course-v1:{}+'.format(data['org'])) |
+                Q(course_key__startswith='{}/'.format(data['org'])))
+        for field, lookup in (('created_after', 'created_time__gte'), ('created_before', 'created_time__lt'), ('updated_after', 'updated_time__gte'), ('updated_before', 'updated_time__lt')):
+            if data.get(field):
+                courses = courses.filter(**{lookup: dt.strptime(data[field]+' +0000', "%H:%M %d/%m/%Y %z")})
+        return courses.order_by('-id')
+
+    def get_queued_courses(self, data):
+        """
+        Get the queued reruns with the filters of the source course and org
+        """
+        if data.get('state') not in (None, '', 'queued'):
+            return []
+        queued = get_queued_reruns()
+        if data.get('source_course'):
+            queued = [x for x in queued if str(x.source_course_key) == str(CourseKey.from_string(data['source_course']))]
+        if data.get('org'):
+            queued = [x for x in queued if x.course_key.org == data['org']]
+        return queued
     
     def get_status_course(self, course_key):
         return CourseRerunState.objects.get(
@@ -177,9 +389,82 @@ class ReRunPendingCourseApi(APIView):
                 should_display=True,
             )
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class ReRunEventsApi(APIView):
+    """
+        Long polling of the state of the reruns of a batch or a course,
+        return as soon as the state of its courses differs from the version of
+        the client or after NORTEAMERICANO_RERUN_EVENTS_TIMEOUT seconds.
+        The request holds a sync worker while it waits, keep the timeout small.
+    """
+    authentication_classes = (CachedBearerAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = 'rerun_events'
+
+    def get(self, request, format=None):
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            data = request.query_params.dict()
+            data.update(request.data.items())
+            serializer = ReRunEventsSerializer(data=data)
+            if serializer.is_valid():
+                data = dict(serializer.data)
+                version = data.pop('version', None)
+                base_url = request.build_absolute_uri('/')
+                response = self.wait_changes(data, version, base_url)
+                return Response(data=response, status=status.HTTP_200_OK)
+            else:
+                logger.error("NorteamericanoReRunEvents - serializer is not valid")
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            logger.error("NorteamericanoReRunEvents - User is Anonymous or dont have permission")
+            return Response({'error': 'User dont have permission'}, status=status.HTTP_400_BAD_REQUEST)
+
+    def wait_changes(self, data, version, base_url):
+        """
+            Wait until the state of the courses differs from the state of the
+            version of the client, the version is checked every
+            NORTEAMERICANO_RERUN_EVENTS_INTERVAL seconds and the state is only
+            compared when it changes (other courses bump the same version).
+            Without version it returns immediately.
+        """
+        timeout = getattr(settings, 'NORTEAMERICANO_RERUN_EVENTS_TIMEOUT', RERUN_EVENTS_TIMEOUT)
+        interval = getattr(settings, 'NORTEAMERICANO_RERUN_EVENTS_INTERVAL', RERUN_EVENTS_INTERVAL)
+        finish = time.time() + timeout
+        key = 'pending-courses-events.{}'.format(json.dumps(data, sort_keys=True))
+        def get_status(status_version):
+            return get_cached_rerun_status(
+                status_version, key, lambda: ReRunPendingCourseApi().pending_courses(data, base_url))
+        current_version = get_rerun_status_version()
+        courses_status = get_status(current_version)
+        if version is None:
+            changed = True
+        elif current_version != version:
+            # without the state of the client version it is reported as changed
+            changed = courses_status != get_rerun_status(version, key)
+        else:
+            changed = False
+        while not changed and time.time() < finish:
+            time.sleep(max(0, min(interval, finish - time.time())))
+            new_version = get_rerun_status_version()
+            if new_version != current_version:
+                current_version = new_version
+                new_status = get_status(current_version)
+                changed = new_status != courses_status
+                courses_status = new_status
+        return {
+            'result': 'success',
+            'version': current_version,
+            'changed': changed,
+            'courses_status': courses_status
+        }
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class ReRunApi(APIView):
-    authentication_classes = (BearerAuthentication,)
+    authentication_classes = (CachedBearerAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = 'rerun'
 
     def post(self, request, format=None):
         if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
@@ -196,32 +481,70 @@ class ReRunApi(APIView):
             return Response({'error': 'User dont have permission'}, status=status.HTTP_400_BAD_REQUEST)
 
     def rerun_courses(self, data, user, base_url):
-        from cms.djangoapps.contentstore.views.course import rerun_course
         start_date = dt.strptime(data['start_date']+' +0000', "%H:%M %d/%m/%Y %z")
         end_date = dt.strptime(data['end_date']+' +0000', "%H:%M %d/%m/%Y %z")
         source_course_key = CourseKey.from_string(data['source_course'])
         new_course_key = CourseKey.from_string(data['new_course'])
-        org = new_course_key.org
-        number = new_course_key.course
-        run = new_course_key.run
-        fields = {'start': start_date, 'end':end_date, 'display_name':data['display_name']}
-        wiki_slug = u"{0}.{1}.{2}".format(org, number, run)
-        definition_data = {'wiki_slug': wiki_slug}
-        fields.update(definition_data)
-        try:
-            new_course_id = rerun_course(user, source_course_key, org, number, run, fields)
-        except Exception as e:
-            logger.error('NorteamericanoApiReRun - Error in rerun_course(): {}'.format(str(e)))
-            new_course_id = None
-        if not new_course_id:
-            result = 'Error en relanzar el curso'
+        item = enqueue_rerun(user, source_course_key, new_course_key, data['display_name'], start_date, end_date)
+        schedule_reruns.delay()
+        rerun_status = get_rerun_status([item])
+        if item.state == RerunQueueItem.FAILED:
             response = {'new_course_url':'', "status": 'Error en relanzar el curso','result':'error'}
         else:
-            response = {'new_course_url':'{}course/{}'.format(base_url,str(new_course_id)), "status": 'Procesandose','result':'success'}
+            response = {'new_course_url':'{}course/{}'.format(base_url,str(item.course_key)), "status": rerun_status[item.id],'result':'success'}
+            if item.state == RerunQueueItem.PENDING:
+                response['position'] = item.position
         return response
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class ReRunBulkApi(APIView):
+    authentication_classes = (CachedBearerAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = 'rerun_bulk'
+
+    def post(self, request, format=None):
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            serializer = ReRunBulkSerializer(data=request.data)
+            if serializer.is_valid():
+                base_url = request.build_absolute_uri('/')
+                response = self.rerun_courses(serializer.validated_data['reruns'], request.user, base_url)
+                return Response(data=response, status=status.HTTP_200_OK)
+            else:
+                logger.error("NorteamericanoApiReRunBulk - serializer is not valid")
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            logger.error("NorteamericanoApiReRunBulk - User is Anonymous or dont have permission")
+            return Response({'error': 'User dont have permission'}, status=status.HTTP_400_BAD_REQUEST)
+
+    def rerun_courses(self, reruns, user, base_url):
+        """
+            Validate the reruns together like the rerun CSV and queue the valid
+            ones in one batch. Return the batch id and the result of each rerun.
+        """
+        fields = ['source_course', 'new_course', 'display_name', 'start_date', 'end_date']
+        rows = [[str(x.get(field, '')) for field in fields] for x in reruns]
+        batch_id = uuid.uuid4().hex
+        results = []
+        queued = []
+        for row, data in validate_rerun_rows(rows, user, is_api=True):
+            if data is None:
+                results.append({'new_course_id': row[1], 'result': 'error', 'status': row[5]})
+            else:
+                item = enqueue_rerun(user, data['source_course_key'], data['new_course_key'], row[2], data['start'], data['end'], batch_id)
+                queued.append(item)
+                results.append(item)
+        if not queued:
+            return {'result': 'error', 'batch_id': '', 'reruns': results}
+        schedule_reruns.delay()
+        rerun_status = get_rerun_status(queued)
+        for index, item in enumerate(results):
+            if isinstance(item, RerunQueueItem):
+                results[index] = {'new_course_id': str(item.course_key), 'result': 'error' if item.state == RerunQueueItem.FAILED else 'success', 'status': rerun_status[item.id], 'new_course_url': '{}course/{}'.format(base_url, str(item.course_key))}
+        return {'result': 'success', 'batch_id': batch_id, 'reruns': results}
+
 class CourseStaffEnrollApi(APIView):
-    authentication_classes = (BearerAuthentication,)
+    authentication_classes = (CachedBearerAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def post(self, request, format=None):
@@ -247,24 +570,76 @@ class CourseStaffEnrollApi(APIView):
         rut = data['rut']
         action = data['action']
         with transaction.atomic():
-            na_user = NAExtraInfo.objects.get(na_rut=rut)
+            user = User.objects.get(id=get_na_user_ids([rut])[rut])
             if action == 'enroll':
-                enroll_course_user(na_user.user, data['course'], 'audit')
-                add_role_course_staff(na_user.user, course_key)
+                enroll_course_user(user, data['course'], 'audit')
+                add_role_course_staff(user, course_key)
             else:
-                remove_role_course_staff(na_user.user, course_key)
+                remove_role_course_staff(user, course_key)
                 #unenroll CourseEnrollmentAllowed
                 enrollmentAllowed = CourseEnrollmentAllowed.objects.filter(
-                    course_id=course_key, user__naextrainfo=na_user)
+                    course_id=course_key, user=user)
                 if enrollmentAllowed:
                     enrollmentAllowed.delete()
                 #unenroll CourseEnrollment
-                enrollment = CourseEnrollment.objects.filter(user__naextrainfo=na_user, course_id=course_key)
+                enrollment = CourseEnrollment.objects.filter(user=user, course_id=course_key)
                 if enrollment:
                     enrollment.update(is_active=0)
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class CourseStaffEnrollBulkApi(APIView):
+    authentication_classes = (CachedBearerAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = 'course_staff_bulk'
+
+    def post(self, request, format=None):
+        if HAVE_NA_MODEL is False:
+            logger.error("NorteamericanoApiCourseStaffEnrollBulk - Model is not installed")
+            return Response({'error': "Model is not installed"}, status=status.HTTP_400_BAD_REQUEST)
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            serializer = CourseStaffEnrollBulkSerializer(data=request.data)
+            if serializer.is_valid():
+                results = self.coursestaff_users(serializer.validated_data['staff'])
+                return Response(data={'result':'success', 'staff': results}, status=status.HTTP_200_OK)
+            else:
+                logger.error("NorteamericanoApiCourseStaffEnrollBulk - serializer is not valid")
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            logger.error("NorteamericanoApiCourseStaffEnrollBulk - User is Anonymous or dont have permission")
+            return Response({'error': 'User dont have permission'}, status=status.HTTP_400_BAD_REQUEST)
+
+    def coursestaff_users(self, staff):
+        """
+            Validate the (rut, course, action) records with the ruts and courses
+            resolved together and apply the role changes grouped by course.
+            Return the result of each record in the same order.
+        """
+        ruts = [normalize_rut(x['rut']) for x in staff if isinstance(x.get('rut'), str) and validarRutAllType(clean_rut(x['rut']))]
+        na_ruts = get_na_user_ids(ruts)
+        courses = resolve_courses([x['course'] for x in staff if isinstance(x.get('course'), str)])
+        results = []
+        data = []
+        for record in staff:
+            serializer = CourseStaffEnrollSerializer(data=record, context={'courses': courses, 'na_ruts': na_ruts})
+            if serializer.is_valid():
+                aux = serializer.validated_data
+                data.append((aux['rut'], aux['course'], aux['action']))
+                results.append({'rut': aux['rut'], 'course': aux['course'], 'action': aux['action'], 'result': 'success'})
+            else:
+                results.append({'rut': record.get('rut', ''), 'course': record.get('course', ''), 'action': record.get('action', ''), 'result': 'error', 'error': serializer.errors})
+        try:
+            errors = course_staff_users(data, na_ruts)
+        except Exception as e:
+            logger.exception("NorteamericanoApiCourseStaffEnrollBulk - Error in course_staff_users, changes rolled back: {}".format(str(e)))
+            errors = {(rut, course_id): 'Error, no se realizaron cambios' for rut, course_id, action in data}
+        for result in results:
+            if result['result'] == 'success' and (result['rut'], result['course']) in errors:
+                result.update({'result': 'error', 'error': errors[(result['rut'], result['course'])]})
+        return results
+
 class CourseDataApi(APIView):
-    authentication_classes = (BearerAuthentication,)
+    authentication_classes = (CachedBearerAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def post(self, request, format=None):
@@ -272,8 +647,8 @@ class CourseDataApi(APIView):
             serializer = CourseDataSerializer(data=request.data)
             if serializer.is_valid():
                 result = self.set_data(serializer.data, request.user)
-                if result:
-                    return Response(data={'result':'success'}, status=status.HTTP_200_OK)
+                if result is not None:
+                    return Response(data={'result':'success', 'updated': result}, status=status.HTTP_200_OK)
                 else:
                     logger.error("NorteamericanoApiCourseData - end_date must be later than the start_date.")
                     return Response(data={'result':'error', 'error': 'end_date must be later than the start_date'}, status=status.HTTP_400_BAD_REQUEST)
@@ -291,3 +666,37 @@ class CourseDataApi(APIView):
         end_date = data.get('end_date', None)
         result = set_data_course(course_key, start_date, end_date, user)
         return result
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class CourseDataBulkApi(APIView):
+    authentication_classes = (CachedBearerAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = 'course_data_bulk'
+
+    def post(self, request, format=None):
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            serializer = CourseDataBulkSerializer(data=request.data)
+            if serializer.is_valid():
+                response = self.set_data(serializer.validated_data['courses'], request.user)
+                return Response(data=response, status=status.HTTP_200_OK)
+            else:
+                logger.error("NorteamericanoApiCourseDataBulk - serializer is not valid")
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            logger.error("NorteamericanoApiCourseDataBulk - User is Anonymous or dont have permission")
+            return Response({'error': 'User dont have permission'}, status=status.HTTP_400_BAD_REQUEST)
+
+    def set_data(self, courses, user):
+        """
+            Validate the courses together like the course dates CSV and
+            update the valid ones. Return the result of each course.
+        """
+        fields = ['course', 'start_date', 'end_date']
+        rows = [[str(x.get(field, '')) for field in fields] for x in courses]
+        results = [
+            {'course': row[0], 'result': 'success' if row[3] in ('Fechas actualizadas', 'Sin cambios') else 'error', 'status': row[3], 'updated': row[3] == 'Fechas actualizadas'}
+            for row in set_courses_dates(rows, user)[1:]
+        ]
+        result = 'success' if any(x['result'] == 'success' for x in results) else 'error'
+        return {'result': result, 'courses': results}
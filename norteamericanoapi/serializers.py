@@ -1,15 +1,21 @@
 from opaque_keys import InvalidKeyError
 from opaque_keys.edx.keys import CourseKey
 from opaque_keys import InvalidKeyError
+from django.conf import settings
 from rest_framework import serializers
-from .utils import validarRutAllType, validate_course_pending_course
+from .utils import clean_rut, validarRutAllType, validate_course_pending_course, get_na_users
 from .utils import validate_course as utils_validate_course
+from .rerun_tasks import is_rerun_queued
+from .models import RerunQueueItem
 from norteamericano_form.models import NAExtraInfo
 from datetime import datetime as dt
 from openedx.core.djangoapps.course_groups.cohorts import is_cohort_exists
 import re
 import logging
 logger = logging.getLogger(__name__)
+ENROLL_BULK_MAX = 1000
+RERUN_BULK_MAX = 500
+COURSE_DATA_BULK_MAX = 500
 regex = r'^(([^<>()\[\]\.,;:\s@\"]+(\.[^<>()\[\]\.,;:\s@\"]+)*)|(\".+\"))@(([^<>()[\]\.,;:\s@\"]+\.)+[^<>()[\]\.,;:\s@\"]{2,})$'
 
 class EnrollSerializer(serializers.Serializer):
@@ -31,7 +37,13 @@ class EnrollSerializer(serializers.Serializer):
 
     def validate_course(self, value):
         course = value
-        if not utils_validate_course(course):
+        # courses already resolved by the bulk enroll (course id -> CourseOverview or None)
+        courses = self.context.get('courses')
+        if courses is not None and course in courses:
+            valid = courses[course] is not None
+        else:
+            valid = utils_validate_course(course)
+        if not valid:
             logger.error('NAEnrollSerializer - Course key not valid or dont exists: {}'.format(course))
             raise serializers.ValidationError(u"Course key not valid or dont exists: {}".format(course))
         return course
@@ -56,35 +68,120 @@ class EnrollSerializer(serializers.Serializer):
             raise serializers.ValidationError(u"'Email invalid': {}".format(email))
         return email
 
+class EnrollBulkSerializer(serializers.Serializer):
+    students = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    def validate_students(self, value):
+        max_students = getattr(settings, 'NORTEAMERICANO_ENROLL_BULK_MAX', ENROLL_BULK_MAX)
+        if len(value) > max_students:
+            logger.error("NAEnrollBulkSerializer - Too many students: {}".format(len(value)))
+            raise serializers.ValidationError(u"Too many students, max: {}".format(max_students))
+        return value
+
 class UnEnrollSerializer(serializers.Serializer):
     rut =serializers.CharField(required=True)
     course =serializers.CharField(required=True)
 
     def validate_rut(self, value):
-        rut = value
+        rut = clean_rut(value)
         if not validarRutAllType(rut):
-            logger.error("NAUnEnrollSerializer - 'Rut/Passport invalid': {}".format(rut))
-            raise serializers.ValidationError(u"'Rut/Passport invalid': {}".format(rut))
-        rut = rut.upper()
-        rut = rut.replace("-", "")
-        rut = rut.replace(".", "")
-        rut = rut.strip()
+            logger.error("NAUnEnrollSerializer - 'Rut/Passport invalid': {}".format(value))
+            raise serializers.ValidationError(u"'Rut/Passport invalid': {}".format(value))
         if rut[0] != 'P':
             rut = '{}-{}'.format(rut[:-1], rut[-1])
-        if not NAExtraInfo.objects.filter(na_rut=rut).exists():
+        # ruts already resolved by the bulk unenroll (rut -> user id)
+        na_ruts = self.context.get('na_ruts')
+        if na_ruts is not None:
+            registered = rut in na_ruts
+        else:
+            registered = rut in get_na_users([rut])
+        if not registered:
             logger.error("NAUnEnrollSerializer - 'Rut/Passport is not registered': {}".format(rut))
             raise serializers.ValidationError(u"'Rut/Passport is not registered': {}".format(rut))
         return rut
 
     def validate_course(self, value):
         course = value
-        if not utils_validate_course(course):
+        courses = self.context.get('courses')
+        if courses is not None and course in courses:
+            valid = courses[course] is not None
+        else:
+            valid = utils_validate_course(course)
+        if not valid:
             logger.error('NAUnEnrollSerializer - Course key not valid or dont exists: {}'.format(course))
             raise serializers.ValidationError(u"Course key not valid or dont exists: {}".format(course))
         return course
 
+class UnEnrollBulkSerializer(serializers.Serializer):
+    students = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    def validate_students(self, value):
+        max_students = getattr(settings, 'NORTEAMERICANO_ENROLL_BULK_MAX', ENROLL_BULK_MAX)
+        if len(value) > max_students:
+            logger.error("NAUnEnrollBulkSerializer - Too many students: {}".format(len(value)))
+            raise serializers.ValidationError(u"Too many students, max: {}".format(max_students))
+        return value
+
 class ReRunPendingCourseSerializer(serializers.Serializer):
-    course =serializers.CharField(required=True)
+    course =serializers.CharField(required=False)
+    batch =serializers.CharField(required=False)
+    state =serializers.ChoiceField(
+        choices=(
+            ('in_progress', 'in_progress'),
+            ('failed', 'failed'),
+            ('succeeded', 'succeeded'),
+            ('queued', 'queued')
+        ),
+        required=False
+    )
+    source_course =serializers.CharField(required=False)
+    org =serializers.CharField(required=False)
+    created_after =serializers.CharField(required=False)
+    created_before =serializers.CharField(required=False)
+    updated_after =serializers.CharField(required=False)
+    updated_before =serializers.CharField(required=False)
+
+    def validate_batch(self, value):
+        batch = value
+        if not RerunQueueItem.objects.filter(batch_id=batch).exists():
+            logger.error('NAReRunPendingCourseSerializer - Batch id dont exists: {}'.format(batch))
+            raise serializers.ValidationError(u"Batch id dont exists: {}".format(batch))
+        return batch
+
+    def validate(self, attrs):
+        if 'course' not in attrs and 'batch' not in attrs:
+            logger.error('NAReRunPendingCourseSerializer - course or batch are not defined')
+            raise serializers.ValidationError(u"course or batch are required")
+        return attrs
+
+    def validate_source_course(self, value):
+        course = value
+        try:
+            aux = CourseKey.from_string(course)
+        except InvalidKeyError:
+            logger.error('NAReRunPendingCourseSerializer - Source Course key not valid: {}'.format(course))
+            raise serializers.ValidationError(u"Source Course key not valid: {}".format(course))
+        return course
+
+    def validate_date_filter(self, value):
+        try:
+            aux = dt.strptime(value+' +0000', "%H:%M %d/%m/%Y %z")
+        except ValueError:
+            logger.error('NAReRunPendingCourseSerializer - Wrong format date: {}, must be HH:MM DD/MM/YYYY'.format(value))
+            raise serializers.ValidationError(u"Wrong format date: {}, must be 'HH:MM DD/MM/YYYY'".format(value))
+        return value
+
+    def validate_created_after(self, value):
+        return self.validate_date_filter(value)
+
+    def validate_created_before(self, value):
+        return self.validate_date_filter(value)
+
+    def validate_updated_after(self, value):
+        return self.validate_date_filter(value)
+
+    def validate_updated_before(self, value):
+        return self.validate_date_filter(value)
 
     def validate_course(self, value):
         course = value
@@ -95,6 +192,26 @@ class ReRunPendingCourseSerializer(serializers.Serializer):
             raise serializers.ValidationError(u"Course key not valid or dont exists: {}".format(course))
         return course
 
+class ReRunEventsSerializer(ReRunPendingCourseSerializer):
+    version =serializers.CharField(required=False)
+
+    def validate_course(self, value):
+        course = value
+        if course == 'all':
+            logger.error('NAReRunEventsSerializer - course all is not allowed')
+            raise serializers.ValidationError(u"course all is not allowed, use a course or a batch")
+        return super(ReRunEventsSerializer, self).validate_course(course)
+
+class ReRunBulkSerializer(serializers.Serializer):
+    reruns = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    def validate_reruns(self, value):
+        max_reruns = getattr(settings, 'NORTEAMERICANO_RERUN_BULK_MAX', RERUN_BULK_MAX)
+        if len(value) > max_reruns:
+            logger.error("NAReRunBulkSerializer - Too many reruns: {}".format(len(value)))
+            raise serializers.ValidationError(u"Too many reruns, max: {}".format(max_reruns))
+        return value
+
 class ReRunSerializer(serializers.Serializer):
     source_course =serializers.CharField(required=True, allow_blank=False)
     new_course =serializers.CharField(required=True, allow_blank=False)
@@ -118,6 +235,9 @@ class ReRunSerializer(serializers.Serializer):
             raise serializers.ValidationError(u"New Course key not valid: {}".format(course))
         if utils_validate_course(course):
             raise serializers.ValidationError(u"New Course key already exists: {}".format(course))
+        if is_rerun_queued(aux):
+            logger.error('NAReRunSerializer - New Course key already queued: {}'.format(course))
+            raise serializers.ValidationError(u"New Course key already queued: {}".format(course))
         return course
     
     def validate_start_date(self, value):
@@ -161,28 +281,45 @@ class CourseStaffEnrollSerializer(serializers.Serializer):
         required=True
     )
     def validate_rut(self, value):
-        rut = value
+        rut = clean_rut(value)
         if not validarRutAllType(rut):
-            logger.error("NACourseStaffEnrollSerializer - 'Rut/Passport invalid': {}".format(rut))
-            raise serializers.ValidationError(u"'Rut/Passport invalid': {}".format(rut))
-        rut = rut.upper()
-        rut = rut.replace("-", "")
-        rut = rut.replace(".", "")
-        rut = rut.strip()
+            logger.error("NACourseStaffEnrollSerializer - 'Rut/Passport invalid': {}".format(value))
+            raise serializers.ValidationError(u"'Rut/Passport invalid': {}".format(value))
         if rut[0] != 'P':
             rut = '{}-{}'.format(rut[:-1], rut[-1])
-        if not NAExtraInfo.objects.filter(na_rut=rut).exists():
+        # ruts already resolved by the bulk course staff (rut -> user id)
+        na_ruts = self.context.get('na_ruts')
+        if na_ruts is not None:
+            registered = rut in na_ruts
+        else:
+            registered = rut in get_na_users([rut])
+        if not registered:
             logger.error("NACourseStaffEnrollSerializer - 'Rut/Passport is not registered': {}".format(rut))
             raise serializers.ValidationError(u"'Rut/Passport is not registered': {}".format(rut))
         return rut
 
     def validate_course(self, value):
         course = value
-        if not utils_validate_course(course):
+        courses = self.context.get('courses')
+        if courses is not None and course in courses:
+            valid = courses[course] is not None
+        else:
+            valid = utils_validate_course(course)
+        if not valid:
             logger.error('NACourseStaffEnrollSerializer - Course key not valid or dont exists: {}'.format(course))
             raise serializers.ValidationError(u"Course key not valid or dont exists: {}".format(course))
         return course
 
+class CourseStaffEnrollBulkSerializer(serializers.Serializer):
+    staff = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    def validate_staff(self, value):
+        max_staff = getattr(settings, 'NORTEAMERICANO_ENROLL_BULK_MAX', ENROLL_BULK_MAX)
+        if len(value) > max_staff:
+            logger.error("NACourseStaffEnrollBulkSerializer - Too many records: {}".format(len(value)))
+            raise serializers.ValidationError(u"Too many records, max: {}".format(max_staff))
+        return value
+
 class CourseDataSerializer(serializers.Serializer):
     course =serializers.CharField(required=True, allow_blank=False)
     start_date =serializers.CharField(required=False)
@@ -233,4 +370,14 @@ class CourseDataSerializer(serializers.Serializer):
             return attrs
         else:
             logger.error('NACourseDataSerializer - start_date or end_date are not defined')
-            raise serializers.ValidationError(u"Wrong format date, must be 'HH:MM DD/MM/YYYY'")
\ No newline at end of file
+            raise serializers.ValidationError(u"Wrong format date, must be 'HH:MM DD/MM/YYYY'")
+
+class CourseDataBulkSerializer(serializers.Serializer):
+    courses = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    def validate_courses(self, value):
+        max_courses = getattr(settings, 'NORTEAMERICANO_COURSE_DATA_BULK_MAX', COURSE_DATA_BULK_MAX)
+        if len(value) > max_courses:
+            logger.error("NACourseDataBulkSerializer - Too many courses: {}".format(len(value)))
+            raise serializers.ValidationError(u"Too many courses, max: {}".format(max_courses))
+        return value
\ No newline at end of file
@@ -0,0 +1,137 @@
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from common.djangoapps.course_action_state.models import CourseRerunState
+from common.djangoapps.course_action_state.managers import CourseRerunUIStateManager
+from oauth2_provider.models import get_access_token_model
+from xmodule.modulestore.django import SignalHandler
+from .authentication import invalidate_access_token, invalidate_user_tokens
+from .cache import bump_rerun_status_version, invalidate_course_exists, invalidate_na_ruts
+from .models import RerunQueueItem
+from .rerun_tasks import finish_rerun
+try:
+    from norteamericano_form.models import NAExtraInfo
+    HAVE_NA_MODEL = True
+except ImportError:
+    HAVE_NA_MODEL = False
+
+
+@receiver(post_save, sender=CourseRerunState)
+def rerun_state_changed(sender, instance, **kwargs):
+    """
+        Free the slot of the rerun queue when the clone finishes
+    """
+    bump_rerun_status_version()
+    course_key = instance.course_key
+    transaction.on_commit(lambda: invalidate_course_exists(course_key))
+    if instance.state == CourseRerunUIStateManager.State.SUCCEEDED:
+        finish_rerun(instance.course_key, True)
+    elif instance.state == CourseRerunUIStateManager.State.FAILED:
+        finish_rerun(instance.course_key, False)
+
+@receiver(post_delete, sender=CourseRerunState)
+@receiver(post_save, sender=RerunQueueItem)
+@receiver(post_delete, sender=RerunQueueItem)
+def rerun_status_changed(sender, instance, **kwargs):
+    """
+        Discard the cached status of the reruns
+    """
+    bump_rerun_status_version()
+    course_key = instance.course_key
+    transaction.on_commit(lambda: invalidate_course_exists(course_key))
+
+@receiver(SignalHandler.course_published)
+@receiver(SignalHandler.course_deleted)
+def course_changed(sender, course_key, **kwargs):
+    """
+        Discard the cached existence of the course
+    """
+    transaction.on_commit(lambda: invalidate_course_exists(course_key))
+
+@receiver(post_save, sender=get_access_token_model())
+@receiver(post_delete, sender=get_access_token_model())
+def access_token_changed(sender, instance, **kwargs):
+    """
+        Revoke the cached token when it is deleted or changed, after the
+        commit so a concurrent request can not cache it again
+    """
+    token = instance.token
+    transaction.on_commit(lambda: invalidate_access_token(token))
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+        Revoke the cached tokens of the user when it changes (e.g. it is
+        deactivated), the saves of the login time are skipped
+    """
+    if created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    user_id = instance.id
+    transaction.on_commit(lambda: invalidate_user_tokens([user_id]))
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+        Revoke the cached tokens of the users whose permissions or groups
+        change, the cached users keep their permissions
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif pk_set is not None:
+        user_ids = list(pk_set)
+    else:
+        user_ids = list(instance.user_set.values_list('id', flat=True))
+    transaction.on_commit(lambda: invalidate_user_tokens(user_ids))
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+        Revoke the cached tokens of the users of the groups whose permissions change
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        group_ids = [instance.pk]
+    elif pk_set is not None:
+        group_ids = list(pk_set)
+    else:
+        group_ids = list(instance.group_set.values_list('id', flat=True))
+    user_ids = list(User.objects.filter(groups__in=group_ids).values_list('id', flat=True))
+    transaction.on_commit(lambda: invalidate_user_tokens(user_ids))
+
+if HAVE_NA_MODEL:
+    @receiver(pre_save, sender=NAExtraInfo)
+    def na_user_rut_changed(sender, instance, **kwargs):
+        """
+            Discard the cached user of the previous rut when it changes,
+            after the commit so a concurrent request can not cache it again
+        """
+        if instance.pk:
+            old_rut = NAExtraInfo.objects.filter(pk=instance.pk).values_list('na_rut', flat=True).first()
+            if old_rut != instance.na_rut:
+                transaction.on_commit(lambda: invalidate_na_ruts([old_rut]))
+
+    @receiver(post_save, sender=NAExtraInfo)
+    @receiver(post_delete, sender=NAExtraInfo)
+    def na_user_changed(sender, instance, **kwargs):
+        """
+            Discard the cached user of the rut
+        """
+        na_rut = instance.na_rut
+        transaction.on_commit(lambda: invalidate_na_ruts([na_rut]))
+
+    @receiver(post_save, sender=User)
+    def na_username_changed(sender, instance, created=False, update_fields=None, **kwargs):
+        """
+            Discard the cached username of the rut, the saves of other
+            fields (like last_login) are skipped
+        """
+        if created or (update_fields is not None and 'username' not in update_fields):
+            return
+        user_id = instance.id
+        transaction.on_commit(lambda: invalidate_na_ruts(
+            NAExtraInfo.objects.filter(user_id=user_id).values_list('na_rut', flat=True)))
@@ -17,15 +17,24 @@ from openedx.core.djangoapps.models.course_details import CourseDetails
 from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
 from common.djangoapps.student.tests.factories import CourseEnrollmentAllowedFactory, UserFactory, CourseEnrollmentFactory
 from common.djangoapps.student.auth import has_course_author_access
-from common.djangoapps.student.roles import CourseInstructorRole, CourseStaffRole
+from common.djangoapps.student.roles import CourseInstructorRole, CourseStaffRole, OrgStaffRole
 from common.djangoapps.course_action_state.models import CourseRerunState
 from common.djangoapps.course_action_state.managers import CourseRerunUIStateManager
-from norteamericanoapi.rest_api import ReRunPendingCourseApi, ReRunApi, CourseDataApi
-from norteamericanoapi.serializers import ReRunPendingCourseSerializer, ReRunSerializer, CourseDataSerializer
+from norteamericanoapi.rest_api import ReRunPendingCourseApi, ReRunEventsApi, ReRunApi, ReRunBulkApi, CourseDataApi, CourseDataBulkApi
+from norteamericanoapi.serializers import ReRunPendingCourseSerializer, ReRunEventsSerializer, ReRunSerializer, CourseDataSerializer
+from norteamericanoapi.utils import validate_user, validate_rerun_rows, validate_course, validate_course_pending_course
+from norteamericanoapi.models import RerunQueueItem
+from norteamericanoapi.cache import bump_rerun_status_version, get_cached_rerun_status
+from norteamericanoapi.rerun_tasks import enqueue_rerun, schedule_reruns, finish_rerun, get_queued_reruns
+from edx_django_utils.cache import RequestCache
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 from django.test.utils import override_settings
+from django.utils import timezone
 from unittest.case import SkipTest
 import re
 import json
+import datetime
 import urllib.parse
 try:
     from norteamericano_form.models import NAExtraInfo
@@ -34,6 +43,8 @@ except ImportError:
     HAVE_NA_MODEL = False
 
 class TestReRunPendingCourse(ModuleStoreTestCase):
+    ENABLED_CACHES = ['default', 'mongo_metadata_inheritance', 'loc_cache']
+
     def setUp(self):
         super(TestReRunPendingCourse, self).setUp()
         with patch('common.djangoapps.student.models.cc.User.save'):
@@ -71,6 +82,67 @@ class TestReRunPendingCourse(ModuleStoreTestCase):
         response = new_client.get(reverse('norteamericanoapi:pending-courses'))
         self.assertEqual(response.status_code, 404)
 
+    def test_pending_course_not_modified(self):
+        """
+            test get pending rerun courses with the etag of the last response
+        """
+        sourse_course_key = CourseLocator('source-Org', 'source-Course', 'source-Run')
+        CourseRerunState.objects.initiated(
+            sourse_course_key, destination_course_key=CourseLocator('destination-Org', 'destination-Course', 'destination-Run'), user=self.user_staff, display_name="test course"
+        )
+        response = self.client.get(reverse('norteamericanoapi:pending-courses'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        response = self.client.get(reverse('norteamericanoapi:pending-courses'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        CourseRerunState.objects.initiated(
+            sourse_course_key, destination_course_key=CourseLocator('destination-Org', 'destination-Course', 'destination-Run2'), user=self.user_staff, display_name="test course 2"
+        )
+        response = self.client.get(reverse('norteamericanoapi:pending-courses'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['courses']), 2)
+        # a change in the same second is not hidden by If-Modified-Since
+        response = self.client.get(reverse('norteamericanoapi:pending-courses'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_rerun_status(self):
+        """
+            test the status is computed once by version
+        """
+        get_status = Mock(return_value={'result': 'success'})
+        version = bump_rerun_status_version()
+        self.assertEqual(get_cached_rerun_status(version, 'test', get_status), {'result': 'success'})
+        self.assertEqual(get_cached_rerun_status(version, 'test', get_status), {'result': 'success'})
+        self.assertEqual(get_status.call_count, 1)
+        version = bump_rerun_status_version()
+        get_cached_rerun_status(version, 'test', get_status)
+        self.assertEqual(get_status.call_count, 2)
+
+    def test_pending_course_queued(self):
+        """
+            test the queued reruns are only listed to the users with access to the source course
+        """
+        start = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+        end = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+        sourse_course_key = CourseLocator('source-Org', 'source-Course', 'source-Run')
+        enqueue_rerun(self.user_staff, sourse_course_key, CourseLocator('source-Org', 'source-Course', 'run2'), 'test course', start, end)
+        response = self.client.get(reverse('norteamericanoapi:pending-courses'))
+        self.assertEqual(response.status_code, 200)
+        courses = response.json()['courses']
+        self.assertEqual([(x['new_course_id'], x['state'], x['position']) for x in courses], [('course-v1:source-Org+source-Course+run2', 'queued', 1)])
+
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            user = UserFactory(username='testuser4', password='12345')
+            user.user_permissions.add(Permission.objects.get(codename='na_instructor_staff', content_type=ContentType.objects.get_for_model(NAExtraInfo)))
+        client = Client()
+        client.login(username='testuser4', password='12345')
+        response = client.get(reverse('norteamericanoapi:pending-courses'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['courses'], [])
+
     def test_pending_course_post(self):
         """
             test get pending rerun courses wrong method
@@ -127,6 +199,8 @@ class TestReRunPendingCourseSerializers(ModuleStoreTestCase):
         self.assertEqual(str(serializer.errors['course'][0]), "Course key not valid or dont exists: {}".format(body['course']))
 
 class TestReRunPendingCourseAPI(ModuleStoreTestCase):
+    ENABLED_CACHES = ['default', 'mongo_metadata_inheritance', 'loc_cache']
+
     def setUp(self):
         super(TestReRunPendingCourseAPI, self).setUp()
         self.created_user = UserFactory()
@@ -157,6 +231,82 @@ class TestReRunPendingCourseAPI(ModuleStoreTestCase):
         response = ReRunPendingCourseApi().pending_courses(body, base_url)
         self.assertEqual(response, expected)
 
+    def test_pending_rerun_api_filters(self):
+        """
+            Test pending rerun api with filters and pagination
+        """
+        other_course = CourseLocator("other_org", "test_course_num", "test_run")
+        CourseRerunState.objects.initiated(
+            source_course_key=CourseLocator("other_org", "source_course_num", "source_run"),
+            destination_course_key=other_course,
+            user=self.created_user,
+            display_name="other course name",
+        )
+        CourseRerunState.objects.failed(course_key=other_course)
+        api = ReRunPendingCourseApi()
+        courses = api.get_courses_pending({'course': 'all', 'org': 'test_org'})
+        self.assertEqual([x.course_key for x in courses], [self.new_course])
+        courses = api.get_courses_pending({'course': 'all', 'state': 'failed'})
+        self.assertEqual([x.course_key for x in courses], [other_course])
+        courses = api.get_courses_pending({'course': 'all', 'source_course': str(self.source_course)})
+        self.assertEqual([x.course_key for x in courses], [self.new_course])
+        courses = api.get_courses_pending({'course': 'all', 'created_after': '00:00 01/01/2100'})
+        self.assertEqual(list(courses), [])
+        self.assertEqual(list(api.get_courses_pending({'course': 'all', 'state': 'queued'})), [])
+
+        base_url ='https://test.web.st/'
+        request = Request(APIRequestFactory().get('/', {'course': 'all', 'page_size': 1}))
+        response = api.paginated_courses(request, {'course': 'all'}, base_url)
+        self.assertEqual(len(response.data['courses_status']), 1)
+        self.assertEqual(response.data['courses_status'][0]['new_course_id'], str(other_course))
+        self.assertIsNotNone(response.data['next'])
+        request = Request(APIRequestFactory().get(response.data['next']))
+        response = api.paginated_courses(request, {'course': 'all'}, base_url)
+        self.assertEqual([x['new_course_id'] for x in response.data['courses_status']], [str(self.new_course)])
+        self.assertIsNone(response.data['next'])
+
+        # the page size of the settings is read by request
+        with override_settings(NORTEAMERICANO_PENDING_COURSES_PAGE_SIZE=1):
+            request = Request(APIRequestFactory().get('/', {'course': 'all'}))
+            response = api.paginated_courses(request, {'course': 'all'}, base_url)
+        self.assertEqual(len(response.data['courses_status']), 1)
+        self.assertIsNotNone(response.data['next'])
+
+    @override_settings(NORTEAMERICANO_RERUN_EVENTS_TIMEOUT=0)
+    def test_rerun_events_api(self):
+        """
+            Test the long polling of the state of the reruns
+        """
+        base_url ='https://test.web.st/'
+        body = {'course': str(self.new_course)}
+        response = ReRunEventsApi().wait_changes(body, None, base_url)
+        self.assertTrue(response['changed'])
+        self.assertEqual(response['courses_status'][0]['state'], 'in_progress')
+        version = response['version']
+
+        response = ReRunEventsApi().wait_changes(body, version, base_url)
+        self.assertFalse(response['changed'])
+        self.assertEqual(response['version'], version)
+
+        # a change of other courses is not reported
+        bump_rerun_status_version()
+        response = ReRunEventsApi().wait_changes(body, version, base_url)
+        self.assertFalse(response['changed'])
+        self.assertNotEqual(response['version'], version)
+        version = response['version']
+
+        CourseRerunState.objects.failed(course_key=self.new_course)
+        response = ReRunEventsApi().wait_changes(body, version, base_url)
+        self.assertTrue(response['changed'])
+        self.assertNotEqual(response['version'], version)
+        self.assertEqual(response['courses_status'][0]['state'], 'failed')
+
+        serializer = ReRunEventsSerializer(data={'course': 'all'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(str(serializer.errors['course'][0]), "course all is not allowed, use a course or a batch")
+        serializer = ReRunEventsSerializer(data={'course': str(self.new_course), 'version': version})
+        self.assertTrue(serializer.is_valid())
+
 class TestReRun(ModuleStoreTestCase):
     def setUp(self):
         super(TestReRun, self).setUp()
@@ -384,6 +534,68 @@ class TestReRun(ModuleStoreTestCase):
         expect = ['','Course Id;Nuevo Course Id;Nombre curso nuevo;Fecha de Inicio(UTC);Fecha de Termino(UTC);Estado\r\n', aux]
         self.assertEqual(data, expect)
 
+    @patch('norteamericanoapi.utils.get_course_with_access')
+    def test_validate_user(self, get_course_with_access):
+        """
+            test the permission of the user is resolved from the roles, without loading the course, and memoized
+        """
+        course_id = str(self.course.id)
+        self.assertTrue(validate_user(self.user_staff, course_id))
+        self.assertFalse(validate_user(self.student, course_id))
+        with self.assertNumQueries(0):
+            self.assertFalse(validate_user(self.student, course_id))
+
+        CourseStaffRole(self.course.id).add_users(self.student)
+        RequestCache.clear_all_namespaces()
+        self.assertTrue(validate_user(User.objects.get(id=self.student.id), course_id))
+        CourseStaffRole(self.course.id).remove_users(self.student)
+        OrgStaffRole(self.course.id.org).add_users(self.student)
+        RequestCache.clear_all_namespaces()
+        self.assertTrue(validate_user(User.objects.get(id=self.student.id), course_id))
+        RequestCache.clear_all_namespaces()
+        self.assertFalse(validate_user(User.objects.get(id=self.student.id), 'course-v1:eol+Test202v2 2022'))
+        get_course_with_access.assert_not_called()
+
+    def test_validate_rerun_rows(self):
+        """
+            test all the rows of the rerun csv are validated together before any rerun
+        """
+        course2 = CourseFactory.create(
+            org='mss',
+            course='888',
+            display_name='2022',
+            emit_signals=True)
+        aux = CourseOverview.get_from_id(course2.id)
+        CourseStaffRole(self.course.id).add_users(self.student)
+        student = User.objects.get(id=self.student.id)
+        dates = ['15:00 25/12/2022', '15:00 25/12/2023']
+        csv_data = [
+            [str(self.course.id), 'course-v1:mss+999+run1', 'rerun'] + dates,
+            [str(self.course.id), 'course-v1:mss+999+run1', 'rerun'] + dates,
+            [str(self.course.id), 'course-v1:mss+999+run2', 'rerun', '25/12/2022', dates[1]],
+            [str(course2.id), 'course-v1:mss+888+run1', 'rerun'] + dates,
+            ['course-v1:mss+777+2022', 'course-v1:mss+777+run1', 'rerun'] + dates,
+            [str(self.course.id), str(course2.id), 'rerun'] + dates,
+            [str(self.course.id), 'asd', 'rerun'] + dates,
+            [str(self.course.id), 'course-v1:mss+999+run3'],
+        ]
+        with patch('norteamericanoapi.utils.get_course_with_access') as get_course_with_access:
+            rows = validate_rerun_rows(csv_data, student)
+            get_course_with_access.assert_not_called()
+        self.assertEqual(rows[0][1]['source_course_key'], self.course.id)
+        self.assertEqual(rows[0][1]['new_course_key'], CourseKey.from_string('course-v1:mss+999+run1'))
+        self.assertEqual([x[0][5] for x in rows], [
+            '',
+            'El nuevo course id ya esta en cola',
+            'Formato incorrecto en las fechas del curso',
+            'Usuario no tiene permisos en el curso',
+            'Formato del course_id incorrecto o el curso no existe',
+            'El nuevo course id ya existe',
+            'Formato del nuevo course_id incorrecto',
+            'Faltan datos',
+        ])
+        self.assertEqual([x[1] is None for x in rows], [False, True, True, True, True, True, True, True])
+
 class TestReRunSerializers(ModuleStoreTestCase):
     def setUp(self):
         super(TestReRunSerializers, self).setUp()
@@ -486,6 +698,133 @@ class TestReRunAPI(ModuleStoreTestCase):
         self.assertEqual(rerun_state.state, CourseRerunUIStateManager.State.SUCCEEDED)
         self.assertEqual(response, expected)
 
+    def test_rerun_bulk_api(self):
+        """
+            Test bulk rerun api, the reruns are validated together and polled by batch id
+        """
+        spec = {
+            "source_course":str(self.course.id),
+            "new_course":'course-v1:mss+999+run1',
+            "display_name":"test name",
+            "start_date":"00:00 01/01/2022",
+            "end_date":"00:00 01/01/2023"
+        }
+        reruns = [
+            spec,
+            dict(spec, new_course='course-v1:mss+999+run2'),
+            dict(spec, new_course='course-v1:mss+999+run3', display_name=''),
+            dict(spec, new_course='course-v1:mss+999+run4', end_date="00:00 01/01/2021"),
+            dict(spec, source_course='course-v1:mss+777+2022'),
+            # valid after the rejected specs of the same new course
+            dict(spec, new_course='course-v1:mss+999+run3'),
+        ]
+        base_url ='https://test.web.st/'
+        response = ReRunBulkApi().rerun_courses(reruns, self.user_staff, base_url)
+        self.assertEqual(response['result'], 'success')
+        self.assertEqual(len(response['batch_id']), 32)
+        self.assertEqual([x['result'] for x in response['reruns']], ['success', 'success', 'error', 'error', 'error', 'success'])
+        self.assertEqual(response['reruns'][0], {'new_course_id': 'course-v1:mss+999+run1', 'result': 'success', 'status': 'Procesandose', 'new_course_url': '{}course/course-v1:mss+999+run1'.format(base_url)})
+        self.assertEqual(response['reruns'][2]['status'], 'Falta el nombre del curso nuevo')
+        self.assertEqual(response['reruns'][3]['status'], 'La fecha de termino debe ser posterior a la fecha de inicio')
+        self.assertEqual(response['reruns'][4]['status'], 'Formato del course_id incorrecto o el curso no existe')
+        self.assertEqual(response['reruns'][5]['new_course_id'], 'course-v1:mss+999+run3')
+
+        serializer = ReRunPendingCourseSerializer(data={'batch': response['batch_id']})
+        self.assertTrue(serializer.is_valid())
+        pending = ReRunPendingCourseApi().pending_courses(serializer.data, base_url)
+        self.assertEqual([x['new_course_id'] for x in pending], ['course-v1:mss+999+run1', 'course-v1:mss+999+run2', 'course-v1:mss+999+run3'])
+        self.assertEqual([x['state'] for x in pending], [CourseRerunUIStateManager.State.SUCCEEDED] * 3)
+        self.assertFalse(ReRunPendingCourseSerializer(data={'batch': '0' * 32}).is_valid())
+        self.assertFalse(ReRunPendingCourseSerializer(data={}).is_valid())
+
+class TestReRunQueue(ModuleStoreTestCase):
+    def setUp(self):
+        super(TestReRunQueue, self).setUp()
+        self.course = CourseFactory.create(
+            org='mss',
+            course='999',
+            display_name='2022',
+            emit_signals=True)
+        self.course2 = CourseFactory.create(
+            org='mss',
+            course='888',
+            display_name='2022',
+            emit_signals=True)
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            self.user_staff = UserFactory(
+                username='testuser3',
+                password='12345',
+                email='student2@edx.org',
+                is_staff=True)
+        self.start = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+        self.end = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def enqueue(self, source, run):
+        return enqueue_rerun(self.user_staff, source, CourseLocator('mss', source.course, run), 'rerun', self.start, self.end)
+
+    @override_settings(NORTEAMERICANO_RERUN_MAX_RUNNING=2, NORTEAMERICANO_RERUN_MAX_RUNNING_PER_SOURCE=1)
+    @patch('cms.djangoapps.contentstore.views.course.rerun_course')
+    def test_rerun_queue_limits(self, rerun_course):
+        """
+            Test the reruns are started within the global and by source course limits
+        """
+        item_1 = self.enqueue(self.course.id, 'run1')
+        item_2 = self.enqueue(self.course.id, 'run2')
+        item_3 = self.enqueue(self.course2.id, 'run3')
+        item_4 = self.enqueue(self.course2.id, 'run4')
+        schedule_reruns()
+        states = dict(RerunQueueItem.objects.values_list('id', 'state'))
+        self.assertEqual(states, {item_1.id: 'running', item_2.id: 'pending', item_3.id: 'running', item_4.id: 'pending'})
+        self.assertEqual(rerun_course.call_count, 2)
+        self.assertEqual([(x.id, x.position) for x in get_queued_reruns()], [(item_2.id, 1), (item_4.id, 2)])
+
+        body = {"course": str(item_4.course_key)}
+        base_url = 'https://test.web.st/'
+        response = ReRunPendingCourseApi().pending_courses(body, base_url)
+        self.assertEqual(response[0]['state'], 'queued')
+        self.assertEqual(response[0]['position'], 2)
+
+        finish_rerun(item_1.course_key, True)
+        states = dict(RerunQueueItem.objects.values_list('id', 'state'))
+        self.assertEqual(states, {item_1.id: 'succeeded', item_2.id: 'running', item_3.id: 'running', item_4.id: 'pending'})
+        self.assertEqual(rerun_course.call_count, 3)
+
+    @patch('cms.djangoapps.contentstore.views.course.rerun_course')
+    def test_rerun_queue_start_error(self, rerun_course):
+        """
+            Test a rerun that can not be started is marked as failed and frees its slot
+        """
+        rerun_course.side_effect = [Exception('Duplicate course'), None]
+        item_1 = self.enqueue(self.course.id, 'run1')
+        item_2 = self.enqueue(self.course.id, 'run2')
+        schedule_reruns()
+        item_1.refresh_from_db()
+        item_2.refresh_from_db()
+        self.assertEqual(item_1.state, 'failed')
+        self.assertEqual(item_1.error, 'Duplicate course')
+        self.assertEqual(item_2.state, 'running')
+
+    @override_settings(NORTEAMERICANO_RERUN_MAX_RUNTIME=3600)
+    @patch('cms.djangoapps.contentstore.views.course.rerun_course')
+    def test_rerun_queue_timeout(self, rerun_course):
+        """
+            Test a rerun running for more than the max runtime is marked as failed and frees its slot
+        """
+        item_1 = self.enqueue(self.course.id, 'run1')
+        item_2 = self.enqueue(self.course.id, 'run2')
+        schedule_reruns()
+        schedule_reruns()
+        item_2.refresh_from_db()
+        self.assertEqual(item_2.state, 'pending')
+        RerunQueueItem.objects.filter(id=item_1.id).update(started=timezone.now() - datetime.timedelta(seconds=3601))
+        schedule_reruns()
+        item_1.refresh_from_db()
+        item_2.refresh_from_db()
+        self.assertEqual(item_1.state, 'failed')
+        self.assertEqual(item_1.error, 'El curso no termino de procesarse en 3600 segundos')
+        self.assertEqual(item_2.state, 'running')
+        self.assertEqual(rerun_course.call_count, 2)
+
 class TestCourseDataSerializers(ModuleStoreTestCase):
     def setUp(self):
         super(TestCourseDataSerializers, self).setUp()
@@ -587,6 +926,134 @@ class TestCourseDataAPI(ModuleStoreTestCase):
         response = CourseDataApi().set_data(body, self.user_staff)
         self.assertFalse(response)
 
+    def test_coursedata_bulk_api(self):
+        """
+            Test coursedata bulk api
+        """
+        courses = [
+            {"course":str(self.course.id), "start_date":"00:00 01/01/2022", "end_date":"00:00 01/01/2023"},
+            {"course":str(self.course.id), "end_date":"00:00 01/01/2024"},
+            {"course":"course-v1:eol+Test202v2+2022", "start_date":"00:00 01/01/2022"},
+            {"course":str(self.course.id), "start_date":"00-00 01/01/2022"},
+            {"course":str(self.course.id)},
+        ]
+        response = CourseDataBulkApi().set_data(courses, self.user_staff)
+        self.assertEqual(response['result'], 'success')
+        self.assertEqual([x['status'] for x in response['courses']], [
+            'Fechas actualizadas',
+            'Curso repetido',
+            'Id curso invalido o curso no existe',
+            'Formato incorrecto en las fechas del curso',
+            'Faltan datos'])
+        jsondetails = CourseDetails.fetch(self.course.id)
+        self.assertEqual(jsondetails.start_date.strftime("%H:%M %d/%m/%Y"), courses[0]['start_date'])
+        self.assertEqual(jsondetails.end_date.strftime("%H:%M %d/%m/%Y"), courses[0]['end_date'])
+
+        courses = [{"course":str(self.course.id), "start_date":"00:00 01/01/2024"}]
+        response = CourseDataBulkApi().set_data(courses, self.user_staff)
+        self.assertEqual(response, {'result': 'error', 'courses': [{'course': str(self.course.id), 'result': 'error', 'status': 'La fecha de termino debe ser posterior a la fecha de inicio', 'updated': False}]})
+
+    def test_coursedata_api_unchanged(self):
+        """
+            Test coursedata api dont write the course when the dates dont change
+        """
+        body = {
+            "course":str(self.course.id),
+            "start_date":"00:00 01/01/2022",
+            "end_date":"00:00 01/01/2023"
+        }
+        self.assertTrue(CourseDataApi().set_data(body, self.user_staff))
+        with patch('xmodule.modulestore.mixed.MixedModuleStore.update_item') as update_item:
+            self.assertFalse(CourseDataApi().set_data(body, self.user_staff))
+            response = CourseDataBulkApi().set_data([body], self.user_staff)
+            self.assertFalse(update_item.called)
+        self.assertEqual(response, {'result': 'success', 'courses': [{'course': str(self.course.id), 'result': 'success', 'status': 'Sin cambios', 'updated': False}]})
+
+    @patch('norteamericanoapi.views.file_to_csvreader')
+    def test_course_dates_csv(self, csv_reader):
+        """
+            Test set the dates of the courses from CSV
+        """
+        content_type = ContentType.objects.get_for_model(NAExtraInfo)
+        permission = Permission.objects.get(
+            codename='na_instructor_staff',
+            content_type=content_type,
+        )
+        self.user_staff.user_permissions.add(permission)
+        client = Client()
+        client.login(username='testuser3', password='12345')
+        response = client.get(reverse('norteamericanoapi:course-dates'))
+        self.assertEqual(response.status_code, 200)
+        csv_reader.return_value = [[str(self.course.id), '', '00:00 01/01/2035']]
+        mock_file_object = Mock()
+        mock_file_object.configure_mock(name="file_name")
+        post_data = {
+            "file": Mock(file=mock_file_object),
+        }
+        response = client.post(reverse('norteamericanoapi:course-dates'), post_data)
+        self.assertEqual(response.status_code, 200)
+        data = [x.decode() for x in response._container]
+        expect = ['', 'Id curso;Fecha de Inicio(UTC);Fecha de Termino(UTC);Estado\r\n', '{};;00:00 01/01/2035;Fechas actualizadas\r\n'.format(str(self.course.id))]
+        self.assertEqual(data, expect)
+        jsondetails = CourseDetails.fetch(self.course.id)
+        self.assertEqual(jsondetails.end_date.strftime("%H:%M %d/%m/%Y"), '00:00 01/01/2035')
+
+class TestCourseCache(ModuleStoreTestCase):
+    ENABLED_CACHES = ['default', 'mongo_metadata_inheritance', 'loc_cache']
+
+    @patch('norteamericanoapi.signals.transaction.on_commit', new=lambda func: func())
+    def test_validate_course_cache(self):
+        """
+            Test the existence of the course is cached until the course is published
+        """
+        course_key = CourseLocator('mss', '888', '2022')
+        self.assertFalse(validate_course(str(course_key)))
+        with self.assertNumQueries(0):
+            self.assertFalse(validate_course(str(course_key)))
+        course = CourseFactory.create(
+            org='mss',
+            course='888',
+            run='2022',
+            display_name='2022',
+            emit_signals=True)
+        self.assertTrue(validate_course(str(course.id)))
+        with self.assertNumQueries(0):
+            self.assertTrue(validate_course(str(course.id)))
+
+    @patch('norteamericanoapi.signals.transaction.on_commit', new=lambda func: func())
+    def test_validate_course_pending_course_cache(self):
+        """
+            Test the existence of the pending rerun is cached until the rerun changes
+        """
+        course_key = CourseLocator('mss', '888', '2023')
+        self.assertFalse(validate_course_pending_course(str(course_key)))
+        with self.assertNumQueries(0):
+            self.assertFalse(validate_course_pending_course(str(course_key)))
+        CourseRerunState.objects.initiated(
+            source_course_key=CourseLocator('mss', '888', '2022'),
+            destination_course_key=course_key,
+            user=UserFactory(),
+            display_name="destination course name",
+        )
+        self.assertTrue(validate_course_pending_course(str(course_key)))
+        with self.assertNumQueries(0):
+            self.assertTrue(validate_course_pending_course(str(course_key)))
+
+    @override_settings(NORTEAMERICANO_COURSE_MISSING_CACHE_TIMEOUT=0)
+    def test_validate_course_missing_not_cached(self):
+        """
+            Test the missing course is not kept in the cache when its timeout expires
+        """
+        course_key = CourseLocator('mss', '888', '2024')
+        self.assertFalse(validate_course(str(course_key)))
+        course = CourseFactory.create(
+            org='mss',
+            course='888',
+            run='2024',
+            display_name='2024',
+            emit_signals=False)
+        self.assertTrue(validate_course(str(course.id)))
+
 class TestReRunExportCSV(ModuleStoreTestCase):
     def setUp(self):
         super(TestReRunExportCSV, self).setUp()
@@ -15,16 +15,35 @@ from xmodule.modulestore import ModuleStoreEnum
 from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase
 from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
 from common.djangoapps.student.tests.factories import CourseEnrollmentAllowedFactory, UserFactory, CourseEnrollmentFactory
+from common.djangoapps.student.models import CourseEnrollment, CourseEnrollmentAllowed
 from common.djangoapps.student.auth import has_course_author_access
 from common.djangoapps.student.roles import CourseInstructorRole, CourseStaffRole
 from common.djangoapps.course_action_state.models import CourseRerunState
 from common.djangoapps.course_action_state.managers import CourseRerunUIStateManager
-from norteamericanoapi.utils import create_user_by_data, generate_username
-from norteamericanoapi.rest_api import EnrollApi, UnenrollApi, CourseStaffEnrollApi
-from norteamericanoapi.serializers import EnrollSerializer, UnEnrollSerializer, CourseStaffEnrollSerializer
+from norteamericanoapi.utils import create_user_by_data, create_password_hash_pool, generate_username, username_prefixes, UsernameReservation, prepare_enroll_row, preload_enroll_data, resolve_courses, enroll_create_user_with_custom_fields, hash_passwords, file_to_csvreader, stream_enroll_csv, get_na_users, get_na_user_ids
+from norteamericanoapi.rest_api import EnrollApi, EnrollBulkApi, UnenrollApi, UnenrollBulkApi, CourseStaffEnrollApi, CourseStaffEnrollBulkApi
+from norteamericanoapi.serializers import EnrollSerializer, EnrollBulkSerializer, UnEnrollSerializer, CourseStaffEnrollSerializer
+from norteamericanoapi.email_tasks import enroll_emails, send_enroll_emails
+from norteamericanoapi.enroll_tasks import cleanup_enroll_jobs
+from norteamericanoapi.models import EnrollJob
+from django.core.files.storage import default_storage
+from norteamericanoapi.cache import NA_RUT_CACHE_NAMESPACE
+from edx_django_utils.cache import RequestCache
+from django.core.management import call_command
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from openedx.core.djangoapps.oauth_dispatch.tests.factories import ApplicationFactory, AccessTokenFactory
+from norteamericanoapi.authentication import CachedBearerAuthentication, token_cache_key
+from norteamericanoapi.throttling import consume_throttle
 from django.test.utils import override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.hashers import check_password, make_password
+from django.core import mail
 from unittest.case import SkipTest
 import re
+import io
+import datetime
 import json
 import urllib.parse
 try:
@@ -34,6 +53,8 @@ except ImportError:
     HAVE_NA_MODEL = False
 
 class TestEnrollCSV(ModuleStoreTestCase):
+    ENABLED_CACHES = ['default', 'mongo_metadata_inheritance', 'loc_cache']
+
     def setUp(self):
         super(TestEnrollCSV, self).setUp()
         self.course = CourseFactory.create(
@@ -157,11 +178,11 @@ class TestEnrollCSV(ModuleStoreTestCase):
             'mode': 'honor'
         }
         response = self.client.post(reverse('norteamericanoapi:enroll'), post_data)
+        self.assertEqual(response.status_code, 200)
+        data = [x.decode() for x in response.streaming_content]
         self.assertTrue(User.objects.filter(email="aux.student2@edx.org").exists())
         self.assertTrue(NAExtraInfo.objects.filter(na_rut='P123456').exists())
-        self.assertEqual(response.status_code, 200)
-        data = [x.decode() for x in response._container]
-        expect = ['',"Email;Apellido Paterno;Apellido Materno;Nombres;RUT;Fecha de Nacimiento;Fono;Id curso;Username;Estado\r\n", 
+        expect = ["Email;Apellido Paterno;Apellido Materno;Nombres;RUT;Fecha de Nacimiento;Fono;Id curso;Username;Estado\r\n", 
         data_student_1, 
         data_student_2,
          data_student_3, 
@@ -175,6 +196,142 @@ class TestEnrollCSV(ModuleStoreTestCase):
          data_student_11]
         self.assertEqual(data, expect)
 
+    @override_settings(REGISTRATION_EMAIL_PATTERNS_DISALLOWED=True, CELERY_ALWAYS_EAGER=True)
+    def test_enroll_csv_async(self):
+        """
+            Test enroll user csv in background, celery in eager mode
+        """
+        if not HAVE_NA_MODEL:
+            self.skipTest("import error norteamericano_form")
+        csv_content = 'Email;Apellido Paterno;Apellido Materno;Nombres;RUT;Fecha de Nacimiento;Fono;Id Curso\n'
+        csv_content += 'aux.student2@edx.org;LastNameP;LastNameM;User;P123456;10/10/2020;12345689;{}\n'.format(self.course.id)
+        csv_content += '@edx.org;LastNameP;LastNameM;User;P789456;10/10/2020;12345689;{}\n'.format(self.course.id)
+        post_data = {
+            "file": SimpleUploadedFile('enroll.csv', csv_content.encode('utf-8'), content_type='text/csv'),
+            'mode': 'honor',
+            'async': '1'
+        }
+        with patch('norteamericanoapi.enroll_tasks.delete_enroll_job') as delete_enroll_job:
+            response = self.client.post(reverse('norteamericanoapi:enroll'), post_data)
+        self.assertEqual(response.status_code, 200)
+        job_id = re.search(r'enroll-status/([0-9a-f]{32})/', response._container[0].decode()).group(1)
+        self.assertTrue(User.objects.filter(email="aux.student2@edx.org").exists())
+        job = EnrollJob.objects.get(job_id=job_id)
+        self.assertEqual(job.upload_file, '')
+        delete_enroll_job.apply_async.assert_called_once()
+        self.assertEqual(delete_enroll_job.apply_async.call_args[1]['args'], (job_id,))
+        self.assertTrue(delete_enroll_job.apply_async.call_args[1]['countdown'] > 0)
+
+        response = self.client.get(reverse('norteamericanoapi:enroll-status', kwargs={'job_id': job_id}))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['state'], 'success')
+        self.assertEqual(data['rows'], 2)
+        self.assertEqual(data['errors'], 1)
+        self.assertEqual(data['download_url'], reverse('norteamericanoapi:enroll-download', kwargs={'job_id': job_id}))
+
+        response = self.client.get(data['download_url'])
+        self.assertEqual(response.status_code, 200)
+        result = b''.join(response.streaming_content).decode()
+        self.assertTrue('aux.student2@edx.org;LastNameP;LastNameM;User;P123456;10/10/2020;12345689;{};user_lastnamep;Creado e Inscrito'.format(self.course.id) in result)
+        self.assertTrue('Formato del correo incorrecto' in result)
+
+        response = self.student_client.get(reverse('norteamericanoapi:enroll-status', kwargs={'job_id': job_id}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('norteamericanoapi:enroll-status', kwargs={'job_id': '0' * 32}))
+        self.assertEqual(response.status_code, 404)
+
+        # expired job, the files and the job are deleted
+        result_file = job.result_file
+        EnrollJob.objects.filter(job_id=job_id).update(created=timezone.now() - datetime.timedelta(days=8))
+        response = self.client.get(reverse('norteamericanoapi:enroll-status', kwargs={'job_id': job_id}))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(cleanup_enroll_jobs(), 1)
+        self.assertFalse(EnrollJob.objects.filter(job_id=job_id).exists())
+        self.assertFalse(default_storage.exists(result_file))
+
+    def test_file_to_csvreader(self):
+        """
+            Test the csv file is decoded while the rows are read
+        """
+        csv_content = 'Email;Nombres\r\nñandú@edx.org;José\r\nqwe@edx.org;Ñuñoa\r\n'
+        csv_reader = file_to_csvreader(io.BytesIO(csv_content.encode('utf-8')))
+        self.assertEqual(next(csv_reader), ['ñandú@edx.org', 'José'])
+        self.assertEqual([x for x in csv_reader], [['qwe@edx.org', 'Ñuñoa']])
+
+    @override_settings(REGISTRATION_EMAIL_PATTERNS_DISALLOWED=True)
+    def test_stream_enroll_csv(self):
+        """
+            Test the result lines are yielded by chunk and the emails are sent after each chunk
+        """
+        if not HAVE_NA_MODEL:
+            self.skipTest("import error norteamericano_form")
+        csv_data = iter([
+            ['aux.student2@edx.org', 'LastNameP', 'LastNameM', 'User', 'P123456','10/10/2020','12345689', str(self.course.id)],
+            ['@edx.org', 'LastNameP', 'LastNameM', 'User', 'P789456','10/10/2020','12345689', str(self.course.id)],
+        ])
+        emails = []
+        lines = stream_enroll_csv(csv_data, 'honor', emails_callback=emails.extend)
+        self.assertEqual(next(lines), "Email;Apellido Paterno;Apellido Materno;Nombres;RUT;Fecha de Nacimiento;Fono;Id curso;Username;Estado\r\n")
+        self.assertFalse(User.objects.filter(email="aux.student2@edx.org").exists())
+        data = [x for x in lines]
+        self.assertEqual(len(data), 2)
+        self.assertTrue(data[0].endswith(';user_lastnamep;Creado e Inscrito\r\n'))
+        self.assertTrue(data[1].endswith(';;Formato del correo incorrecto\r\n'))
+        self.assertEqual(len(emails), 1)
+        self.assertEqual(emails[0]['email'], 'aux.student2@edx.org')
+
+        # the load of the chunk data fails, its rows are marked
+        csv_data = iter([
+            ['aux.student3@edx.org', 'LastNameP', 'LastNameM', 'User', 'P789456','10/10/2020','12345689', str(self.course.id)],
+        ])
+        with patch('norteamericanoapi.utils.preload_enroll_data', side_effect=Exception('error')):
+            data = [x for x in stream_enroll_csv(csv_data, 'honor')]
+        self.assertEqual(len(data), 2)
+        self.assertTrue(data[1].endswith(';;Error en el bloque 1, no se realizaron cambios\r\n'))
+        self.assertFalse(User.objects.filter(email="aux.student3@edx.org").exists())
+
+    @override_settings(CELERY_ALWAYS_EAGER=True, NORTEAMERICANO_EMAIL_BATCH_SIZE=2)
+    def test_send_enroll_emails(self):
+        """
+            Test the enroll emails are sent in batches
+        """
+        emails_data = [{
+            'email': 'student{}@edx.org'.format(x),
+            'user_name': 'Student {}'.format(x),
+            'password': 'password' if x % 2 else '',
+            'course_name': 'test course'
+            } for x in range(5)]
+        with patch('norteamericanoapi.email_tasks.enroll_emails.delay', side_effect=enroll_emails) as delay:
+            send_enroll_emails(emails_data, 'https://test.com/login')
+        self.assertEqual(delay.call_count, 3)
+        self.assertEqual([x.to for x in mail.outbox], [[x['email']] for x in emails_data])
+        self.assertEqual(mail.outbox[0].subject, 'Inscripción en el curso: test course')
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+
+    @patch('norteamericanoapi.email_tasks.get_connection')
+    def test_enroll_emails_one_connection(self, get_connection):
+        """
+            Test the batch is sent over one connection and the failures are reported by recipient
+        """
+        connection = Mock()
+        def send_messages(messages):
+            if messages[0].to == ['student1@edx.org']:
+                raise Exception('Recipient refused')
+            return 1
+        connection.send_messages.side_effect = send_messages
+        get_connection.return_value = connection
+        emails_data = [{
+            'email': 'student{}@edx.org'.format(x),
+            'user_name': 'Student {}'.format(x),
+            'password': '',
+            'course_name': 'test course'
+            } for x in range(3)]
+        result = enroll_emails(emails_data, 'https://test.com/login')
+        self.assertEqual(result, {'sent': ['student0@edx.org', 'student2@edx.org'], 'failed': ['student1@edx.org']})
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(connection.send_messages.call_count, 3)
+
     @patch('norteamericanoapi.views.file_to_csvreader')
     def test_enroll_csv_anonymous_user(self, csv_reader):
         """
@@ -267,6 +424,39 @@ class TestEnrollCSV(ModuleStoreTestCase):
             create_user_by_data({'names':'aa bb', 'lastnames':'cc dd','pass': '1234','email':'aux11@test.ts'}).username,
             'aa_cc2')
 
+    @override_settings(NORTEAMERICANO_PASSWORD_HASH_WORKERS=2)
+    def test_hash_passwords(self):
+        """
+            Test the passwords of the new users are hashed in a process pool
+        """
+        passwords = ['password{}'.format(x) for x in range(10)]
+        executor = create_password_hash_pool()
+        try:
+            hashes = hash_passwords(passwords, executor)
+        finally:
+            executor.shutdown()
+        self.assertEqual(len(hashes), 10)
+        for password, password_hash in zip(passwords, hashes):
+            self.assertTrue(check_password(password, password_hash))
+        # without pool they are hashed serially
+        self.assertTrue(check_password('password0', hash_passwords(passwords[:1])[0]))
+
+    @override_settings(REGISTRATION_EMAIL_PATTERNS_DISALLOWED=True)
+    def test_create_user_password_hash(self):
+        """
+            Test create user with the hash of the password already generated
+        """
+        password_hash = make_password('asd123asd123')
+        user = create_user_by_data(
+            {'names':'aa bb', 'lastnames':'cc dd', 'pass': 'asd123asd123', 'email':'aux1@test.ts'},
+            password_hash=password_hash)
+        user = User.objects.get(id=user.id)
+        self.assertEqual(user.username, 'aa_cc')
+        self.assertTrue(user.is_active)
+        self.assertEqual(user.password, password_hash)
+        self.assertTrue(user.check_password('asd123asd123'))
+        self.assertEqual(user.profile.name, 'aa bb cc dd')
+
     @override_settings(REGISTRATION_EMAIL_PATTERNS_DISALLOWED=True)
     def test_long_name(self):
         """
@@ -295,6 +485,107 @@ class TestEnrollCSV(ModuleStoreTestCase):
             generate_username(user_data),
             "name_last1")
 
+    def test_generate_username_suffix_queries(self):
+        """
+            Test generate username numeric suffix is resolved with a fixed number of queries
+        """
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            for username in ['xx_yy', 'xx_yy1', 'xx_yy2', 'xx_yy04']:
+                UserFactory(username=username, email='{}@test.ts'.format(username))
+        user_data = {
+            'names': 'xx',
+            'lastnames': 'yy',
+            }
+        with self.assertNumQueries(2):
+            self.assertEqual(generate_username(user_data), "xx_yy3")
+
+    def test_generate_username_reservation(self):
+        """
+            Test generate username with the reservation table of an upload
+        """
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            UserFactory(username='aa_cc', email='aa_cc@test.ts')
+        user_data = {
+            'names': 'aa bb',
+            'lastnames': 'cc dd',
+            }
+        usernames = UsernameReservation()
+        with self.assertNumQueries(1):
+            self.assertTrue(usernames.load(username_prefixes(user_data)))
+        with self.assertNumQueries(0):
+            self.assertEqual(generate_username(user_data, usernames=usernames), 'aa_cc_d')
+            self.assertEqual(generate_username(user_data, usernames=usernames), 'aa_cc_dd')
+
+    def test_preload_enroll_data(self):
+        """
+            Test the NAExtraInfo and User of the enroll rows are loaded with a fixed number of queries
+        """
+        na_user = NAExtraInfo.objects.create(
+            user=self.student,
+            na_names='names',
+            na_lastname_p='father lastname',
+            na_lastname_m='mother lastname',
+            na_rut='11111111-1',
+            na_birth_date='10/10/2020',
+            na_phone='123456789'
+        )
+        rows = [
+            prepare_enroll_row([self.student.email, 'a', 'b', 'c', '11.111.111-1', '10/10/2020', '12345689', str(self.course.id)]),
+            prepare_enroll_row([self.staff_user.email.upper(), 'a', 'b', 'c', 'P123456', '10/10/2020', '12345689', str(self.course.id)]),
+            prepare_enroll_row(['new.student@edx.org', 'a', 'b', 'c', 'P654321', '10/10/2020', '12345689', str(self.course.id)]),
+        ]
+        self.assertTrue(all(valid for row, valid in rows))
+        with self.assertNumQueries(3):
+            data = preload_enroll_data([row for row, valid in rows])
+        self.assertEqual(data['na_users']['11111111-1'].user, self.student)
+        self.assertEqual(data['users'][self.staff_user.email], self.staff_user)
+        self.assertFalse('new.student@edx.org' in data['users'])
+        self.assertEqual(data['na_user_ids'], set([self.student.id]))
+
+    def test_resolve_courses(self):
+        """
+            Test the courses of the enroll rows are validated with one query
+        """
+        course_ids = [str(self.course.id), str(self.course2.id), str(self.course.id), 'course-v1:eol+Test202v2+2022', 'asd', '']
+        with self.assertNumQueries(1):
+            courses = resolve_courses(course_ids)
+        self.assertEqual(courses[str(self.course.id)].display_name_with_default, '2022')
+        self.assertEqual(courses[str(self.course2.id)].display_name_with_default, '2021')
+        self.assertIsNone(courses['course-v1:eol+Test202v2+2022'])
+        self.assertIsNone(courses['asd'])
+        self.assertIsNone(courses[''])
+        with self.assertNumQueries(0):
+            resolve_courses([str(self.course.id), 'asd'], courses)
+
+    @override_settings(REGISTRATION_EMAIL_PATTERNS_DISALLOWED=True)
+    def test_enroll_chunks(self):
+        """
+            Test each chunk of the enroll rows is committed on its own
+            and a failed row only rolls back its own changes
+        """
+        if not HAVE_NA_MODEL:
+            self.skipTest("import error norteamericano_form")
+        csv_data = [
+            ['aux.student2@edx.org', 'LastNameP', 'LastNameM', 'User', 'P123456','10/10/2020','12345689', str(self.course.id)],
+            ['qwe@edx.org', 'LastNameP', 'LastNameM', 'User', '456789123','10/10/2020','12345689', str(self.course.id)],
+            ['aux.student3@edx.org', 'LastNameP', 'LastNameM', 'User', 'P789456','10/10/2020','12345689', str(self.course.id)],
+            ['aux.student4@edx.org', 'LastNameP', 'LastNameM', 'User', 'P147258','10/10/2020','12345689', str(self.course.id)],
+        ]
+        progress = Mock()
+        with patch('norteamericanoapi.utils.enroll_course_user', side_effect=[None, Exception('error'), None]):
+            data = enroll_create_user_with_custom_fields(csv_data, 'honor', progress=progress, chunk_size=2)
+        self.assertEqual(data['new_data'][1][-2:], ['user_lastnamep', 'Creado e Inscrito'])
+        self.assertEqual(data['new_data'][2][-1], 'Rut/Pasaporte invalido')
+        self.assertEqual(data['new_data'][3][-2:], ['', 'Error al procesar la fila, no se realizaron cambios'])
+        self.assertEqual(data['new_data'][4][-1], 'Creado e Inscrito')
+        self.assertEqual(len(data['emails_data']), 2)
+        self.assertTrue(NAExtraInfo.objects.filter(na_rut='P123456').exists())
+        self.assertFalse(NAExtraInfo.objects.filter(na_rut='P789456').exists())
+        self.assertFalse(User.objects.filter(email='aux.student3@edx.org').exists())
+        self.assertTrue(NAExtraInfo.objects.filter(na_rut='P147258').exists())
+        self.assertEqual(progress.call_args_list[0][0], (2, 1))
+        self.assertEqual(progress.call_args_list[1][0], (4, 2))
+
     def test_enroll_csv_get(self):
         """
             test enroll user csv view GET method
@@ -466,6 +757,54 @@ class TestEnrollAPI(ModuleStoreTestCase):
         response = EnrollApi().create_enroll_user(body, 'https://test.web.st/login')
         self.assertEqual(response, 'EL correo esta asociado a otro rut')
 
+    @override_settings(REGISTRATION_EMAIL_PATTERNS_DISALLOWED=True)
+    @patch('norteamericanoapi.rest_api.send_enroll_emails')
+    def test_enroll_bulk_api(self, send_enroll_emails):
+        """
+            Test bulk enroll api, the result of each student is returned in order
+        """
+        student = {
+            "email":'student555@edx.org',
+            "lastname_1":"asdasd",
+            "lastname_2":"asdasdasd",
+            "names":"ASdsads",
+            "rut":'P012345',
+            "birthday":"12/12/1212",
+            "phone":"1234578",
+            "course":str(self.course.id),
+            "mode":'honor'
+        }
+        students = [
+            student,
+            dict(student, email=self.student.email, rut='11.111.111-1', mode='audit'),
+            dict(student, email=self.student.email, rut='P111111111'),
+            dict(student, email='student666@edx.org', rut='P0123456', course='course-v1:eol+Tes+t202+2021'),
+            dict(student, email='asd@', rut='P01234567'),
+        ]
+        response = EnrollBulkApi().create_enroll_users(students, 'https://test.web.st/login')
+        self.assertEqual(len(response), 5)
+        self.assertEqual(response[0]['result'], 'success')
+        self.assertEqual(response[0]['email'], 'student555@edx.org')
+        self.assertEqual(response[1], {'email': self.student.email, 'result': 'success', 'username': self.student.username})
+        self.assertEqual(response[2], {'email': self.student.email, 'result': 'error', 'error': 'EL correo esta asociado a otro rut'})
+        self.assertEqual(response[3]['result'], 'error')
+        self.assertTrue('course' in response[3]['error'])
+        self.assertEqual(response[4]['result'], 'error')
+        self.assertTrue('email' in response[4]['error'])
+        aux_na_user = NAExtraInfo.objects.get(na_rut='P012345')
+        self.assertEqual(aux_na_user.user.email, 'student555@edx.org')
+        self.assertFalse(NAExtraInfo.objects.filter(na_rut='P111111111').exists())
+        self.assertEqual(sum(len(x[0][0]) for x in send_enroll_emails.call_args_list), 2)
+
+    def test_enroll_bulk_serializer(self):
+        """
+            Test bulk enroll serializer limits
+        """
+        self.assertFalse(EnrollBulkSerializer(data={'students': []}).is_valid())
+        with override_settings(NORTEAMERICANO_ENROLL_BULK_MAX=1):
+            self.assertFalse(EnrollBulkSerializer(data={'students': [{}, {}]}).is_valid())
+        self.assertTrue(EnrollBulkSerializer(data={'students': [{}, {}]}).is_valid())
+
 class TestUnenrollSerializers(ModuleStoreTestCase):
     def setUp(self):
         super(TestUnenrollSerializers, self).setUp()
@@ -552,7 +891,138 @@ class TestUnenrollAPI(ModuleStoreTestCase):
             "rut":na_user.na_rut,
             "course":str(self.course.id)
         }
+        CourseEnrollmentFactory(user=self.student, course_id=self.course.id)
         UnenrollApi().unenroll_user(body)
+        self.assertFalse(CourseEnrollment.objects.get(user=self.student, course_id=self.course.id).is_active)
+
+    def test_unenroll_bulk_api(self):
+        """
+            Test bulk unenroll api, the ruts are resolved together and the result of each student is returned in order
+        """
+        NAExtraInfo.objects.create(
+            user=self.student,
+            na_names='names',
+            na_lastname_p='father lastname',
+            na_lastname_m='mother lastname',
+            na_rut='11111111-1',
+            na_birth_date='10/10/2020',
+            na_phone='123456789'
+        )
+        NAExtraInfo.objects.create(
+            user=self.student_2,
+            na_names='names',
+            na_lastname_p='father lastname',
+            na_lastname_m='mother lastname',
+            na_rut='P123456',
+            na_birth_date='10/10/2020',
+            na_phone='123456789'
+        )
+        CourseEnrollmentFactory(user=self.student, course_id=self.course.id)
+        CourseEnrollmentFactory(user=self.student_2, course_id=self.course.id)
+        CourseEnrollmentAllowedFactory(email=self.student_2.email, course_id=self.course.id, user=self.student_2)
+        students = [
+            {"rut": '11.111.111-1', "course": str(self.course.id)},
+            {"rut": 'p123456', "course": str(self.course.id)},
+            {"rut": 'P654321', "course": str(self.course.id)},
+            {"rut": '11111111-1', "course": 'course-v1:eol+Tes+t202+2021'},
+        ]
+        response = UnenrollBulkApi().unenroll_users(students)
+        self.assertEqual(response[0], {'rut': '11111111-1', 'result': 'success'})
+        self.assertEqual(response[1], {'rut': 'P123456', 'result': 'success'})
+        self.assertEqual(response[2]['result'], 'error')
+        self.assertTrue('rut' in response[2]['error'])
+        self.assertEqual(response[3]['result'], 'error')
+        self.assertTrue('course' in response[3]['error'])
+        self.assertFalse(CourseEnrollment.objects.filter(course_id=self.course.id, is_active=True).exists())
+        self.assertFalse(CourseEnrollmentAllowed.objects.filter(course_id=self.course.id).exists())
+
+class TestUnenrollCSV(ModuleStoreTestCase):
+    def setUp(self):
+        super(TestUnenrollCSV, self).setUp()
+        self.course = CourseFactory.create(
+            org='mss',
+            course='999',
+            display_name='2022',
+            emit_signals=True)
+        aux = CourseOverview.get_from_id(self.course.id)
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            content_type = ContentType.objects.get_for_model(NAExtraInfo)
+            permission = Permission.objects.get(
+                codename='na_instructor_staff',
+                content_type=content_type,
+            )
+            self.client = Client()
+            self.user_staff = UserFactory(
+                username='testuser3',
+                password='12345',
+                email='staff@edx.org',
+                is_staff=True)
+            self.user_staff.user_permissions.add(permission)
+            self.client.login(username='testuser3', password='12345')
+            self.student = UserFactory(
+                username='student',
+                password='12345',
+                email='student@edx.org')
+
+    def test_unenroll_csv(self):
+        """
+            Test unenroll user csv
+        """
+        NAExtraInfo.objects.create(
+            user=self.student,
+            na_names='names',
+            na_lastname_p='father lastname',
+            na_lastname_m='mother lastname',
+            na_rut='11111111-1',
+            na_birth_date='10/10/2020',
+            na_phone='123456789'
+        )
+        CourseEnrollmentFactory(user=self.student, course_id=self.course.id)
+        csv_content = 'RUT;Id Curso\n'
+        csv_content += '11.111.111-1;{}\n'.format(self.course.id)
+        csv_content += 'P654321;{}\n'.format(self.course.id)
+        csv_content += '\n'
+        csv_content += ';\n'
+        csv_content += '123;{}\n'.format(self.course.id)
+        csv_content += '11111111-1;course-v1:eol+Tes+t202+2021\n'
+        csv_content += '11111111-1\n'
+        post_data = {
+            "file": SimpleUploadedFile('unenroll.csv', csv_content.encode('utf-8'), content_type='text/csv'),
+        }
+        response = self.client.post(reverse('norteamericanoapi:unenroll'), post_data)
+        self.assertEqual(response.status_code, 200)
+        data = [x.decode() for x in response.streaming_content]
+        expect = [
+            'RUT;Id curso;Estado\r\n',
+            '11111111-1;{};Desinscrito\r\n'.format(self.course.id),
+            'P654321;{};Rut/Pasaporte no registrado\r\n'.format(self.course.id),
+            '123;{};Rut/Pasaporte invalido\r\n'.format(self.course.id),
+            '11111111-1;course-v1:eol+Tes+t202+2021;Id curso invalido o curso no existe\r\n',
+            '11111111-1;;Faltan datos\r\n',
+        ]
+        self.assertEqual(data, expect)
+        self.assertFalse(CourseEnrollment.objects.get(user=self.student, course_id=self.course.id).is_active)
+
+    def test_unenroll_csv_get(self):
+        """
+            Test unenroll csv view get and permissions
+        """
+        response = self.client.get(reverse('norteamericanoapi:unenroll'))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('norteamericanoapi:unenroll'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("id=\"not_file\"" in response._container[0].decode())
+        response = Client().get(reverse('norteamericanoapi:unenroll'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_unenroll_export(self):
+        """
+            test export unenroll csv
+        """
+        response = self.client.get(reverse('norteamericanoapi:unenroll-export'))
+        self.assertEqual(response.status_code, 200)
+        data = [x.decode() for x in response._container]
+        self.assertEqual(data, ['', "RUT;Id Curso\r\n"])
 
 class TestEnrollExportCSV(ModuleStoreTestCase):
     def setUp(self):
@@ -709,3 +1179,262 @@ class TestCourseStaffEnrollApi(ModuleStoreTestCase):
         }
         CourseStaffEnrollApi().coursestaff_user(body)
         self.assertFalse(CourseInstructorRole(self.course.id).has_user(self.student2))
+
+    def test_coursestaff_bulk_api(self):
+        """
+            Test bulk coursestaff api, the roles are applied by course and the result of each record is returned in order
+        """
+        course2 = CourseFactory.create(
+            org='mss',
+            course='888',
+            display_name='2023',
+            emit_signals=True)
+        aux = CourseOverview.get_from_id(course2.id)
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            inactive = UserFactory(
+                username='student333',
+                password='12345',
+                email='student333@edx.org',
+                is_active=False)
+        NAExtraInfo.objects.create(
+            user=inactive,
+            na_names='names',
+            na_lastname_p='father lastname',
+            na_lastname_m='mother lastname',
+            na_rut='P33333333',
+            na_birth_date='10/10/2020',
+            na_phone='123456789'
+        )
+        staff = [
+            {"rut": self.na_user.na_rut, "course": str(self.course.id), "action": 'enroll'},
+            {"rut": self.na_user.na_rut, "course": str(course2.id), "action": 'enroll'},
+            {"rut": self.na_user2.na_rut, "course": str(self.course.id), "action": 'unenroll'},
+            {"rut": 'p33333333', "course": str(self.course.id), "action": 'enroll'},
+            {"rut": 'P44444444', "course": str(self.course.id), "action": 'enroll'},
+            {"rut": self.na_user.na_rut, "course": str(self.course.id), "action": 'asd'},
+        ]
+        response = CourseStaffEnrollBulkApi().coursestaff_users(staff)
+        self.assertEqual([x['result'] for x in response], ['success', 'success', 'success', 'error', 'error', 'error'])
+        self.assertEqual(response[3]['error'], 'Usuario inactivo')
+        self.assertTrue('rut' in response[4]['error'])
+        self.assertTrue('action' in response[5]['error'])
+        self.assertTrue(CourseInstructorRole(self.course.id).has_user(User.objects.get(id=self.student.id)))
+        self.assertTrue(CourseInstructorRole(course2.id).has_user(User.objects.get(id=self.student.id)))
+        self.assertFalse(CourseInstructorRole(self.course.id).has_user(User.objects.get(id=self.student2.id)))
+        self.assertFalse(CourseInstructorRole(self.course.id).has_user(User.objects.get(id=inactive.id)))
+        self.assertTrue(CourseEnrollment.is_enrolled(self.student, course2.id))
+
+        # applying the same records again does not duplicate the roles
+        response = CourseStaffEnrollBulkApi().coursestaff_users(staff[:2])
+        self.assertEqual([x['result'] for x in response], ['success', 'success'])
+        self.assertEqual(CourseInstructorRole(self.course.id).users_with_role().filter(id=self.student.id).count(), 1)
+
+class TestNaRutCache(ModuleStoreTestCase):
+    ENABLED_CACHES = ['default', 'mongo_metadata_inheritance', 'loc_cache']
+
+    def setUp(self):
+        super(TestNaRutCache, self).setUp()
+        if not HAVE_NA_MODEL:
+            self.skipTest("import error norteamericano_form")
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            self.student = UserFactory(
+                username='student',
+                password='12345',
+                email='student@edx.org')
+        self.na_user = NAExtraInfo.objects.create(
+            user=self.student,
+            na_names='names',
+            na_lastname_p='father lastname',
+            na_lastname_m='mother lastname',
+            na_rut='11111111-1',
+            na_birth_date='10/10/2020',
+            na_phone='123456789'
+        )
+
+    @patch('norteamericanoapi.signals.transaction.on_commit', new=lambda func: func())
+    def test_get_na_users(self):
+        """
+            Test the users of the ruts are cached in the request and in the shared cache
+        """
+        expected = {'11111111-1': (self.na_user.id, self.student.id, 'student')}
+        self.assertEqual(get_na_users(['11111111-1', '22222222-2']), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_na_users(['11111111-1']), expected)
+        RequestCache(NA_RUT_CACHE_NAMESPACE).clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_na_user_ids(['11111111-1']), {'11111111-1': self.student.id})
+
+        # a changed rut is not resolved from the cache
+        self.na_user.na_rut = '22222222-2'
+        self.na_user.save()
+        self.assertEqual(get_na_users(['11111111-1']), {})
+        self.assertEqual(get_na_users(['22222222-2']), {'22222222-2': (self.na_user.id, self.student.id, 'student')})
+
+        self.student.username = 'student_new'
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            self.student.save()
+        self.assertEqual(get_na_users(['22222222-2']), {'22222222-2': (self.na_user.id, self.student.id, 'student_new')})
+
+        self.na_user.delete()
+        self.assertEqual(get_na_users(['22222222-2']), {})
+
+    def test_warm_na_rut_cache(self):
+        """
+            Test the command loads the ruts in the shared cache
+        """
+        call_command('warm_na_rut_cache', batch_size=1)
+        RequestCache(NA_RUT_CACHE_NAMESPACE).clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_na_users(['11111111-1']), {'11111111-1': (self.na_user.id, self.student.id, 'student')})
+
+class TestCachedBearerAuthentication(ModuleStoreTestCase):
+    ENABLED_CACHES = ['default', 'mongo_metadata_inheritance', 'loc_cache']
+
+    def setUp(self):
+        super(TestCachedBearerAuthentication, self).setUp()
+        if not HAVE_NA_MODEL:
+            self.skipTest("import error norteamericano_form")
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            content_type = ContentType.objects.get_for_model(NAExtraInfo)
+            permission = Permission.objects.get(
+                codename='na_instructor_staff',
+                content_type=content_type,
+            )
+            self.user_staff = UserFactory(
+                username='testuser3',
+                password='12345',
+                email='student2@edx.org',
+                is_staff=True)
+            self.user_staff.user_permissions.add(permission)
+        application = ApplicationFactory(user=self.user_staff)
+        self.token = AccessTokenFactory(
+            user=self.user_staff,
+            application=application,
+            expires=timezone.now() + datetime.timedelta(hours=1))
+
+    def test_cached_token(self):
+        """
+            Test the validated token and the permissions of the user are served from the cache
+        """
+        user, token = CachedBearerAuthentication().authenticate_credentials(self.token.token)
+        self.assertEqual(user.id, self.user_staff.id)
+        with self.assertNumQueries(0):
+            user, token = CachedBearerAuthentication().authenticate_credentials(self.token.token)
+            self.assertTrue(user.has_perm('norteamericano_form.na_instructor_staff'))
+        self.assertEqual(token.id, self.token.id)
+
+    @patch('norteamericanoapi.signals.transaction.on_commit', new=lambda func: func())
+    def test_deleted_token(self):
+        """
+            Test the token is revoked from the cache when it is deleted
+        """
+        CachedBearerAuthentication().authenticate_credentials(self.token.token)
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            CachedBearerAuthentication().authenticate_credentials(self.token.token)
+
+    @patch('norteamericanoapi.signals.transaction.on_commit', new=lambda func: func())
+    def test_changed_user(self):
+        """
+            Test the token is revoked from the cache when the user or its permissions change
+        """
+        CachedBearerAuthentication().authenticate_credentials(self.token.token)
+        self.user_staff.last_login = timezone.now()
+        self.user_staff.save(update_fields=['last_login'])
+        self.assertIsNotNone(cache.get(token_cache_key(self.token.token)))
+        self.user_staff.user_permissions.clear()
+        self.assertIsNone(cache.get(token_cache_key(self.token.token)))
+        user, token = CachedBearerAuthentication().authenticate_credentials(self.token.token)
+        self.assertFalse(user.has_perm('norteamericano_form.na_instructor_staff'))
+
+        self.assertIsNotNone(cache.get(token_cache_key(self.token.token)))
+        self.user_staff.is_active = False
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            self.user_staff.save()
+        self.assertIsNone(cache.get(token_cache_key(self.token.token)))
+        user, token = CachedBearerAuthentication().authenticate_credentials(self.token.token)
+        self.assertFalse(user.is_active)
+
+    def test_token_near_expiration(self):
+        """
+            Test a token that expires soon is not cached
+        """
+        self.token.expires = timezone.now() + datetime.timedelta(seconds=10)
+        self.token.save()
+        CachedBearerAuthentication().authenticate_credentials(self.token.token)
+        self.assertIsNone(cache.get(token_cache_key(self.token.token)))
+
+class TestThrottle(ModuleStoreTestCase):
+    ENABLED_CACHES = ['default', 'mongo_metadata_inheritance', 'loc_cache']
+
+    def setUp(self):
+        super(TestThrottle, self).setUp()
+        if not HAVE_NA_MODEL:
+            self.skipTest("import error norteamericano_form")
+        with patch('common.djangoapps.student.models.cc.User.save'):
+            content_type = ContentType.objects.get_for_model(NAExtraInfo)
+            permission = Permission.objects.get(
+                codename='na_instructor_staff',
+                content_type=content_type,
+            )
+            self.client = Client()
+            self.user_staff = UserFactory(
+                username='testuser3',
+                password='12345',
+                email='student2@edx.org',
+                is_staff=True)
+            self.user_staff.user_permissions.add(permission)
+            self.client.login(username='testuser3', password='12345')
+
+    @override_settings(NORTEAMERICANO_THROTTLE_RATES={'enroll': ('2/min', 2)})
+    def test_consume_throttle(self):
+        """
+            Test the bucket allows the burst and then one request every 30 seconds
+        """
+        with patch('norteamericanoapi.throttling.time.time', return_value=1000.0):
+            self.assertEqual(consume_throttle('enroll', 'token.1'), 0)
+            self.assertEqual(consume_throttle('enroll', 'token.1'), 0)
+            self.assertAlmostEqual(consume_throttle('enroll', 'token.1'), 30)
+            # other client has its own bucket
+            self.assertEqual(consume_throttle('enroll', 'token.2'), 0)
+        with patch('norteamericanoapi.throttling.time.time', return_value=1030.0):
+            self.assertEqual(consume_throttle('enroll', 'token.1'), 0)
+            self.assertAlmostEqual(consume_throttle('enroll', 'token.1'), 30)
+
+    @override_settings(NORTEAMERICANO_THROTTLE_RATES={'enroll': ('2/min', 2)})
+    def test_consume_throttle_locked(self):
+        """
+            Test the request is allowed without taking a token while other request holds the lock of the bucket
+        """
+        cache.add('norteamericanoapi.throttle_lock.enroll.token.1', 1, 60)
+        with patch('norteamericanoapi.throttling.time.sleep') as sleep:
+            for x in range(3):
+                self.assertEqual(consume_throttle('enroll', 'token.1'), 0)
+        self.assertEqual(sleep.call_count, 15)
+        self.assertIsNone(cache.get('norteamericanoapi.throttle.enroll.token.1'))
+        cache.delete('norteamericanoapi.throttle_lock.enroll.token.1')
+        with patch('norteamericanoapi.throttling.time.time', return_value=1000.0):
+            self.assertEqual(consume_throttle('enroll', 'token.1'), 0)
+            self.assertEqual(consume_throttle('enroll', 'token.1'), 0)
+            self.assertAlmostEqual(consume_throttle('enroll', 'token.1'), 30)
+        self.assertIsNone(cache.get('norteamericanoapi.throttle_lock.enroll.token.1'))
+
+    @override_settings(NORTEAMERICANO_THROTTLE_RATES={'enroll': None})
+    def test_consume_throttle_disabled(self):
+        """
+            Test a scope without rate is not throttled
+        """
+        for x in range(5):
+            self.assertEqual(consume_throttle('enroll', 'token.1'), 0)
+
+    @override_settings(NORTEAMERICANO_THROTTLE_RATES={'enroll_csv': ('1/hour', 1)})
+    def test_enroll_csv_throttled(self):
+        """
+            Test the enroll csv returns 429 with Retry-After when the rate is exceeded
+        """
+        post_data = {'mode': 'honor'}
+        response = self.client.post(reverse('norteamericanoapi:enroll'), post_data)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('norteamericanoapi:enroll'), post_data)
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(3500 < int(response['Retry-After']) <= 3600)
@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.throttling import BaseThrottle
+from .cache import get_shared_cache
+
+import math
+import logging
+import time
+logger = logging.getLogger(__name__)
+
+# scope -> (rate, burst), the bucket holds burst requests and is refilled at the rate
+THROTTLE_RATES = {
+    'enroll': ('600/min', 60),
+    'enroll_bulk': ('30/min', 5),
+    'rerun': ('60/hour', 10),
+    'rerun_bulk': ('10/hour', 2),
+    'rerun_events': ('60/min', 10),
+    'unenroll_bulk': ('30/min', 5),
+    'course_staff_bulk': ('30/min', 5),
+    'course_data_bulk': ('30/min', 5),
+    'enroll_csv': ('30/hour', 5),
+    'unenroll_csv': ('30/hour', 5),
+    'rerun_csv': ('10/hour', 2),
+    'course_dates_csv': ('30/hour', 5),
+}
+THROTTLE_KEY = 'norteamericanoapi.throttle.{}.{}'
+THROTTLE_LOCK_KEY = 'norteamericanoapi.throttle_lock.{}.{}'
+THROTTLE_LOCK_TIMEOUT = 1
+THROTTLE_LOCK_RETRIES = 5
+THROTTLE_LOCK_SLEEP = 0.01
+THROTTLE_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def get_throttle_rate(scope):
+    """
+        Return (requests by second, burst) of the scope, None if it is not throttled.
+        The rates are overridden by NORTEAMERICANO_THROTTLE_RATES.
+    """
+    rates = dict(THROTTLE_RATES)
+    rates.update(getattr(settings, 'NORTEAMERICANO_THROTTLE_RATES', {}))
+    if rates.get(scope) is None:
+        return None
+    rate, burst = rates[scope]
+    num, period = rate.split('/')
+    return int(num) / THROTTLE_PERIODS[period[0]], int(burst)
+
+def get_throttle_ident(request):
+    """
+        Return the client of the request: the access token, else the user, else the ip
+    """
+    auth = getattr(request, 'auth', None)
+    if getattr(auth, 'id', None) is not None:
+        return 'token.{}'.format(auth.id)
+    if request.user.is_authenticated:
+        return 'user.{}'.format(request.user.id)
+    return 'ip.{}'.format(BaseThrottle().get_ident(request))
+
+def consume_throttle(scope, ident):
+    """
+        Take a request from the token bucket of the client in the scope.
+        Return 0 if the request is allowed, else the seconds to wait.
+        The bucket is read and written holding a lock in the shared cache,
+        if the lock is still busy after a few retries the request is allowed
+        without taking a token, so concurrent requests of a client within its
+        rate are never denied.
+    """
+    rate = get_throttle_rate(scope)
+    if rate is None:
+        return 0
+    refill, burst = rate
+    shared_cache = get_shared_cache()
+    lock_key = THROTTLE_LOCK_KEY.format(scope, ident)
+    for retry in range(THROTTLE_LOCK_RETRIES):
+        if shared_cache.add(lock_key, 1, THROTTLE_LOCK_TIMEOUT):
+            break
+        time.sleep(THROTTLE_LOCK_SLEEP)
+    else:
+        logger.warning("NorteamericanoThrottle - Bucket is locked, request allowed, scope: {}, client: {}".format(scope, ident))
+        return 0
+    try:
+        cache_key = THROTTLE_KEY.format(scope, ident)
+        now = time.time()
+        tokens, last = shared_cache.get(cache_key, (burst, now))
+        # rounded, the float error must not deny a request that is due
+        tokens = min(burst, round(tokens + (now - last) * refill, 6))
+        if tokens < 1:
+            return (1 - tokens) / refill
+        # the bucket is full again after burst / refill seconds
+        shared_cache.set(cache_key, (tokens - 1, now), int(math.ceil(burst / refill)) + 1)
+        return 0
+    finally:
+        shared_cache.delete(lock_key)
+
+def throttle_response(request, scope):
+    """
+        Return a 429 response with Retry-After if the client of the request
+        exceeded the rate of the scope, else None
+    """
+    ident = get_throttle_ident(request)
+    wait = consume_throttle(scope, ident)
+    if not wait:
+        return None
+    logger.error("NorteamericanoThrottle - Rate exceeded, scope: {}, client: {}".format(scope, ident))
+    response = HttpResponse('Demasiadas solicitudes, intente nuevamente en {} segundos'.format(int(math.ceil(wait))), status=429)
+    response['Retry-After'] = str(int(math.ceil(wait)))
+    return response
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+        Throttle by client and view with token bucket semantics,
+        the scope is the throttle_scope of the view
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope is None:
+            return True
+        self.wait_time = consume_throttle(scope, get_throttle_ident(request))
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
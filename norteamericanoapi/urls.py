@@ -3,14 +3,19 @@ from django.conf.urls import url
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from .views import *
-from .rest_api import ReRunPendingCourseApi, ReRunApi, CourseDataApi
+from .rest_api import ReRunPendingCourseApi, ReRunEventsApi, ReRunApi, ReRunBulkApi, CourseDataApi, CourseDataBulkApi
 
 
 urlpatterns = [
     url(r'^api/v0/pending-courses/$', ReRunPendingCourseApi.as_view(), name='pending-courses-api'),
+    url(r'^api/v0/pending-courses/events/$', ReRunEventsApi.as_view(), name='pending-courses-events-api'),
     url(r'^api/v0/rerun/$', ReRunApi.as_view(), name='rerun-api'),
+    url(r'^api/v0/rerun-bulk/$', ReRunBulkApi.as_view(), name='rerun-bulk-api'),
     url(r'^rerun/$', NorteamericanoReRun.as_view(), name='rerun'),
     url(r'^rerun-export/$', NorteamericanoReRunExport.as_view(), name='rerun-export'),
     url(r'^pending-courses/$', NorteamericanoReRunPendingCourse.as_view(), name='pending-courses'),
     url(r'^api/v0/course-data/$', CourseDataApi.as_view(), name='course-data-api'),
+    url(r'^api/v0/course-data-bulk/$', CourseDataBulkApi.as_view(), name='course-data-bulk-api'),
+    url(r'^course-dates/$', NorteamericanoCourseDates.as_view(), name='course-dates'),
+    url(r'^course-dates-export/$', NorteamericanoCourseDatesExport.as_view(), name='course-dates-export'),
 ]
@@ -3,13 +3,20 @@ from django.conf.urls import url
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from .views import *
-from .rest_api import EnrollApi, UnenrollApi, ReRunPendingCourseApi, ReRunApi, CourseStaffEnrollApi
+from .rest_api import EnrollApi, EnrollBulkApi, UnenrollApi, UnenrollBulkApi, ReRunPendingCourseApi, ReRunApi, CourseStaffEnrollApi, CourseStaffEnrollBulkApi
 
 
 urlpatterns = [
     url(r'^enroll/$', NorteamericanoEnroll.as_view(), name='enroll'),
     url(r'^api/v0/enroll/$', EnrollApi.as_view(), name='enroll-api'),
+    url(r'^api/v0/enroll-bulk/$', EnrollBulkApi.as_view(), name='enroll-bulk-api'),
     url(r'^api/v0/unenroll/$', UnenrollApi.as_view(), name='unenroll-api'),
+    url(r'^api/v0/unenroll-bulk/$', UnenrollBulkApi.as_view(), name='unenroll-bulk-api'),
     url(r'^api/v0/course-staff/$', CourseStaffEnrollApi.as_view(), name='course-staff-api'),
+    url(r'^api/v0/course-staff-bulk/$', CourseStaffEnrollBulkApi.as_view(), name='course-staff-bulk-api'),
     url(r'^enroll-export/$', NorteamericanoEnrollExport.as_view(), name='enroll-export'),
+    url(r'^unenroll/$', NorteamericanoUnenroll.as_view(), name='unenroll'),
+    url(r'^unenroll-export/$', NorteamericanoUnenrollExport.as_view(), name='unenroll-export'),
+    url(r'^enroll-status/(?P<job_id>[0-9a-f]{32})/$', NorteamericanoEnrollStatus.as_view(), name='enroll-status'),
+    url(r'^enroll-download/(?P<job_id>[0-9a-f]{32})/$', NorteamericanoEnrollDownload.as_view(), name='enroll-download'),
 ]
@@ -5,20 +5,24 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.shortcuts import get_current_site
 from django.db import transaction
+from django.db.models import Q
 from django.urls import reverse
 from urllib.parse import urlencode
-from itertools import cycle
+from itertools import cycle, islice
 from opaque_keys.edx.keys import CourseKey
 from opaque_keys import InvalidKeyError
 from lms.djangoapps.courseware.courses import get_course_by_id, get_course_with_access
 from xmodule.modulestore.django import modulestore
 from common.djangoapps.student import auth
-from common.djangoapps.student.roles import CourseInstructorRole, CourseStaffRole
+from common.djangoapps.student.roles import CourseInstructorRole, CourseStaffRole, OrgInstructorRole, OrgStaffRole
 from common.djangoapps.course_action_state.models import CourseRerunState
 from xmodule.modulestore import EdxJSONEncoder
 from xmodule.course_module import DEFAULT_START_DATE, CourseFields
-from openedx.core.djangoapps.models.course_details import CourseDetails
 from lms.djangoapps.courseware.access import has_access
+from edx_django_utils.cache import RequestCache
+from .cache import course_exists, pending_course_exists, get_cached_na_ruts
+from .models import RerunQueueItem
+from .rerun_tasks import enqueue_rerun, schedule_reruns, get_rerun_status, get_queued_course_keys, rerun_course_key
 from datetime import datetime as dt
 import unidecode
 import logging
@@ -27,7 +31,12 @@ import six
 import csv
 import re
 import io
+import codecs
+import os
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
 from django.contrib.auth.base_user import BaseUserManager
+from django.contrib.auth.hashers import make_password
 try:
     from norteamericano_form.models import NAExtraInfo
     HAVE_NA_MODEL = True
@@ -37,25 +46,39 @@ logger = logging.getLogger(__name__)
 regex = r'^(([^<>()\[\]\.,;:\s@\"]+(\.[^<>()\[\]\.,;:\s@\"]+)*)|(\".+\"))@(([^<>()[\]\.,;:\s@\"]+\.)+[^<>()[\]\.,;:\s@\"]{2,})$'
 regex_names = r'^[A-Za-z\s\_]+$'
 USERNAME_MAX_LENGTH = 30
+USERNAME_BATCH_SIZE = 50
+USERNAME_SUFFIX_MAX = 10000
+USERNAME_BASE_DEFAULT = 'usuario'
+PRELOAD_BATCH_SIZE = 500
+ENROLL_CHUNK_SIZE = 500
+PASSWORD_HASH_POOL_MIN = 8
+PERMISSIONS_CACHE_NAMESPACE = 'norteamericanoapi.permissions'
+ENROLL_HEADER = ['Email', 'Apellido Paterno', 'Apellido Materno', 'Nombres', 'RUT', 'Fecha de Nacimiento', 'Fono', 'Id curso', 'Username', 'Estado']
+UNENROLL_HEADER = ['RUT', 'Id curso', 'Estado']
 
-def create_user_by_data(user_data, is_api=False):
+def create_user_by_data(user_data, is_api=False, usernames=None, password_hash=None):
     """
-    Create the user by the Django model
+    Create the user by the Django model.
+    If password_hash (hash of user_data['pass']) is given it is set as
+    the password of the account created by do_create_account.
     """
     from openedx.core.djangoapps.user_authn.views.registration_form import AccountCreationForm
     from common.djangoapps.student.helpers import do_create_account
     user_pass = user_data['pass']  # Temporary password
     form = AccountCreationForm(
         data={
-            "username": generate_username(user_data),
+            "username": generate_username(user_data, usernames=usernames),
             "email": user_data['email'],
             "password": user_pass,
-            "name":  user_data['nombreCompleto'] if is_api else '{} {}'.format(user_data['names'], ['lastnames']),
+            "name":  user_data['nombreCompleto'] if is_api else '{} {}'.format(user_data['names'], user_data['lastnames']),
         },
         tos_required=False,
         ignore_email_blacklist=True
     )
     user, _, reg = do_create_account(form)
+    if password_hash is not None:
+        user.password = password_hash
+        user.save(update_fields=['password'])
     reg.activate()
     reg.save()
     #from common.djangoapps.student.models import create_comments_service_user
@@ -63,7 +86,37 @@ def create_user_by_data(user_data, is_api=False):
 
     return user
 
-def generate_username(user_data, is_api=False):
+def hash_passwords(passwords, executor=None):
+    """
+        Hash the passwords in the process pool executor (see
+        create_password_hash_pool). The passwords are hashed serially
+        without executor, if there are few of them or the pool can not be
+        started (e.g. inside a daemonic celery worker).
+    """
+    passwords = [unicodedata.normalize('NFKC', x) for x in passwords]
+    if executor is not None and len(passwords) >= PASSWORD_HASH_POOL_MIN:
+        try:
+            chunksize = -(-len(passwords) // get_password_hash_workers())
+            return list(executor.map(make_password, passwords, chunksize=chunksize))
+        except Exception as e:
+            logger.warning('NorteamericanoEnroll - Process pool not available, hashing passwords serially: {}'.format(str(e)))
+    return [make_password(x) for x in passwords]
+
+def create_password_hash_pool():
+    """
+        Return a pool of NORTEAMERICANO_PASSWORD_HASH_WORKERS processes (all
+        the cpus by default) for hash_passwords, None with one worker.
+        The caller shuts it down at the end of the import.
+    """
+    workers = get_password_hash_workers()
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers)
+
+def get_password_hash_workers():
+    return getattr(settings, 'NORTEAMERICANO_PASSWORD_HASH_WORKERS', None) or os.cpu_count() or 1
+
+def generate_username(user_data, is_api=False, usernames=None):
         """
         Generate an username for the given user_data
         This generation will be done as follow:
@@ -72,100 +125,217 @@ def generate_username(user_data, is_api=False):
         3. return first_name[0] + "_" first_name[1..N][0..N] + "_" + last_name[0]
         4. return first_name[0] + "_" first_name[1..N][0..N] + "_" + last_name[1..N][0..N]
         5. return first_name[0] + "_" + last_name[0] + N
+        Candidates of 1-4 are checked in batches, the N of 5 is picked from
+        a single query over the existing usernames.
+        If usernames (UsernameReservation) is given, the candidates are checked
+        against it instead of the database and the result is reserved in it.
         """
-        if is_api:
-            aux_username = unidecode.unidecode(user_data['nombreCompleto'].lower())
-            aux_username = re.sub(r'[^a-zA-Z0-9\_]', ' ', aux_username)
-            aux_username = aux_username.split(" ")
-            aux_username = [x for x in aux_username if x]
-            if len(aux_username) > 1:
-                i = int(len(aux_username)/2)
-                aux_first_name = aux_username[0:i]
-                aux_last_name = aux_username[i:]
-            else:
-                if User.objects.filter(username=aux_username[0]).exists():
-                    for i in range(1, 10000):
-                        name_tmp = aux_username[0] + str(i)
-                        if not User.objects.filter(username=name_tmp).exists():
-                            return name_tmp
-                else:
-                    return aux_username[0]
+        reservation = usernames
+        if usernames is not None and not usernames.load(username_prefixes(user_data, is_api)):
+            usernames = None
+        aux_first_name, aux_last_name = get_username_names(user_data, is_api)
+        if aux_last_name is None:
+            username = get_available_username([aux_first_name[0]], usernames)
+            if username is None:
+                username = get_username_with_suffix(aux_first_name[0], usernames)
+        else:
+            first_name = [x for x in aux_first_name if x != ''] or ['']
+            last_name = [x for x in aux_last_name if x != ''] or ['']
+
+            # 1. - 4.
+            username = get_available_username(username_candidates(first_name, last_name), usernames)
+
+            # 5.
+            if username is None:
+                username = get_username_with_suffix(get_username_base(first_name, last_name), usernames)
+
+        if username is None:
+            # Username cant be generated
+            raise Exception("Error generating username for name {}".format(' '.join(aux_first_name + (aux_last_name or []))))
+        if reservation is not None:
+            reservation.reserve(username)
+        return username
+
+def normalize_username_name(name):
+    """
+        Return the ascii lowercase words of the name
+    """
+    aux_name = unidecode.unidecode(name.lower())
+    aux_name = re.sub(r'[^a-zA-Z0-9\_]', ' ', aux_name)
+    aux_name = aux_name.split(" ")
+    return [x for x in aux_name if x]
+
+def get_username_names(user_data, is_api=False):
+    """
+        Return the first names and last names used to generate the username.
+        Last names are None when the api full name has only one word.
+    """
+    if is_api:
+        aux_username = normalize_username_name(user_data['nombreCompleto'])
+        if len(aux_username) > 1:
+            i = int(len(aux_username)/2)
+            return aux_username[0:i], aux_username[i:]
+        return aux_username, None
+    return normalize_username_name(user_data['names']), normalize_username_name(user_data['lastnames'])
+
+def get_username_base(first_name, last_name):
+    """
+        Return the base of the step 5 of generate_username,
+        leaving space to add the numbers in the username
+    """
+    test_name = first_name[0] + "_" + last_name[0]
+    test_name = test_name[0:(USERNAME_MAX_LENGTH - 5)]
+    if test_name[-1] == '_':
+        test_name = test_name[:-1]
+    return test_name
+
+def username_prefixes(user_data, is_api=False):
+    """
+        Return the prefixes shared by every username that generate_username
+        can return for the given user_data
+    """
+    aux_first_name, aux_last_name = get_username_names(user_data, is_api)
+    if aux_last_name is None:
+        return aux_first_name[:1]
+    first_name = aux_first_name or ['']
+    last_name = aux_last_name or ['']
+    # 1., 2. and 5.
+    prefixes = [get_username_base(first_name, last_name)]
+    # 3. and 4.
+    if len(first_name) > 1:
+        prefixes.append((first_name[0] + "_" + first_name[1][0])[0:(USERNAME_MAX_LENGTH - 5)])
+    return prefixes
+
+class UsernameReservation(object):
+    """
+        In-memory index of the taken usernames for one bulk upload.
+        It is filled with the existing usernames that share the name prefixes
+        of the upload and with every username generated during the upload,
+        so the usernames can be picked without database queries.
+    """
+    def __init__(self):
+        self.prefixes = set()
+        self.usernames = set()
+
+    def load(self, prefixes):
+        """
+            Load the existing usernames starting with the given prefixes.
+            Return False if some prefix can not be indexed (empty prefix).
+        """
+        prefixes = list(prefixes)
+        new_prefixes = list(set(x.lower() for x in prefixes if x) - self.prefixes)
+        for i in range(0, len(new_prefixes), USERNAME_BATCH_SIZE):
+            query = Q()
+            for prefix in new_prefixes[i:i + USERNAME_BATCH_SIZE]:
+                query |= Q(username__istartswith=prefix)
+            self.usernames.update(x.lower() for x in User.objects.filter(query).values_list('username', flat=True))
+        self.prefixes.update(new_prefixes)
+        return all(prefixes)
+
+    def taken(self, usernames):
+        """
+            Return the given usernames that are already taken
+        """
+        return set(x.lower() for x in usernames if x.lower() in self.usernames)
+
+    def reserve(self, username):
+        self.usernames.add(username.lower())
+
+def username_candidates(first_name, last_name):
+    """
+        Yield lazily the usernames of the steps 1 to 4 of generate_username,
+        in the same order they must be tried
+    """
+    # 1.
+    test_name = first_name[0] + "_" + last_name[0]
+    if len(test_name) <= USERNAME_MAX_LENGTH:
+        yield test_name
+
+    # 2.
+    for i in range(len(last_name[1:])):
+        test_name = test_name + "_"
+        for j in range(len(last_name[i + 1])):
+            test_name = test_name + last_name[i + 1][j]
+            if len(test_name) > USERNAME_MAX_LENGTH:
+                break
+            yield test_name
+
+    # 3.
+    first_name_temp = first_name[0]
+    for i in range(len(first_name[1:])):
+        first_name_temp = first_name_temp + "_"
+        for j in range(len(first_name[i + 1])):
+            first_name_temp = first_name_temp + first_name[i + 1][j]
+            test_name = first_name_temp + "_" + last_name[0]
+            if len(test_name) > USERNAME_MAX_LENGTH:
+                break
+            yield test_name
+
+    # 4.
+    first_name_temp = first_name[0]
+    for first_index in range(len(first_name[1:])):
+        first_name_temp = first_name_temp + "_"
+        for first_second_index in range(len(first_name[first_index + 1])):
+            first_name_temp = first_name_temp + \
+                first_name[first_index + 1][first_second_index]
+            test_name = first_name_temp + "_" + last_name[0]
+            if len(test_name) > USERNAME_MAX_LENGTH:
+                break
+            for second_index in range(len(last_name[1:])):
+                test_name = test_name + "_"
+                for second_second_index in range(
+                        len(last_name[second_index + 1])):
+                    test_name = test_name + \
+                        last_name[second_index + 1][second_second_index]
+                    if len(test_name) > USERNAME_MAX_LENGTH:
+                        break
+                    yield test_name
+
+def get_available_username(candidates, usernames=None):
+    """
+        Return the first candidate that is not taken, checking the candidates
+        in batches of USERNAME_BATCH_SIZE against the UsernameReservation
+        if given or else against the database (one query per batch)
+    """
+    candidates = iter(candidates)
+    while True:
+        batch = list(islice(candidates, USERNAME_BATCH_SIZE))
+        if not batch:
+            return None
+        if usernames is not None:
+            taken = usernames.taken(batch)
         else:
-            aux_first_name = unidecode.unidecode(user_data['names'].lower())
-            aux_first_name = re.sub(r'[^a-zA-Z0-9\_]', ' ', aux_first_name)
-            aux_first_name = aux_first_name.split(" ")
-            aux_first_name = [x for x in aux_first_name if x]
-            aux_last_name = unidecode.unidecode(user_data['lastnames'].lower())
-            aux_last_name = re.sub(r'[^a-zA-Z0-9\_]', ' ', aux_last_name)
-            aux_last_name = aux_last_name.split(" ")
-            aux_last_name = [x for x in aux_last_name if x]
-
-        first_name = [x for x in aux_first_name if x != ''] or ['']
-        last_name = [x for x in aux_last_name if x != ''] or ['']
-
-        # 1.
-        test_name = first_name[0] + "_" + last_name[0]
-        if len(test_name) <= USERNAME_MAX_LENGTH and not User.objects.filter(
-                username=test_name).exists():
-            return test_name
-
-        # 2.
-        for i in range(len(last_name[1:])):
-            test_name = test_name + "_"
-            for j in range(len(last_name[i + 1])):
-                test_name = test_name + last_name[i + 1][j]
-                if len(test_name) > USERNAME_MAX_LENGTH:
-                    break
-                if not User.objects.filter(username=test_name).exists():
-                    return test_name
-
-        # 3.
-        first_name_temp = first_name[0]
-        for i in range(len(first_name[1:])):
-            first_name_temp = first_name_temp + "_"
-            for j in range(len(first_name[i + 1])):
-                first_name_temp = first_name_temp + first_name[i + 1][j]
-                test_name = first_name_temp + "_" + last_name[0]
-                if len(test_name) > USERNAME_MAX_LENGTH:
-                    break
-                if not User.objects.filter(username=test_name).exists():
-                    return test_name
-
-        # 4.
-        first_name_temp = first_name[0]
-        for first_index in range(len(first_name[1:])):
-            first_name_temp = first_name_temp + "_"
-            for first_second_index in range(len(first_name[first_index + 1])):
-                first_name_temp = first_name_temp + \
-                    first_name[first_index + 1][first_second_index]
-                test_name = first_name_temp + "_" + last_name[0]
-                if len(test_name) > USERNAME_MAX_LENGTH:
-                    break
-                for second_index in range(len(last_name[1:])):
-                    test_name = test_name + "_"
-                    for second_second_index in range(
-                            len(last_name[second_index + 1])):
-                        test_name = test_name + \
-                            last_name[second_index + 1][second_second_index]
-                        if len(test_name) > USERNAME_MAX_LENGTH:
-                            break
-                        if not User.objects.filter(
-                                username=test_name).exists():
-                            return test_name
-
-        # 5.
-        # Make sure we have space to add the numbers in the username
-        test_name = first_name[0] + "_" + last_name[0]
-        test_name = test_name[0:(USERNAME_MAX_LENGTH - 5)]
-        if test_name[-1] == '_':
-            test_name = test_name[:-1]
-        for i in range(1, 10000):
-            name_tmp = test_name + str(i)
-            if not User.objects.filter(username=name_tmp).exists():
-                return name_tmp
-
-        # Username cant be generated
-        raise Exception("Error generating username for name {}".format())
+            taken = set(x.lower() for x in User.objects.filter(username__in=batch).values_list('username', flat=True))
+        for username in batch:
+            if username.lower() not in taken:
+                return username
+
+def get_username_with_suffix(base, usernames=None):
+    """
+        Return base + N with the lowest N (1 to USERNAME_SUFFIX_MAX - 1) that
+        is not taken, using the UsernameReservation if given or else a single
+        query over the usernames base + N, USERNAME_BASE_DEFAULT is used as base
+        if it is empty
+    """
+    if not base:
+        base = USERNAME_BASE_DEFAULT
+    if usernames is not None:
+        for i in range(1, USERNAME_SUFFIX_MAX):
+            if not usernames.taken([base + str(i)]):
+                return base + str(i)
+        return None
+    pattern = re.compile(r'^{}([0-9]+)$'.format(re.escape(base.lower())))
+    used = set()
+    # every taken suffix is read, a slice of the unordered rows could skip some of them
+    users = User.objects.filter(username__iregex=r'^{}[0-9]+$'.format(re.escape(base))).values_list('username', flat=True)
+    for username in users:
+        match = pattern.match(username.lower())
+        if match:
+            used.add(match.group(1))
+    for i in range(1, USERNAME_SUFFIX_MAX):
+        if str(i) not in used:
+            return base + str(i)
+    return None
 
 def validate_course(id_curso):
     """
@@ -174,11 +344,36 @@ def validate_course(id_curso):
     from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
     try:
         aux = CourseKey.from_string(id_curso)
-        return CourseOverview.objects.filter(id=aux).exists()
+        return course_exists(aux, lambda: CourseOverview.objects.filter(id=aux).exists())
     except InvalidKeyError:
         logger.error("Norteamericano error valdiate course, invalid format: {}".format(id_curso))
         return False
 
+def resolve_courses(course_ids, courses=None):
+    """
+        Validate the distinct course ids with one CourseOverview query.
+        Return a dict course id -> CourseOverview, None if the course id is
+        not valid or the course doesnt exists.
+        Course ids already in courses are not queried again.
+    """
+    from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
+    if courses is None:
+        courses = {}
+    keys = {}
+    for course_id in set(course_ids):
+        if course_id in courses:
+            continue
+        courses[course_id] = None
+        try:
+            keys[CourseKey.from_string(course_id)] = course_id
+        except InvalidKeyError:
+            logger.error("Norteamericano error resolve_courses, invalid format: {}".format(course_id))
+    for keys_chunk in chunks(list(keys), PRELOAD_BATCH_SIZE):
+        for course in CourseOverview.objects.filter(id__in=keys_chunk):
+            if course.id in keys:
+                courses[keys[course.id]] = course
+    return courses
+
 def validate_course_pending_course(course_id):
     """
         Validate if course id exists in pending rerun
@@ -186,37 +381,127 @@ def validate_course_pending_course(course_id):
     from common.djangoapps.course_action_state.models import CourseRerunState
     try:
         aux = CourseKey.from_string(course_id)
-        return CourseRerunState.objects.filter(course_key=aux).exists()
+        return pending_course_exists(aux, lambda: CourseRerunState.objects.filter(course_key=aux).exists() or RerunQueueItem.objects.filter(course_key=aux).exists())
     except InvalidKeyError:
         logger.error("Norteamericano error validate_course_pending_course, invalid format: {}".format(course_id))
         return False
 
 def set_data_course(course_key, start_date, end_date, user):
     """
-        Set start_date and/or end_date
+        Set start_date and/or end_date, return None if the dates are not
+        valid, else if the course was written
     """
     from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
     with transaction.atomic():
         course = CourseOverview.objects.get(id=course_key)
-        data = {}
-        course_details = CourseDetails.fetch(course_key).__dict__
+        start = None
+        end = None
         if start_date:
             start = dt.strptime(start_date+' +0000', "%H:%M %d/%m/%Y %z")
-            data['start_date'] = start.strftime("%Y-%m-%dT%H:%M:%S")+'Z'
-            course_details['start_date'] = data['start_date']
-        else:
-            start = course.start_date
         if end_date:
             end = dt.strptime(end_date+' +0000', "%H:%M %d/%m/%Y %z")
-            data['end_date'] = end.strftime("%Y-%m-%dT%H:%M:%S")+'Z'
-            course_details['end_date'] = data['end_date']
-        else:
-            end = course.end_date
-        if end is not None and end <= start:
+        new_start = start or course.start_date
+        new_end = end or course.end_date
+        if new_end is not None and new_end <= new_start:
+            return None
+        if start is None and end is None:
             return False
-        if data:
-            CourseDetails.update_from_json(course_key, course_details, user)
-        return True
+        return update_course_dates(course_key, start, end, user)
+
+def update_course_dates(course_key, start, end, user):
+    """
+        Write the start and/or end in the course block with one update,
+        CourseDetails.update_from_json also rewrites every about item.
+        The course is not written (nor published) if the dates dont change.
+        Return if the course was written.
+    """
+    store = modulestore()
+    with store.bulk_operations(course_key):
+        descriptor = store.get_course(course_key)
+        changed = False
+        if start is not None and descriptor.start != start:
+            descriptor.start = start
+            changed = True
+        if end is not None and descriptor.end != end:
+            descriptor.end = end
+            changed = True
+        if changed:
+            store.update_item(descriptor, user.id)
+    return changed
+
+def validate_course_dates_rows(csv_data, user):
+    """
+        Validate all the rows of the course dates CSV before any update, the
+        courses are checked with one CourseOverview query and the permission
+        once by course.
+        Return a list of (row, data), data is None if the row is not valid
+        (the error is in the row) or the course key and the parsed dates.
+    """
+    rows = []
+    for row in csv_data:
+        while len(row) < 4:
+            row.append('')
+        if row[0] == '' or (row[1] == '' and row[2] == ''):
+            row[3] = 'Faltan datos'
+            rows.append((row, None))
+            continue
+        data = {'start': None, 'end': None}
+        try:
+            if row[1] != '':
+                data['start'] = dt.strptime(row[1]+' +0000', "%H:%M %d/%m/%Y %z")
+            if row[2] != '':
+                data['end'] = dt.strptime(row[2]+' +0000', "%H:%M %d/%m/%Y %z")
+        except ValueError:
+            row[3] = 'Formato incorrecto en las fechas del curso'
+            rows.append((row, None))
+            continue
+        rows.append((row, data))
+
+    parsed = [(row, data) for row, data in rows if data is not None]
+    courses = resolve_courses([row[0] for row, data in parsed])
+    permissions = {}
+    updated = set()
+    for row, data in parsed:
+        course = courses[row[0]]
+        if course is None:
+            row[3] = 'Id curso invalido o curso no existe'
+        elif course.id in updated:
+            row[3] = 'Curso repetido'
+        else:
+            if row[0] not in permissions:
+                permissions[row[0]] = validate_user(user, row[0])
+            start = data['start'] or course.start_date
+            end = data['end'] or course.end_date
+            if not permissions[row[0]]:
+                row[3] = 'Usuario no tiene permisos en el curso'
+            elif start is not None and end is not None and end <= start:
+                row[3] = 'La fecha de termino debe ser posterior a la fecha de inicio'
+            else:
+                data['course_key'] = course.id
+                updated.add(course.id)
+                continue
+        data.clear()
+    return [(row, data or None) for row, data in rows]
+
+def set_courses_dates(csv_data, user):
+    """
+        Set the dates of the courses from CSV file, all the rows are
+        validated before the first update
+    """
+    new_data = [['Id curso', 'Fecha de Inicio(UTC)', 'Fecha de Termino(UTC)', 'Estado']]
+    for row, data in validate_course_dates_rows(csv_data, user):
+        new_data.append(row)
+        if data is None:
+            continue
+        try:
+            if update_course_dates(data['course_key'], data['start'], data['end'], user):
+                row[3] = 'Fechas actualizadas'
+            else:
+                row[3] = 'Sin cambios'
+        except Exception as e:
+            logger.error("NorteamericanoCourseDates - Error updating the course {}: {}".format(row[0], str(e)))
+            row[3] = 'Error al actualizar el curso'
+    return new_data
 
 def is_course_staff(user, course_id):
     """
@@ -250,10 +535,34 @@ def validate_user(user, course_id):
     if not user.is_anonymous and user.has_perm('norteamericano_form.na_instructor_staff'):
         if user.is_staff:
             access = True
-        if is_instructor(user, course_id):
-            access = True
-        if is_course_staff(user, course_id):
-            access = True
+        else:
+            access = has_course_staff_access(user, course_id)
+    return access
+
+def has_course_staff_access(user, course_id):
+    """
+        Verify if the user is instructor or staff of the course (or of its org),
+        like has_access 'staff' but only with the CourseAccessRole of the user,
+        without loading the course. Memoized by user and course in the request
+        cache, which lasts the request or the celery task.
+    """
+    cache = RequestCache(PERMISSIONS_CACHE_NAMESPACE)
+    cache_key = '{}.{}'.format(user.id, course_id)
+    cached_response = cache.get_cached_response(cache_key)
+    if cached_response.is_found:
+        return cached_response.value
+    try:
+        course_key = CourseKey.from_string(course_id)
+        roles = (
+            CourseInstructorRole(course_key),
+            CourseStaffRole(course_key),
+            OrgInstructorRole(course_key.org),
+            OrgStaffRole(course_key.org),
+        )
+        access = any(role.has_user(user) for role in roles)
+    except InvalidKeyError:
+        access = False
+    cache.set(cache_key, access)
     return access
 
 def enroll_course_user(user, course, mode):
@@ -280,101 +589,445 @@ def remove_role_course_staff(user, course_key):
     role = CourseInstructorRole(course_key)
     role.remove_users(user)
 
+def course_staff_users(data, user_ids=None):
+    """
+        Apply the list of (rut, course id, action) grouped by course, the
+        instructor roles are added with one bulk create and removed with
+        one delete by course. Like CourseStaffEnrollApi the users are
+        enrolled in audit mode or unenrolled, if a tuple is repeated the
+        last action is applied. Inactive users dont get the role.
+        Return a dict (rut, course id) -> error of the tuples not applied.
+    """
+    from common.djangoapps.student.models import CourseAccessRole
+    if user_ids is None:
+        user_ids = get_na_user_ids([rut for rut, course_id, action in data])
+    users = {}
+    for ids_chunk in chunks(set(user_ids.values()), PRELOAD_BATCH_SIZE):
+        users.update((user.id, user) for user in User.objects.filter(id__in=ids_chunk))
+    actions_by_course = {}
+    errors = {}
+    for rut, course_id, action in data:
+        user = users.get(user_ids.get(rut))
+        if user is None:
+            errors[(rut, course_id)] = 'Rut/Pasaporte no registrado'
+        elif action == 'enroll' and not user.is_active:
+            errors[(rut, course_id)] = 'Usuario inactivo'
+        else:
+            actions_by_course.setdefault(course_id, {})[user.id] = (rut, action)
+    with transaction.atomic():
+        for course_id, actions in actions_by_course.items():
+            course_key = CourseKey.from_string(course_id)
+            add_ids = [user_id for user_id, (rut, action) in actions.items() if action == 'enroll']
+            remove_ids = [user_id for user_id, (rut, action) in actions.items() if action != 'enroll']
+            roles = CourseAccessRole.objects.filter(role=CourseInstructorRole.ROLE, org=course_key.org, course_id=course_key)
+            existing = set()
+            for ids_chunk in chunks(add_ids, PRELOAD_BATCH_SIZE):
+                existing.update(roles.filter(user_id__in=ids_chunk).values_list('user_id', flat=True))
+            # the bulk create and the delete bypass RoleBase.add_users and
+            # remove_users, so the cached roles of the users are cleared here
+            CourseAccessRole.objects.bulk_create([
+                CourseAccessRole(user_id=user_id, role=CourseInstructorRole.ROLE, org=course_key.org, course_id=course_key)
+                for user_id in add_ids if user_id not in existing
+            ])
+            for user_id in add_ids:
+                enroll_course_user(users[user_id], course_id, 'audit')
+            for ids_chunk in chunks(remove_ids, PRELOAD_BATCH_SIZE):
+                roles.filter(user_id__in=ids_chunk).delete()
+            unenroll_users([(actions[user_id][0], course_id) for user_id in remove_ids], user_ids)
+            for user_id in actions:
+                if hasattr(users[user_id], '_roles'):
+                    del users[user_id]._roles
+    return errors
+
 def file_to_csvreader(csvfile):
     """
-        Convert file in csv object
+        Convert file in csv object, the file is decoded incrementally
+        while the rows are read
     """
-    package_file = csvfile
-    decoded_file = package_file.read().decode('utf-8')
-    io_string = io.StringIO(decoded_file)
-    csv_reader = csv.reader(io_string, delimiter=';')
+    decoded_file = codecs.iterdecode(csvfile, 'utf-8')
+    csv_reader = csv.reader(decoded_file, delimiter=';')
     header = next(csv_reader)
     return csv_reader
 
-def enroll_create_user_with_custom_fields(csv_data, mode):
+class Echo(object):
+    """
+        File-like object that returns the written value,
+        used to stream the lines of a csv.writer
+    """
+    def write(self, value):
+        return value
+
+def stream_enroll_csv(csv_data, mode, emails_callback=None, progress=None):
+    """
+        Yield the lines of the enroll result CSV as the chunks of rows are
+        processed. emails_callback(emails_data) is called after each chunk
+        is committed and progress(rows, errors) with the processed rows and
+        the rows with errors.
+    """
+    writer = csv.writer(
+        Echo(),
+        delimiter=';',
+        dialect='excel')
+    yield writer.writerow(ENROLL_HEADER)
+    rows = 0
+    errors = 0
+    for chunk in enroll_chunks(csv_data, mode):
+        if emails_callback is not None:
+            emails_callback(chunk['emails_data'])
+        rows += len(chunk['new_data'])
+        errors += len(chunk['new_data']) - len(chunk['emails_data'])
+        if progress is not None:
+            progress(rows, errors)
+        for row in chunk['new_data']:
+            yield writer.writerow(row)
+
+def enroll_create_user_with_custom_fields(csv_data, mode, progress=None, chunk_size=None):
     """
-        Create and enroll the user
+        Create and enroll the user.
+        progress(rows, errors) is called after each chunk
+        with the processed rows and the rows with errors.
     """
-    new_data = [['Email', 'Apellido Paterno', 'Apellido Materno', 'Nombres', 'RUT', 'Fecha de Nacimiento', 'Fono', 'Id curso', 'Username', 'Estado']]
+    new_data = [ENROLL_HEADER]
     emails_data = []
+    errors = 0
+    for chunk in enroll_chunks(csv_data, mode, chunk_size):
+        new_data.extend(chunk['new_data'])
+        emails_data.extend(chunk['emails_data'])
+        errors += len(chunk['new_data']) - len(chunk['emails_data'])
+        if progress is not None:
+            progress(len(new_data) - 1, errors)
+    return {'new_data': new_data, 'emails_data': emails_data}
+
+def enroll_chunks(csv_data, mode, chunk_size=None):
+    """
+        Create and enroll the users of the rows in chunks of chunk_size rows
+        (NORTEAMERICANO_ENROLL_CHUNK_SIZE), each chunk in its own transaction
+        and each row in a savepoint of it.
+        Yield for each chunk the result rows and the data of the enroll emails.
+        If a row fails only its changes are rolled back and the row is marked,
+        if the chunk (or the load of its data) fails its changes are rolled
+        back and its rows are marked.
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'NORTEAMERICANO_ENROLL_CHUNK_SIZE', ENROLL_CHUNK_SIZE)
     courses = {}
-    with transaction.atomic():
-        for row in csv_data:
-            if len(row) < 8:
-                while len(row) < 8:
-                    row.append('')
-                new_data.append(row + ['', 'Faltan datos'])
-                continue
-            elif len(row) < 10:
-                while len(row) < 10:
-                    row.append('')
-
-            row[0] = row[0].lower()
-            row[4] = row[4].upper()
-            row[4] = row[4].replace("-", "")
-            row[4] = row[4].replace(".", "")
-            row[4] = row[4].strip()
-            aux_pass = ''
-            error = ''
-            user_created = False
-            if not validarRutAllType(row[4]):
-                row[-1] = 'Rut/Pasaporte invalido'
+    usernames = UsernameReservation()
+    # the processes of the pool are started by the first chunk with enough new users
+    executor = create_password_hash_pool()
+    try:
+        for number, chunk in enumerate(chunks(csv_data, chunk_size), 1):
+            yield enroll_chunk(number, chunk, mode, courses, usernames, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def enroll_chunk(number, chunk, mode, courses, usernames, executor=None):
+    """
+        Create and enroll the users of the rows of the chunk in a transaction,
+        return the result rows and the data of the enroll emails
+    """
+    rows = [prepare_enroll_row(row) for row in chunk]
+    new_data = []
+    emails_data = []
+    try:
+        resolve_courses([row[7] for row, valid in rows if valid], courses)
+        na_data = preload_enroll_data([row for row, valid in rows if valid])
+        new_rows = [
+            row for row, valid in rows
+            if valid and courses[row[7]] is not None and row[4] not in na_data['na_users']
+            and row[0] not in na_data['users'] and re.match(regex, row[0])
+        ]
+        usernames.load([
+            prefix for row in new_rows
+            for prefix in username_prefixes({'names': row[3], 'lastnames': '{} {}'.format(row[1], row[2])})
+        ])
+        passwords = generate_passwords(set(row[0] for row in new_rows), executor)
+        with transaction.atomic():
+            for row, valid in rows:
+                email_data = None
+                if valid:
+                    email_data = enroll_row_savepoint(row, mode, courses, na_data, usernames, passwords)
                 new_data.append(row)
+                if email_data:
+                    emails_data.append(email_data)
+    except Exception as e:
+        logger.exception('NorteamericanoEnroll - Error in chunk {}, changes rolled back: {}'.format(number, str(e)))
+        new_data = []
+        emails_data = []
+        for row, valid in rows:
+            if valid:
+                row[-2] = ''
+                row[-1] = 'Error en el bloque {}, no se realizaron cambios'.format(number)
+            new_data.append(row)
+    return {'new_data': new_data, 'emails_data': emails_data}
+
+def enroll_row_savepoint(row, mode, courses, na_data, usernames, passwords=None):
+    """
+        enroll_row in a savepoint, if it fails its changes and the users
+        it added to na_data are discarded and the row is marked
+    """
+    user = na_data['users'].get(row[0])
+    na_user = na_data['na_users'].get(row[4])
+    try:
+        with transaction.atomic():
+            return enroll_row(row, mode, courses, na_data, usernames, passwords)
+    except Exception as e:
+        logger.exception('NorteamericanoEnroll - Error in row {}, changes rolled back: {}'.format(row[0], str(e)))
+        new_na_user = na_data['na_users'].get(row[4])
+        if new_na_user is not None and new_na_user is not na_user:
+            na_data['na_user_ids'].discard(new_na_user.user_id)
+        for key, value, data in ((row[0], user, na_data['users']), (row[4], na_user, na_data['na_users'])):
+            if value is None:
+                data.pop(key, None)
+            else:
+                data[key] = value
+        row[-2] = ''
+        row[-1] = 'Error al procesar la fila, no se realizaron cambios'
+        return None
+
+def generate_passwords(emails, executor=None):
+    """
+        Generate the temporary passwords of the new users and hash them in
+        parallel. Return a dict email -> (password, password hash).
+    """
+    emails = list(emails)
+    passwords = [BaseUserManager().make_random_password(12).lower() for x in emails]
+    return dict(zip(emails, zip(passwords, hash_passwords(passwords, executor))))
+
+def enroll_row(row, mode, courses, na_data, usernames, passwords=None):
+    """
+        Create (if needed) and enroll the user of the prepared row,
+        set the username and the state in the row.
+        passwords is a dict email -> (password, password hash) of the
+        passwords already generated for the new users.
+        Return the data of the enroll email or None if the row has errors.
+    """
+    aux_pass = ''
+    error = ''
+    if courses[row[7]] is None:
+        row[-1] = 'Id curso invalido o curso no existe'
+        return None
+    na_user = na_data['na_users'].get(row[4])
+    if na_user is None:
+        user = na_data['users'].get(row[0])
+        if user is not None:
+            if user.id in na_data['na_user_ids']:
+                user = None
+                error = 'EL correo esta asociado a otro rut'
+        elif re.match(regex, row[0]):
+            if passwords and row[0] in passwords:
+                aux_pass, password_hash = passwords.pop(row[0])
+            else:
+                aux_pass = BaseUserManager().make_random_password(12)
+                aux_pass = aux_pass.lower()
+                password_hash = None
+            user_data = {
+                'email':row[0],
+                'names':row[3],
+                'lastnames': '{} {}'.format(row[1], row[2]),
+                'pass': aux_pass
+            }
+            user = create_user_by_data(user_data, usernames=usernames, password_hash=password_hash)
+            na_data['users'][row[0]] = user
+        else:
+            error = 'Formato del correo incorrecto'
+        if user:
+            na_user = create_na_user(row, user)
+            na_data['na_users'][row[4]] = na_user
+            na_data['na_user_ids'].add(user.id)
+    if not na_user:
+        row[-1] = error
+        return None
+    enroll_course_user(na_user.user, row[7], mode)
+    row[-2] = na_user.user.username
+    row[-1] = 'Inscrito' if aux_pass == '' else 'Creado e Inscrito'
+    return {
+        'email':row[0],
+        'user_name': na_user.user.profile.name.strip(),
+        'password': aux_pass,
+        'course_name': courses[row[7]].display_name_with_default
+    }
+
+def prepare_enroll_row(row):
+    """
+        Complete and normalize the row of the enroll CSV (email and rut).
+        Return the row and False if the row can not be processed.
+    """
+    if len(row) < 8:
+        while len(row) < 8:
+            row.append('')
+        return row + ['', 'Faltan datos'], False
+    elif len(row) < 10:
+        while len(row) < 10:
+            row.append('')
+
+    row[0] = row[0].lower()
+    row[4] = row[4].upper()
+    row[4] = row[4].replace("-", "")
+    row[4] = row[4].replace(".", "")
+    row[4] = row[4].strip()
+    if not validarRutAllType(row[4]):
+        row[-1] = 'Rut/Pasaporte invalido'
+        return row, False
+    if row[4][0] != 'P':
+        row[4] = '{}-{}'.format(row[4][:-1], row[4][-1])
+    return row, True
+
+def preload_enroll_data(rows):
+    """
+        Load the NAExtraInfo and User of the enroll rows with a fixed number
+        of queries. Return the indexes by rut ('na_users') and by email ('users')
+        and the ids of the users that already have a NAExtraInfo ('na_user_ids').
+    """
+    ruts = list(set(row[4] for row in rows))
+    emails = list(set(row[0] for row in rows))
+    na_users = {}
+    users = {}
+    for ruts_chunk in chunks(ruts, PRELOAD_BATCH_SIZE):
+        na_users.update(
+            (x.na_rut, x) for x in NAExtraInfo.objects.filter(na_rut__in=ruts_chunk).select_related('user__profile'))
+    for emails_chunk in chunks(emails, PRELOAD_BATCH_SIZE):
+        users.update(
+            (x.email.lower(), x) for x in User.objects.filter(email__in=emails_chunk).select_related('profile'))
+    na_user_ids = set()
+    for ids_chunk in chunks([x.id for x in users.values()], PRELOAD_BATCH_SIZE):
+        na_user_ids.update(NAExtraInfo.objects.filter(user_id__in=ids_chunk).values_list('user_id', flat=True))
+    return {'na_users': na_users, 'users': users, 'na_user_ids': na_user_ids}
+
+def clean_rut(rut):
+    """
+        Return the rut in uppercase without dots, dashes and spaces,
+        the format validated by validarRutAllType
+    """
+    rut = rut.upper()
+    rut = rut.replace("-", "")
+    rut = rut.replace(".", "")
+    return rut.strip()
+
+def normalize_rut(rut):
+    """
+        Return the rut in the format of NAExtraInfo, 12345678-9 or P123456
+    """
+    rut = clean_rut(rut)
+    if rut[0] != 'P':
+        rut = '{}-{}'.format(rut[:-1], rut[-1])
+    return rut
+
+def load_na_users(ruts):
+    """
+        Return a dict rut -> (NAExtraInfo id, user id, username) of the
+        registered ruts, with a fixed number of queries.
+    """
+    na_users = {}
+    for ruts_chunk in chunks(set(ruts), PRELOAD_BATCH_SIZE):
+        for na_rut, na_id, user_id, username in NAExtraInfo.objects.filter(na_rut__in=ruts_chunk).values_list('na_rut', 'id', 'user_id', 'user__username'):
+            na_users[na_rut] = (na_id, user_id, username)
+    return na_users
+
+def get_na_users(ruts):
+    """
+        Return a dict rut -> (NAExtraInfo id, user id, username) of the
+        registered ruts, the ruts already resolved are read from the cache.
+    """
+    return get_cached_na_ruts(ruts, load_na_users)
+
+def get_na_user_ids(ruts):
+    """
+        Return a dict rut -> user id of the registered ruts
+    """
+    return {rut: na_user[1] for rut, na_user in get_na_users(ruts).items()}
+
+def unenroll_users(data, user_ids=None):
+    """
+        Unenroll the users of the list of (rut, course id) from the courses.
+        The ruts are resolved together (unless user_ids is given) and the
+        enrollments are removed with one delete and one update by course.
+        Return the dict rut -> user id of the registered ruts.
+    """
+    from common.djangoapps.student.models import CourseEnrollment, CourseEnrollmentAllowed
+    if user_ids is None:
+        user_ids = get_na_user_ids([rut for rut, course_id in data])
+    users_by_course = {}
+    for rut, course_id in data:
+        if rut in user_ids:
+            users_by_course.setdefault(course_id, set()).add(user_ids[rut])
+    with transaction.atomic():
+        for course_id, course_user_ids in users_by_course.items():
+            course_key = CourseKey.from_string(course_id)
+            for ids_chunk in chunks(course_user_ids, PRELOAD_BATCH_SIZE):
+                #unenroll CourseEnrollmentAllowed
+                CourseEnrollmentAllowed.objects.filter(course_id=course_key, user_id__in=ids_chunk).delete()
+                #unenroll CourseEnrollment
+                CourseEnrollment.objects.filter(course_id=course_key, user_id__in=ids_chunk).update(is_active=False)
+    return user_ids
+
+def unenroll_chunks(csv_data, chunk_size=None):
+    """
+        Unenroll the rows [rut, course id] in chunks of chunk_size rows
+        (NORTEAMERICANO_ENROLL_CHUNK_SIZE), yield the result rows of each chunk.
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'NORTEAMERICANO_ENROLL_CHUNK_SIZE', ENROLL_CHUNK_SIZE)
+    courses = {}
+    for number, chunk in enumerate(chunks(csv_data, chunk_size), 1):
+        rows = []
+        for row in chunk:
+            if not any(x.strip() for x in row):
+                # blank line of the CSV
                 continue
-            if row[4][0] != 'P':
-                row[4] = '{}-{}'.format(row[4][:-1], row[4][-1])
-            if not validate_course(row[7]):
-                row[-1] = 'Id curso invalido o curso no existe'
-                new_data.append(row)
+            if len(row) < 2:
+                row = (row + [''])[:2]
+                rows.append(row + ['Faltan datos'])
                 continue
-            if NAExtraInfo.objects.filter(na_rut=row[4]).exists():
-                na_user = NAExtraInfo.objects.get(na_rut=row[4])
+            row = row[:2] + ['']
+            if not validarRutAllType(clean_rut(row[0])):
+                row[2] = 'Rut/Pasaporte invalido'
             else:
-                try:
-                    user = User.objects.get(email=row[0])
-                    if NAExtraInfo.objects.filter(user=user).exists():
-                        user = None
-                        error = 'EL correo esta asociado a otro rut'
-                except User.DoesNotExist:
-                    if re.match(regex, row[0]):
-                        aux_pass = BaseUserManager().make_random_password(12)
-                        aux_pass = aux_pass.lower()
-                        user_data = {
-                            'email':row[0],
-                            'names':row[3],
-                            'lastnames': '{} {}'.format(row[1], row[2]),
-                            'pass': aux_pass
-                        }
-                        user = create_user_by_data(user_data)
-                        user_created = True
-                    else:
-                        user = None
-                        error = 'Formato del correo incorrecto'
-                if user:
-                    na_user = create_na_user(row, user)
-                else:
-                    na_user = None
-            if na_user:
-                enroll_course_user(na_user.user, row[7], mode)
-                row[-2] = na_user.user.username
-                row[-1] = 'Inscrito' if aux_pass == '' else 'Creado e Inscrito'
-                new_data.append(row)
-                if row[7] in courses:
-                    course_name = courses[row[7]]
-                else:
-                    course = get_course_by_id(CourseKey.from_string(row[7]))
-                    course_name = course.display_name_with_default
-                    courses[row[7]] = course_name
-                emails_data.append({
-                    'email':row[0],
-                    'user_name': na_user.user.profile.name.strip(),
-                    'password': aux_pass,
-                    'course_name': course_name
-                })
-            else:
-                row[-1] = error
-                new_data.append(row)
-    return {'new_data': new_data, 'emails_data': emails_data}
+                row[0] = normalize_rut(row[0])
+            rows.append(row)
+        resolve_courses([row[1] for row in rows if row[2] == ''], courses)
+        user_ids = get_na_user_ids([row[0] for row in rows if row[2] == ''])
+        for row in rows:
+            if row[2] != '':
+                continue
+            if courses[row[1]] is None:
+                row[2] = 'Id curso invalido o curso no existe'
+            elif row[0] not in user_ids:
+                row[2] = 'Rut/Pasaporte no registrado'
+        try:
+            unenroll_users([(row[0], row[1]) for row in rows if row[2] == ''], user_ids)
+            for row in rows:
+                if row[2] == '':
+                    row[2] = 'Desinscrito'
+        except Exception as e:
+            logger.exception('NorteamericanoUnenroll - Error in chunk {}, changes rolled back: {}'.format(number, str(e)))
+            for row in rows:
+                if row[2] == '':
+                    row[2] = 'Error en el bloque {}, no se realizaron cambios'.format(number)
+        yield rows
+
+def stream_unenroll_csv(csv_data):
+    """
+        Yield the lines of the unenroll result CSV as the chunks of rows are processed.
+    """
+    writer = csv.writer(
+        Echo(),
+        delimiter=';',
+        dialect='excel')
+    yield writer.writerow(UNENROLL_HEADER)
+    for rows in unenroll_chunks(csv_data):
+        for row in rows:
+            yield writer.writerow(row)
+
+def chunks(iterable, size):
+    """
+        Yield lists of at most size elements of the iterable
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
 
 def create_na_user(user_data, user):
     """
@@ -394,66 +1047,86 @@ def create_na_user(user_data, user):
 
 def rerun_courses(csv_data, user):
     """
-        ReRun Courses from CSV file
+        ReRun Courses from CSV file, the reruns are queued and started by the scheduler
     """
-    from cms.djangoapps.contentstore.views.course import rerun_course
     new_data = [['Course Id', 'Nuevo Course Id', 'Nombre curso nuevo', 'Fecha de Inicio(UTC)', 'Fecha de Termino(UTC)', 'Estado']]
+    queued = []
+    for course_ids, data in validate_rerun_rows(csv_data, user):
+        new_data.append(course_ids)
+        if data is not None:
+            item = enqueue_rerun(user, data['source_course_key'], data['new_course_key'], course_ids[2], data['start'], data['end'])
+            queued.append((course_ids, item))
+    if queued:
+        schedule_reruns.delay()
+        status = get_rerun_status([item for course_ids, item in queued])
+        for course_ids, item in queued:
+            course_ids[5] = status[item.id]
+    return new_data
+
+def validate_rerun_rows(csv_data, user, is_api=False):
+    """
+        Validate all the rows of the rerun CSV before any rerun, the rows are
+        parsed first and then the source and new courses are checked with
+        one CourseOverview query, the queue with one query and the permission
+        once by source course. With is_api (ReRunBulkApi) the name of the new
+        course is required and the end must be after the start.
+        Return a list of (row, data), data is None if the row is not valid
+        (the error is in the row) or the parsed keys and dates.
+    """
+    rows = []
     for course_ids in csv_data:
         if len(course_ids) < 5:
             while len(course_ids) < 5:
                 course_ids.append('')
-            new_data.append(course_ids + ['Faltan datos'])
+            rows.append((course_ids + ['Faltan datos'], None))
             continue
         if len(course_ids) < 6:
             course_ids.append('')
         try:
-            aux = CourseKey.from_string(course_ids[1])
+            new_course_key = CourseKey.from_string(course_ids[1])
         except InvalidKeyError:
             logger.error("Norteamericano error format course_id, invalid format: {}".format(course_ids[1]))
             course_ids[5] = 'Formato del nuevo course_id incorrecto'
-            new_data.append(course_ids)
+            rows.append((course_ids, None))
             continue
-        if not validate_course(course_ids[0]):
+        data = {'new_course_key': new_course_key, 'start': None, 'end': None}
+        try:
+            data['start'] = dt.strptime(course_ids[3]+' +0000', "%H:%M %d/%m/%Y %z")
+            data['end'] = dt.strptime(course_ids[4]+' +0000', "%H:%M %d/%m/%Y %z")
+        except ValueError:
+            pass
+        rows.append((course_ids, data))
+
+    parsed = [(course_ids, data) for course_ids, data in rows if data is not None]
+    courses = resolve_courses([course_ids[0] for course_ids, data in parsed] + [course_ids[1] for course_ids, data in parsed])
+    queued = get_queued_course_keys([data['new_course_key'] for course_ids, data in parsed])
+    permissions = {}
+    for course_ids, data in parsed:
+        target = rerun_course_key(data['new_course_key'])
+        if courses[course_ids[0]] is None:
             course_ids[5] = 'Formato del course_id incorrecto o el curso no existe'
-            new_data.append(course_ids)
-        elif validate_course(course_ids[1]):
+        elif courses[course_ids[1]] is not None:
             course_ids[5] = 'El nuevo course id ya existe'
-            new_data.append(course_ids)
-        elif not validate_user(user, course_ids[0]):
-            course_ids[5] = 'Usuario no tiene permisos en el curso'
-            new_data.append(course_ids)
+        elif target in queued:
+            course_ids[5] = 'El nuevo course id ya esta en cola'
         else:
-            try:
-                start_date = dt.strptime(course_ids[3]+' +0000', "%H:%M %d/%m/%Y %z")
-                end_date = dt.strptime(course_ids[4]+' +0000', "%H:%M %d/%m/%Y %z")
-            except ValueError:
+            if course_ids[0] not in permissions:
+                permissions[course_ids[0]] = validate_user(user, course_ids[0])
+            if not permissions[course_ids[0]]:
+                course_ids[5] = 'Usuario no tiene permisos en el curso'
+            elif data['start'] is None or data['end'] is None:
                 course_ids[5] = 'Formato incorrecto en las fechas del curso'
-                new_data.append(course_ids)
+            elif is_api and course_ids[2] == '':
+                course_ids[5] = 'Falta el nombre del curso nuevo'
+            elif is_api and data['end'] <= data['start']:
+                course_ids[5] = 'La fecha de termino debe ser posterior a la fecha de inicio'
+            else:
+                data['source_course_key'] = courses[course_ids[0]].id
+                # a repeated new course id in the sheet is rejected like a queued one
+                queued.add(target)
                 continue
-            new_course_key = CourseKey.from_string(course_ids[1])
-            org = new_course_key.org
-            number = new_course_key.course
-            run = new_course_key.run
-            display_name = course_ids[2]
-            fields = {'start': start_date, 'end':end_date}
-            if display_name:
-                fields['display_name'] = display_name
-
-            wiki_slug = u"{0}.{1}.{2}".format(org, number, run)
-            definition_data = {'wiki_slug': wiki_slug}
-            fields.update(definition_data)
-
-            source_course_key = CourseKey.from_string(course_ids[0])
-            try:
-                new_course_id = rerun_course(user, source_course_key, org, number, run, fields)
-            except Exception as e:
-                logger.error('NorteamericanoReRun - Error in rerun_course(): {}'.format(str(e)))
-                new_course_id = None
-            course_ids[5] = 'Procesandose'
-            if not new_course_id:
-                course_ids[5] = 'Error en relanzar el curso'
-            new_data.append(course_ids)
-    return new_data
+        data.clear()
+    return [(course_ids, data or None) for course_ids, data in rows]
 
 def validarRut(rut):
     """
@@ -6,9 +6,17 @@ from django.http import HttpResponseRedirect, HttpResponseForbidden, Http404
 from django.shortcuts import render
 from django.urls import reverse
 from django.views.generic.base import View
-from django.http import HttpResponse
-from .utils import file_to_csvreader, validate_course, validate_user, enroll_create_user_with_custom_fields, rerun_courses, HAVE_NA_MODEL
-from .email_tasks import enroll_email
+from django.utils.decorators import method_decorator
+from django.db import transaction
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse
+from django.core.files.storage import default_storage
+from .utils import file_to_csvreader, validate_course, validate_user, stream_enroll_csv, stream_unenroll_csv, rerun_courses, set_courses_dates, HAVE_NA_MODEL
+from .email_tasks import send_enroll_emails
+from .enroll_tasks import create_enroll_job, enroll_csv_task, get_enroll_job, get_enroll_job_status
+from .models import EnrollJob
+from .rerun_tasks import get_queued_reruns
+from .throttling import throttle_response
+from .cache import get_rerun_status_version, rerun_status_not_modified, set_rerun_status_headers, get_cached_rerun_status
 from common.djangoapps.edxmako.shortcuts import render_to_response
 import logging
 import json
@@ -18,9 +26,10 @@ from common.djangoapps.util.json_request import JsonResponse, JsonResponseBadReq
 
 logger = logging.getLogger(__name__)
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class NorteamericanoEnroll(View):
     """
-        Enroll users
+        Enroll users, each chunk of the CSV is committed on its own
     """
     def get(self, request):
         if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
@@ -39,25 +48,28 @@ class NorteamericanoEnroll(View):
         if HAVE_NA_MODEL is False:
             return render_to_response('norteamericanoapi/enroll.html', context)
         if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            throttled = throttle_response(request, 'enroll_csv')
+            if throttled is not None:
+                return throttled
             error_response = self.validate_data(request)
             if len(error_response) > 0:
                 context['result'] = 'error'
                 context['errors'] = error_response
                 return render_to_response('norteamericanoapi/enroll.html', context)
-            csv_reader = file_to_csvreader(request.FILES.get('file').file)
-            csv_data = [x for x in csv_reader]
-            data = enroll_create_user_with_custom_fields(csv_data, request.POST.get('mode'))
-            
             login_url = 'https://{}/login'.format(settings.LMS_BASE)
-            for email in data['emails_data']:
-                enroll_email.delay(email, login_url)
-            response = HttpResponse(content_type='text/csv')
+            if request.POST.get('async', '') == '1':
+                job_id = create_enroll_job(request.user, request.FILES.get('file'), request.POST.get('mode'))
+                enroll_csv_task.delay(job_id, login_url)
+                context['job_id'] = job_id
+                context['url_job_status'] = reverse('norteamericanoapi:enroll-status', kwargs={'job_id': job_id})
+                return render_to_response('norteamericanoapi/enroll.html', context)
+            def send_emails(emails_data):
+                send_enroll_emails(emails_data, login_url)
+            csv_reader = file_to_csvreader(request.FILES.get('file').file)
+            response = StreamingHttpResponse(
+                stream_enroll_csv(csv_reader, request.POST.get('mode'), emails_callback=send_emails),
+                content_type='text/csv')
             response['Content-Disposition'] = 'attachment; filename="enroll_resumen.csv"'
-            writer = csv.writer(
-                response,
-                delimiter=';',
-                dialect='excel')
-            writer.writerows(data['new_data'])
             return response
         else:
             logger.error("NorteamericanoEnroll - User is Anonymous")
@@ -76,6 +88,41 @@ class NorteamericanoEnroll(View):
             logger.error("NorteamericanoEnroll - Wrong Mode, user: {}, mode: {}".format(request.user, request.POST.get('mode')))
         return response
 
+class NorteamericanoEnrollStatus(View):
+    """
+        Get the progress of an asynchronous enroll job
+    """
+    def get(self, request, job_id):
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            job = get_enroll_job(job_id)
+            if job is not None and (job.user_id == request.user.id or request.user.is_staff):
+                response = get_enroll_job_status(job)
+                response['result'] = 'success'
+                response['download_url'] = ''
+                if job.state == EnrollJob.SUCCESS:
+                    response['download_url'] = reverse('norteamericanoapi:enroll-download', kwargs={'job_id': job_id})
+                return JsonResponse(response)
+            logger.error("NorteamericanoEnrollStatus - Job does not exists or user dont have permission, user: {}, job: {}".format(request.user, job_id))
+        else:
+            logger.error("NorteamericanoEnrollStatus - User is Anonymous")
+        raise Http404()
+
+class NorteamericanoEnrollDownload(View):
+    """
+        Download the result CSV of an asynchronous enroll job
+    """
+    def get(self, request, job_id):
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            job = get_enroll_job(job_id)
+            if job is not None and job.state == EnrollJob.SUCCESS and (job.user_id == request.user.id or request.user.is_staff):
+                response = FileResponse(default_storage.open(job.result_file, 'rb'), content_type='text/csv')
+                response['Content-Disposition'] = 'attachment; filename="enroll_resumen.csv"'
+                return response
+            logger.error("NorteamericanoEnrollDownload - Job is not finished or user dont have permission, user: {}, job: {}".format(request.user, job_id))
+        else:
+            logger.error("NorteamericanoEnrollDownload - User is Anonymous")
+        raise Http404()
+
 class NorteamericanoEnrollExport(View):
     """
         Export CSV to enroll users
@@ -96,24 +143,95 @@ class NorteamericanoEnrollExport(View):
             logger.error("NorteamericanoEnrollExport - User is Anonymous")
         raise Http404()
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class NorteamericanoUnenroll(View):
+    """
+        Unenroll users, each chunk of the CSV is committed on its own
+    """
+    def get(self, request):
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            context = {'HAVE_NA_MODEL': HAVE_NA_MODEL}
+            return render_to_response('norteamericanoapi/unenroll.html', context)
+        else:
+            logger.error("NorteamericanoUnenroll - User is Anonymous")
+        raise Http404()
+
+    def post(self, request):
+        """
+            csv file first column is rut
+            [[rut, course_id],...]
+        """
+        context = {'result': 'success', 'HAVE_NA_MODEL': HAVE_NA_MODEL}
+        if HAVE_NA_MODEL is False:
+            return render_to_response('norteamericanoapi/unenroll.html', context)
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            throttled = throttle_response(request, 'unenroll_csv')
+            if throttled is not None:
+                return throttled
+            if request.FILES.get('file', None) is None or not hasattr(request.FILES.get('file'), "file"):
+                logger.error('NorteamericanoUnenroll - Error, request dont have csv file: {}'.format(request.POST))
+                context['result'] = 'error'
+                context['errors'] = {'not_file': True}
+                return render_to_response('norteamericanoapi/unenroll.html', context)
+            csv_reader = file_to_csvreader(request.FILES.get('file').file)
+            response = StreamingHttpResponse(stream_unenroll_csv(csv_reader), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="unenroll_resumen.csv"'
+            return response
+        else:
+            logger.error("NorteamericanoUnenroll - User is Anonymous")
+            raise Http404()
+
+class NorteamericanoUnenrollExport(View):
+    """
+        Export CSV to unenroll users
+    """
+
+    def get(self, request):
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            response = HttpResponse(content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="planilla_unenroll.csv"'
+
+            writer = csv.writer(
+                response,
+                delimiter=';',
+                dialect='excel')
+            writer.writerow(['RUT', 'Id Curso'])
+            return response
+        else:
+            logger.error("NorteamericanoUnenrollExport - User is Anonymous")
+        raise Http404()
+
 class NorteamericanoReRunPendingCourse(View):
     """
         Get pending rerun courses
     """
     def get(self, request):
-        from cms.djangoapps.contentstore.views.course import get_in_process_course_actions
         if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
-            aux = get_in_process_course_actions(request)
-            pending_courses = [ {'new_course_id':str(x.course_key), 'origen_course_id': str(x.source_course_key), 'display_name': x.display_name, 'state': x.state} for x in aux ]
-            response = {'result': 'success', 'courses': pending_courses}
-            return JsonResponse(response)
+            # the courses depend on the access of the user
+            version = get_rerun_status_version()
+            key = 'pending-courses.{}'.format(request.user.id)
+            not_modified = rerun_status_not_modified(request, version, key)
+            if not_modified is not None:
+                return not_modified
+            response = get_cached_rerun_status(version, key, lambda: self.pending_courses(request))
+            return set_rerun_status_headers(JsonResponse(response), version, key)
         else:
             logger.error("NorteamericanoReRunPendingCourse - User is Anonymous")
         raise Http404()
 
+    def pending_courses(self, request):
+        from cms.djangoapps.contentstore.views.course import get_in_process_course_actions
+        aux = get_in_process_course_actions(request)
+        pending_courses = [ {'new_course_id':str(x.course_key), 'origen_course_id': str(x.source_course_key), 'display_name': x.display_name, 'state': x.state} for x in aux ]
+        # only the queued reruns of the user or of the courses the user has access to
+        queued = [x for x in get_queued_reruns() if x.user_id == request.user.id or validate_user(request.user, str(x.source_course_key))]
+        pending_courses.extend([ {'new_course_id':str(x.course_key), 'origen_course_id': str(x.source_course_key), 'display_name': x.display_name, 'state': 'queued', 'position': x.position} for x in queued ])
+        return {'result': 'success', 'courses': pending_courses}
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class NorteamericanoReRun(View):
     """
-        Rerun courses from CSV
+        Rerun courses from CSV, the reruns are queued and started by the scheduler
     """
     def get(self, request):
         if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
@@ -126,6 +244,9 @@ class NorteamericanoReRun(View):
     def post(self, request):
         context = {'result': 'success', 'url_pending_courses': reverse("norteamericanoapi:pending-courses")}
         if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            throttled = throttle_response(request, 'rerun_csv')
+            if throttled is not None:
+                return throttled
             error_response = self.validate_data(request)
             if len(error_response) > 0:
                 context['result'] = 'error'
@@ -153,6 +274,71 @@ class NorteamericanoReRun(View):
             response['not_file'] = True
         return response
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class NorteamericanoCourseDates(View):
+    """
+        Set the start and end dates of the courses from CSV
+    """
+    def get(self, request):
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            return render_to_response('norteamericanoapi/course_dates.html', {})
+        else:
+            logger.error("NorteamericanoCourseDates - User is Anonymous")
+        raise Http404()
+
+    def post(self, request):
+        context = {'result': 'success'}
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            throttled = throttle_response(request, 'course_dates_csv')
+            if throttled is not None:
+                return throttled
+            error_response = self.validate_data(request)
+            if len(error_response) > 0:
+                context['result'] = 'error'
+                context['errors'] = error_response
+                return render_to_response('norteamericanoapi/course_dates.html', context)
+            csv_reader = file_to_csvreader(request.FILES.get('file').file)
+            csv_data = [x for x in csv_reader]
+            data = set_courses_dates(csv_data, request.user)
+            response = HttpResponse(content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="fechas_cursos_resumen.csv"'
+            writer = csv.writer(
+                response,
+                delimiter=';',
+                dialect='excel')
+            writer.writerows(data)
+            return response
+        else:
+            logger.error("NorteamericanoCourseDates - User is Anonymous")
+            raise Http404()
+
+    def validate_data(self, request):
+        response = {}
+        if request.FILES.get('file', None) is None or not hasattr(request.FILES.get('file'), "file"):
+            logger.error('NorteamericanoCourseDates - Error, request dont have csv file: {}'.format(request.FILES))
+            response['not_file'] = True
+        return response
+
+class NorteamericanoCourseDatesExport(View):
+    """
+        Export CSV to set the dates of the courses
+    """
+
+    def get(self, request):
+        if not request.user.is_anonymous and request.user.has_perm('norteamericano_form.na_instructor_staff'):
+            response = HttpResponse(content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="planilla_fechas_cursos.csv"'
+
+            writer = csv.writer(
+                response,
+                delimiter=';',
+                dialect='excel')
+            writer.writerow(['Id curso', 'Fecha de Inicio(UTC)', 'Fecha de Termino(UTC)'])
+            return response
+        else:
+            logger.error("NorteamericanoCourseDatesExport - User is Anonymous")
+        raise Http404()
+
 class NorteamericanoReRunExport(View):
     """
         Export CSV to rerun courses
@@ -21,7 +21,13 @@ setup(
     author="Luis Santana",
     author_email="luis.santana@uchile.cl",
     description=".",
-    packages=['norteamericanoapi'],
+    packages=[
+        'norteamericanoapi',
+        'norteamericanoapi.management',
+        'norteamericanoapi.management.commands',
+        'norteamericanoapi.migrations',
+        'norteamericanoapi.settings',
+    ],
     install_requires=["unidecode>=1.1.1"],
     classifiers=[
         "Programming Language :: Python :: 2",
@@ -32,6 +38,6 @@ setup(
         "cms.djangoapp": ["norteamericanoapi = norteamericanoapi.apps:NorteamericanoAPIConfig"],
         "lms.djangoapp": ["norteamericanoapi = norteamericanoapi.apps:NorteamericanoAPIConfig"]
     },
-    package_data=package_data("norteamericanoapi", ["static", "public"]),
+    package_data=package_data("norteamericanoapi", ["static", "public", "templates"]),
 )
 